@@ -0,0 +1,217 @@
+"""
+Общий HTTP-клиент OpenAI Chat Completions для всех модулей T-Assistant.
+
+Одна requests.Session с пулом keep-alive соединений на пару (ключ, адрес API),
+таймауты на каждый вызов, повторы с экспоненциальной задержкой и случайным
+разбросом (429/5xx/обрыв связи) и ограничение числа одновременных запросов.
+Адрес API задается параметром api_base или переменной OPENAI_API_BASE -
+так модули можно проверять на локальной заглушке (см. benchmark.py).
+"""
+import json
+import os
+import random
+import threading
+import time
+from contextlib import nullcontext
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_API_BASE = "https://api.openai.com/v1"
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class APIError(Exception):
+    def __init__(self, message, status=None, code=None):
+        super().__init__(message)
+        self.status = status
+        self.code = code
+
+
+class AuthenticationError(APIError):
+    pass
+
+
+class RateLimitError(APIError):
+    pass
+
+
+class QuotaExceededError(RateLimitError):
+    pass
+
+
+class InvalidRequestError(APIError):
+    pass
+
+
+class APITimeoutError(APIError):
+    pass
+
+
+def error_from_response(response):
+    """Исключение по HTTP-ответу с ошибкой"""
+    try:
+        error = response.json().get("error", {})
+    except ValueError:
+        error = {}
+    message = error.get("message") or f"HTTP {response.status_code}"
+    code = error.get("code") or error.get("type")
+
+    if response.status_code == 401:
+        return AuthenticationError(message, response.status_code, code)
+    if response.status_code == 429:
+        if code == "insufficient_quota":
+            return QuotaExceededError(message, response.status_code, code)
+        return RateLimitError(message, response.status_code, code)
+    if response.status_code in (400, 404, 422):
+        return InvalidRequestError(message, response.status_code, code)
+    return APIError(message, response.status_code, code)
+
+
+class ChatClient:
+    def __init__(self, api_key, api_base=None, timeout=30.0, connect_timeout=5.0,
+                 max_retries=3, backoff_base=0.5, backoff_cap=8.0,
+                 max_concurrency=4, pool_size=8):
+        self.api_key = api_key
+        self.api_base = (api_base or os.environ.get("OPENAI_API_BASE") or DEFAULT_API_BASE).rstrip("/")
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json"
+        })
+
+        # Не больше max_concurrency запросов к API одновременно
+        self.limiter = threading.BoundedSemaphore(max_concurrency)
+
+        # Счетчики меняются из разных потоков
+        self.stats_lock = threading.Lock()
+        self.requests_sent = 0
+        self.retries = 0
+
+    def backoff_delay(self, attempt, retry_after=None):
+        """Задержка перед повтором: Retry-After от сервера или "full jitter" backoff"""
+        if retry_after is not None:
+            return min(retry_after, self.backoff_cap)
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+
+    def post(self, path, payload, timeout=None, stream=False, max_retries=None, use_limiter=True):
+        """POST к API с повторами; возвращает успешный requests.Response.
+
+        use_limiter=False - слот лимитера уже занял вызывающий (stream_chat
+        держит его, пока читает поток ответа).
+        """
+        url = f"{self.api_base}/{path.lstrip('/')}"
+        read_timeout = timeout or self.timeout
+        if max_retries is None:
+            max_retries = self.max_retries
+
+        attempt = 0
+        while True:
+            error = None
+            retry_after = None
+            try:
+                with self.limiter if use_limiter else nullcontext():
+                    with self.stats_lock:
+                        self.requests_sent += 1
+                    response = self.session.post(
+                        url, data=json.dumps(payload), stream=stream,
+                        timeout=(self.connect_timeout, read_timeout)
+                    )
+                if response.status_code < 400:
+                    return response
+
+                error = error_from_response(response)
+                response.close()
+                if response.status_code not in RETRY_STATUSES or isinstance(error, QuotaExceededError):
+                    raise error
+                try:
+                    retry_after = float(response.headers.get("Retry-After"))
+                except (TypeError, ValueError):
+                    retry_after = None
+            except requests.Timeout as e:
+                error = APITimeoutError(f"Превышено время ожидания API: {e}")
+            except requests.ConnectionError as e:
+                error = APIError(f"Нет соединения с API: {e}")
+
+            if attempt >= max_retries:
+                raise error
+            delay = self.backoff_delay(attempt, retry_after)
+            print(f"[API] {error} - повтор через {delay:.1f}с ({attempt + 1}/{max_retries})")
+            with self.stats_lock:
+                self.retries += 1
+            attempt += 1
+            time.sleep(delay)
+
+    def chat(self, messages, model="gpt-3.5-turbo", timeout=None, max_retries=None, **params):
+        """Ответ модели (текст) на список сообщений"""
+        payload = {"model": model, "messages": messages}
+        payload.update(params)
+        data = self.post("chat/completions", payload, timeout=timeout, max_retries=max_retries).json()
+        return data["choices"][0]["message"]["content"].strip()
+
+    def stream_chat(self, messages, model="gpt-3.5-turbo", timeout=None, cancel_event=None, **params):
+        """Генератор фрагментов ответа модели по мере генерации (stream=True, SSE).
+
+        Если cancel_event установлен, чтение прекращается и соединение
+        закрывается; то же происходит при закрытии генератора. Слот лимитера
+        занят, пока поток ответа не закрыт.
+        """
+        payload = {"model": model, "messages": messages, "stream": True}
+        payload.update(params)
+        self.limiter.acquire()
+        try:
+            response = self.post("chat/completions", payload, timeout=timeout, stream=True, use_limiter=False)
+        except BaseException:
+            self.limiter.release()
+            raise
+        try:
+            # chunk_size=None - отдаем данные сразу, как пришел очередной фрагмент
+            for line in response.iter_lines(chunk_size=None):
+                if cancel_event is not None and cancel_event.is_set():
+                    return
+                if not line.startswith(b"data:"):
+                    continue
+                data = line[5:].strip()
+                if data == b"[DONE]":
+                    return
+                try:
+                    event = json.loads(data)
+                except ValueError as e:
+                    raise APIError(f"Некорректный фрагмент потока: {e}")
+                if "error" in event:
+                    raise APIError(event["error"].get("message", "Ошибка потока"))
+                choices = event.get("choices") or [{}]
+                delta = choices[0].get("delta", {}).get("content")
+                if delta:
+                    yield delta
+        except requests.RequestException as e:
+            raise APIError(f"Поток ответа прерван: {e}")
+        finally:
+            response.close()
+            self.limiter.release()
+
+    def close(self):
+        self.session.close()
+
+
+clients = {}
+clients_lock = threading.Lock()
+
+
+def get_client(api_key, api_base=None, **options):
+    """Общий клиент для пары (ключ, адрес API): модули делят пул соединений"""
+    api_base = (api_base or os.environ.get("OPENAI_API_BASE") or DEFAULT_API_BASE).rstrip("/")
+    with clients_lock:
+        client = clients.get((api_key, api_base))
+        if client is None:
+            client = ChatClient(api_key, api_base, **options)
+            clients[(api_key, api_base)] = client
+        return client
@@ -1,38 +1,298 @@
-import json
 import os
+import copy
+import hashlib
+import threading
 from datetime import datetime
 import uuid
+from persistence import load_json
+from file_store import JsonFileStore
+from purchase_store import PurchaseColumns
 
-USERS_FILE = "users.json"
+USERS_FILE = "users.json"  # старый формат: все пользователи в одном файле
+USERS_DIR = "users"
+USERS_INDEX_FILE = os.path.join(USERS_DIR, "index.json")
+
+# Версия 2: у покупок есть целочисленные *_ts (секунды epoch) рядом со строками дат
+SCHEMA_VERSION = 2
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+PURCHASE_TIME_FIELDS = ("added_at", "cooling_until", "last_notification", "purchased_at")
+
+def to_epoch(value):
+    """Строка даты "%Y-%m-%d %H:%M:%S" -> секунды epoch (или None)"""
+    if not value:
+        return None
+    try:
+        return int(datetime.strptime(value, DATE_FORMAT).timestamp())
+    except (TypeError, ValueError):
+        return None
+
+def stamp_purchase_times(purchase):
+    """Проставляет *_ts по строковым полям дат покупки"""
+    for field in PURCHASE_TIME_FIELDS:
+        purchase[f"{field}_ts"] = to_epoch(purchase.get(field))
+    return purchase
+
+def purchase_timestamp(purchase, field):
+    """Время покупки в секундах epoch; для старых записей парсит строку"""
+    timestamp = purchase.get(f"{field}_ts")
+    if timestamp is None:
+        timestamp = to_epoch(purchase.get(field))
+    return timestamp
+
+def copy_for_update(user):
+    """Копия данных пользователя для modify_user без копирования покупок.
+    
+    Копируются верхний уровень и вложенные словари и списки (профиль,
+    настройки, список покупок), а сами покупки остаются общими с данными
+    в памяти - перед изменением покупку берут через edit_purchases.
+    """
+    return {key: copy.copy(value) if isinstance(value, (dict, list)) else value
+            for key, value in user.items()}
+
+def edit_purchases(user, purchase_ids):
+    """Заменяет покупки с данными id их копиями (copy-on-write): {id: копия}"""
+    wanted = set(purchase_ids)
+    edited = {}
+    purchases = user.get("purchases", [])
+    for i, purchase in enumerate(purchases):
+        purchase_id = purchase.get("id")
+        if purchase_id in wanted and purchase_id not in edited:
+            purchases[i] = edited[purchase_id] = dict(purchase)
+    return edited
 
 class AuthSystem:
     def __init__(self):
         self.current_user = None
-        self.users = self.load_users()
+        # Только подгруженные пользователи; остальные лежат в шардах на диске
+        self.users = {}
+        # Файлы пользователей общие для всех процессов (UI, сканер, уведомления)
+        self.user_stores = {}
+        self.index_store = JsonFileStore(USERS_INDEX_FILE, default={})
+        self.load_index()
+        # Колоночные копии покупок для статистики (строятся по требованию)
+        self.purchase_stores = {}
+        # Подписчики на изменения покупок: callback(username, action, item)
+        self.listeners = []
+        # Счетчик версий данных пользователя - для инвалидации кэшей
+        self.versions = {}
+        # Изменения покупок внутри modify_user (свои у каждого потока):
+        # рассылаются после записи файла
+        self.pending = threading.local()
     
-    def load_users(self):
-        """Загружает пользователей из файла"""
+    @property
+    def user_index(self):
+        """Индекс никнейм -> файл (перечитывается, только если изменился)"""
         try:
-            if os.path.exists(USERS_FILE):
-                with open(USERS_FILE, "r", encoding="utf-8") as f:
-                    return json.load(f)
+            return self.index_store.read()
         except Exception as e:
-            print(f"[ERROR] Ошибка загрузки пользователей: {e}")
-        return {}
+            print(f"[ERROR] Ошибка загрузки индекса пользователей: {e}")
+            return {}
     
-    def save_users(self):
-        """Сохраняет пользователей в файл"""
+    def load_index(self):
+        """Загружает индекс никнеймов (без профилей и покупок)"""
         try:
-            with open(USERS_FILE, "w", encoding="utf-8") as f:
-                json.dump(self.users, f, ensure_ascii=False, indent=2)
-            return True
+            if not os.path.exists(USERS_INDEX_FILE) and os.path.exists(USERS_FILE):
+                self.migrate_legacy_users()
         except Exception as e:
-            print(f"[ERROR] Ошибка сохранения пользователей: {e}")
+            print(f"[ERROR] Ошибка миграции пользователей: {e}")
+        return self.user_index
+    
+    def migrate_legacy_users(self):
+        """Разбивает старый users.json на файлы по пользователям"""
+        legacy_users = load_json(USERS_FILE, {})
+        
+        index = {}
+        for username, data in legacy_users.items():
+            index[username] = self.make_shard_name(username)
+            JsonFileStore(os.path.join(USERS_DIR, index[username])).write(data)
+        
+        self.index_store.write(index)
+        os.replace(USERS_FILE, USERS_FILE + ".bak")
+        print(f"[AUTH] users.json разбит на {len(index)} файлов в '{USERS_DIR}/'")
+    
+    def make_shard_name(self, username):
+        """Имя файла пользователя (никнейм может содержать любые символы)"""
+        return hashlib.sha1(username.encode("utf-8")).hexdigest()[:16] + ".json"
+    
+    def get_user_file(self, username):
+        """Путь к файлу с данными пользователя"""
+        return os.path.join(USERS_DIR, self.make_shard_name(username))
+    
+    def get_user_store(self, username):
+        """Хранилище файла пользователя"""
+        if username not in self.user_stores:
+            self.user_stores[username] = JsonFileStore(self.get_user_file(username))
+        return self.user_stores[username]
+    
+    def load_user(self, username):
+        """Подгружает данные пользователя; перечитывает файл, только если его изменил другой процесс"""
+        if username not in self.user_index:
+            return None
+        
+        store = self.get_user_store(username)
+        if username in self.users and not store.changed():
+            return self.users[username]
+        
+        try:
+            data = store.read()
+        except Exception as e:
+            print(f"[ERROR] Ошибка загрузки пользователя {username}: {e}")
+            return None
+        
+        if data is not None:
+            reloaded = username in self.users
+            self.users[username] = data
+            self.bump_version(username)
+            if data.get("schema_version", 1) < SCHEMA_VERSION:
+                self.migrate_user(username)
+            if reloaded:
+                print(f"[AUTH] Данные {username} изменены другим процессом - перечитаны")
+                self.purchase_stores.pop(username, None)
+                self.notify_purchases_changed(username, "rebuild")
+        return data
+    
+    def migrate_user(self, username):
+        """Переводит данные пользователя на текущую версию схемы"""
+        store = self.get_user_store(username)
+        expected_signature = store.signature
+        user = self.users[username]
+        for purchase in user.get("purchases", []):
+            stamp_purchase_times(purchase)
+        user["schema_version"] = SCHEMA_VERSION
+        # Если другой процесс успел записать файл - он уже мигрировал сам
+        if store.compare_and_swap(expected_signature, user):
+            print(f"[AUTH] Данные {username} переведены на схему v{SCHEMA_VERSION}")
+    
+    def modify_user(self, username, mutate):
+        """Изменяет данные пользователя под блокировкой файла.
+        
+        Перед изменением подтягивает свежую версию с диска, поэтому записи
+        из разных процессов не теряются. mutate(user) получает копию данных
+        (copy_for_update: покупки в ней общие, менять их можно только через
+        edit_purchases) и возвращает результат; если он истинный, копия
+        записывается в файл и только после успешной записи заменяет данные
+        в памяти. Изменения
+        покупок mutate сообщает через defer_change - подписчики узнают о них
+        тоже после записи.
+        """
+        if username not in self.user_index:
             return False
+        
+        store = self.get_user_store(username)
+        changes = []
+        try:
+            with store.lock:
+                current = self.load_user(username)
+                if current is None:
+                    return False
+                user = copy_for_update(current)
+                outer_changes = getattr(self.pending, "changes", None)
+                self.pending.changes = changes
+                try:
+                    result = mutate(user)
+                finally:
+                    self.pending.changes = outer_changes
+                if not result:
+                    return result
+                store.write(user)
+                self.users[username] = user
+                self.bump_version(username)
+        except Exception as e:
+            print(f"[ERROR] Ошибка сохранения пользователя {username}: {e}")
+            return False
+        
+        for action, item in changes:
+            self.notify_purchases_changed(username, action, item)
+        return result
+    
+    def defer_change(self, action, item=None):
+        """Откладывает уведомление об изменении покупок до записи файла (внутри modify_user)"""
+        self.pending.changes.append((action, item))
+    
+    def bump_version(self, username):
+        self.versions[username] = self.versions.get(username, 0) + 1
+    
+    def data_version(self, username):
+        """Версия данных пользователя: меняется при каждом изменении или перечитывании"""
+        self.load_user(username)
+        return self.versions.get(username, 0)
+    
+    def unload_user(self, username):
+        """Выгружает данные пользователя из памяти"""
+        self.users.pop(username, None)
+        self.user_stores.pop(username, None)
+        self.purchase_stores.pop(username, None)
+        self.notify_purchases_changed(username, "unload")
+    
+    def get_purchase_store(self, username):
+        """Колоночное хранилище покупок пользователя для быстрых агрегатов"""
+        if self.load_user(username) is None:
+            return PurchaseColumns()
+        if username not in self.purchase_stores:
+            self.purchase_stores[username] = PurchaseColumns(self.users[username].get("purchases", []))
+        return self.purchase_stores[username]
+    
+    def add_listener(self, callback):
+        """Подписывает callback(username, action, item) на изменения покупок"""
+        self.listeners.append(callback)
+    
+    def notify_purchases_changed(self, username, action, item=None):
+        """Сообщает об изменении покупок: add/update (item - покупка),
+        delete (item - id), rebuild (список заменен целиком), unload"""
+        store = self.purchase_stores.get(username)
+        if store is not None:
+            if action == "add":
+                store.append(item)
+            elif action == "update":
+                store.update(item)
+            elif action == "delete":
+                store.remove(item)
+            elif action == "rebuild":
+                store.rebuild(self.users[username].get("purchases", []))
+        
+        for listener in self.listeners:
+            try:
+                listener(username, action, item)
+            except Exception as e:
+                print(f"[ERROR] Ошибка обработчика изменений покупок: {e}")
+    
+    def load_users(self):
+        """Читает с диска всех пользователей (дорого, только для служебных задач)"""
+        users = {}
+        for username in self.user_index:
+            try:
+                data = load_json(self.get_user_file(username))
+            except Exception as e:
+                print(f"[ERROR] Ошибка загрузки пользователя {username}: {e}")
+                continue
+            if data is not None:
+                users[username] = data
+        return users
+    
+    def save_user(self, username):
+        """Сохраняет данные пользователя, если файл не менял другой процесс"""
+        if username not in self.users:
+            return False
+        store = self.get_user_store(username)
+        try:
+            if store.compare_and_swap(store.signature, self.users[username]):
+                self.bump_version(username)
+                return True
+            print(f"[AUTH] Файл {username} изменен другим процессом - запись отменена")
+        except Exception as e:
+            print(f"[ERROR] Ошибка сохранения пользователя {username}: {e}")
+        return False
+    
+    def save_users(self):
+        """Сохраняет всех подгруженных пользователей"""
+        success = True
+        for username in list(self.users):
+            success = self.save_user(username) and success
+        return success
     
     def create_new_user(self, username):
         """Создает нового пользователя по никнейму"""
-        if username in self.users:
+        if username in self.user_index:
             return False, "Пользователь с таким никнеймом уже существует"
         
         if not username or len(username.strip()) < 2:
@@ -42,7 +302,8 @@ class AuthSystem:
             return False, "Никнейм не должен превышать 20 символов"
         
         # Создаем базовую структуру пользователя без пароля
-        self.users[username] = {
+        user = {
+            "schema_version": SCHEMA_VERSION,
             "created_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
             "last_login": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
             "is_first_time": True,
@@ -72,7 +333,23 @@ class AuthSystem:
             "purchases": []
         }
         
-        self.save_users()
+        def register(index):
+            # Другой процесс мог занять никнейм, пока мы заполняли анкету
+            if username in index:
+                return False
+            self.get_user_store(username).write(user)
+            index[username] = self.make_shard_name(username)
+            return True
+        
+        try:
+            if not self.index_store.update(register):
+                return False, "Пользователь с таким никнеймом уже существует"
+        except Exception as e:
+            print(f"[ERROR] Ошибка создания пользователя: {e}")
+            return False, "Не удалось сохранить пользователя"
+        
+        self.users[username] = user
+        self.bump_version(username)
         return True, "Новый пользователь создан"
     
     def login(self, username):
@@ -80,69 +357,84 @@ class AuthSystem:
         if not username or len(username.strip()) < 2:
             return False, "Введите никнейм"
         
-        if username in self.users:
-            self.users[username]["last_login"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            self.current_user = username
-            self.save_users()
+        def touch_login(user):
+            user["last_login"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            return True
+        
+        if username in self.user_index:
+            if not self.modify_user(username, touch_login):
+                return False, "Не удалось сохранить данные пользователя"
+            self.switch_current_user(username)
             return True, f"Добро пожаловать, {username}!"
         else:
             success, message = self.create_new_user(username)
             if success:
-                self.current_user = username
+                self.switch_current_user(username)
                 return True, f"Новый пользователь {username} создан!"
             else:
                 return False, message
     
+    def switch_current_user(self, username):
+        """Делает пользователя текущим и выгружает остальных из памяти"""
+        for loaded in list(self.users):
+            if loaded != username:
+                self.unload_user(loaded)
+        self.current_user = username
+        self.notify_purchases_changed(username, "rebuild")
+    
     def logout(self):
         """Выход пользователя"""
+        if self.current_user:
+            self.unload_user(self.current_user)
         self.current_user = None
         return True
     
     def is_first_time_user(self, username):
         """Проверяет, является ли пользователь новым (нужно заполнить анкету)"""
-        if username in self.users:
+        if self.load_user(username) is not None:
             return self.users[username].get("is_first_time", True)
         return True
     
     def get_user_data(self, username):
         """Получает данные пользователя"""
-        return self.users.get(username, {}).copy()
+        return (self.load_user(username) or {}).copy()
     
     def update_user_data(self, username, data):
         """Обновляет данные пользователя"""
-        if username in self.users:
+        def apply(user):
             for key, value in data.items():
-                if key in self.users[username]:
-                    if isinstance(self.users[username][key], dict) and isinstance(value, dict):
-                        self.users[username][key].update(value)
+                if key in user:
+                    if isinstance(user[key], dict) and isinstance(value, dict):
+                        user[key].update(value)
                     else:
-                        self.users[username][key] = value
+                        user[key] = value
                 else:
-                    self.users[username][key] = value
+                    user[key] = value
             
-            self.save_users()
+            if "purchases" in data or "notification_settings" in data:
+                self.defer_change("rebuild")
             return True
-        return False
+        
+        return self.modify_user(username, apply)
     
     def complete_first_time_setup(self, username, profile_data):
         """Завершает первоначальную настройку пользователя"""
-        if username in self.users:
-            if "personal_profile" not in self.users[username]:
-                self.users[username]["personal_profile"] = {}
-            
-            self.users[username]["personal_profile"].update(profile_data)
-            self.users[username]["personal_profile"]["filling_completed"] = True
-            self.users[username]["is_first_time"] = False
+        def apply(user):
+            if "personal_profile" not in user:
+                user["personal_profile"] = {}
             
-            self.save_users()
+            user["personal_profile"].update(profile_data)
+            user["personal_profile"]["filling_completed"] = True
+            user["is_first_time"] = False
             return True
-        return False
+        
+        return self.modify_user(username, apply)
     
     def add_purchase(self, username, purchase_data):
         """Добавляет покупку пользователю"""
-        if username in self.users:
-            if "purchases" not in self.users[username]:
-                self.users[username]["purchases"] = []
+        def apply(user):
+            if "purchases" not in user:
+                user["purchases"] = []
             
             if "id" not in purchase_data:
                 purchase_data["id"] = f"item_{int(datetime.now().timestamp())}_{uuid.uuid4().hex[:8]}"
@@ -174,53 +466,63 @@ class AuthSystem:
                 purchase_data["purchased_at"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
                 print(f"[AUTH] Покупка '{purchase_data.get('name')}' сразу куплена (накопления {current_savings} >= {savings_target})")
             
+            stamp_purchase_times(purchase_data)
             print(f"[AUTH] Добавлена покупка: {purchase_data.get('name')}, статус: {purchase_data.get('status')}")
             
-            self.users[username]["purchases"].append(purchase_data)
-            self.save_users()
+            user["purchases"].append(purchase_data)
+            self.defer_change("add", purchase_data)
             return True
-        return False
+        
+        return self.modify_user(username, apply)
     
     def update_purchase(self, username, purchase_id, update_data):
         """Обновляет покупку пользователя с проверкой накоплений"""
-        if username in self.users and "purchases" in self.users[username]:
-            for purchase in self.users[username]["purchases"]:
-                if purchase.get("id") == purchase_id:
-                    # Сохраняем текущие данные
-                    old_status = purchase.get("status", "cooling")
-                    
-                    # Обновляем данные
-                    purchase.update(update_data)
-                    
-                    # Проверяем: если накопления достигли цели - меняем статус
-                    if old_status == "cooling":
-                        current_savings = purchase.get("current_savings", 0)
-                        savings_target = purchase.get("savings_target", purchase.get("price", 0))
-                        
-                        if current_savings >= savings_target:
-                            purchase["status"] = "purchased"
-                            purchase["purchased_at"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                            print(f"[AUTH] Покупка '{purchase.get('name')}' теперь куплена! Накопления: {current_savings}/{savings_target}")
-                    
-                    self.save_users()
-                    return True
-        return False
+        def apply(user):
+            purchase = edit_purchases(user, [purchase_id]).get(purchase_id)
+            if purchase is None:
+                return False
+            
+            # Сохраняем текущие данные
+            old_status = purchase.get("status", "cooling")
+            
+            # Обновляем данные
+            purchase.update(update_data)
+            
+            # Проверяем: если накопления достигли цели - меняем статус
+            if old_status == "cooling":
+                current_savings = purchase.get("current_savings", 0)
+                savings_target = purchase.get("savings_target", purchase.get("price", 0))
+                
+                if current_savings >= savings_target:
+                    purchase["status"] = "purchased"
+                    purchase["purchased_at"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                    print(f"[AUTH] Покупка '{purchase.get('name')}' теперь куплена! Накопления: {current_savings}/{savings_target}")
+            
+            stamp_purchase_times(purchase)
+            self.defer_change("update", purchase)
+            return True
+        
+        return self.modify_user(username, apply)
     
     def delete_purchase(self, username, purchase_id):
         """Удаляет покупку пользователя"""
-        if username in self.users and "purchases" in self.users[username]:
-            initial_length = len(self.users[username]["purchases"])
-            self.users[username]["purchases"] = [
-                p for p in self.users[username]["purchases"] if p.get("id") != purchase_id
+        def apply(user):
+            if "purchases" not in user:
+                return False
+            initial_length = len(user["purchases"])
+            user["purchases"] = [
+                p for p in user["purchases"] if p.get("id") != purchase_id
             ]
-            if len(self.users[username]["purchases"]) < initial_length:
-                self.save_users()
+            if len(user["purchases"]) < initial_length:
+                self.defer_change("delete", purchase_id)
                 return True
-        return False
+            return False
+        
+        return self.modify_user(username, apply)
     
     def get_purchase(self, username, purchase_id):
         """Получает покупку по ID"""
-        if username in self.users and "purchases" in self.users[username]:
+        if self.load_user(username) is not None and "purchases" in self.users[username]:
             for purchase in self.users[username]["purchases"]:
                 if purchase.get("id") == purchase_id:
                     return purchase.copy()
@@ -228,11 +530,14 @@ class AuthSystem:
     
     def mark_purchase_as_purchased(self, username, purchase_id):
         """Помечает покупку как купленную (ручное действие)"""
-        if username in self.users and "purchases" in self.users[username]:
-            for purchase in self.users[username]["purchases"]:
-                if purchase.get("id") == purchase_id:
-                    purchase["status"] = "purchased"
-                    purchase["purchased_at"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                    self.save_users()
-                    return True
-        return False
\ No newline at end of file
+        def apply(user):
+            purchase = edit_purchases(user, [purchase_id]).get(purchase_id)
+            if purchase is None:
+                return False
+            purchase["status"] = "purchased"
+            purchase["purchased_at"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            stamp_purchase_times(purchase)
+            self.defer_change("update", purchase)
+            return True
+        
+        return self.modify_user(username, apply)
\ No newline at end of file
@@ -0,0 +1,1268 @@
+"""
+Замеры производительности T-Assistant.
+
+Запуск:
+    python benchmark.py              # все замеры
+    python benchmark.py persistence  # только выбранный
+"""
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def make_purchases(count):
+    """Синтетическая история покупок в формате AuthSystem"""
+    categories = ["Электроника", "Одежда и обувь", "Бытовая техника", "Дом и ремонт", "Хобби и развлечения"]
+    statuses = ["cooling", "purchased"]
+    purchases = []
+    for i in range(count):
+        price = 500 + (i * 7919) % 150000
+        purchases.append({
+            "id": f"item_{1700000000 + i}_{uuid.uuid4().hex[:8]}",
+            "name": f"Товар №{i}",
+            "price": price,
+            "category": categories[i % len(categories)],
+            "cooling_days": 7,
+            "cooling_until": "2024-01-08 12:00:00",
+            "added_at": "2024-01-01 12:00:00",
+            "status": statuses[i % len(statuses)],
+            "notified": False,
+            "last_notification": None,
+            "current_savings": (i * 31) % price,
+            "savings_target": price,
+            "purchased_at": None
+        })
+    return purchases
+
+
+def timed(func, repeat=3):
+    """Лучшее время из нескольких прогонов, мс"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def bench_persistence():
+    """users.json: stdlib json c indent=2 против persistence.save_json/load_json"""
+    from persistence import ORJSON_AVAILABLE, load_json, save_json
+
+    print(f"Ускоренный кодировщик (orjson): {'да' if ORJSON_AVAILABLE else 'нет'}")
+    print(f"{'покупок':>8} | {'stdlib save':>11} | {'codec save':>10} | {'stdlib load':>11} | {'codec load':>10} | {'размер, КБ':>16}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "users.json")
+        for count in (1000, 10000, 100000):
+            users = {"bench_user": {"personal_profile": {}, "purchases": make_purchases(count)}}
+
+            def stdlib_save():
+                with open(path, "w", encoding="utf-8") as f:
+                    json.dump(users, f, ensure_ascii=False, indent=2)
+
+            def stdlib_load():
+                with open(path, "r", encoding="utf-8") as f:
+                    json.load(f)
+
+            stdlib_save_ms = timed(stdlib_save)
+            stdlib_load_ms = timed(stdlib_load)
+            stdlib_size = os.path.getsize(path) // 1024
+
+            codec_save_ms = timed(lambda: save_json(path, users))
+            codec_load_ms = timed(lambda: load_json(path))
+            codec_size = os.path.getsize(path) // 1024
+            assert load_json(path) == users
+            assert not [name for name in os.listdir(tmp) if name.startswith(".tmp-")]
+
+            print(f"{count:>8} | {stdlib_save_ms:>9.1f}мс | {codec_save_ms:>8.1f}мс | "
+                  f"{stdlib_load_ms:>9.1f}мс | {codec_load_ms:>8.1f}мс | {stdlib_size:>7} -> {codec_size:>6}")
+
+
+def legacy_pending_ids(user_data, now):
+    """Покупки к уведомлению прежним полным перебором check_pending_notifications"""
+    from auth import purchase_timestamp
+
+    settings = user_data.get("notification_settings", {})
+    if not settings.get("enabled", True):
+        return []
+    pending = []
+    for purchase in user_data.get("purchases", []):
+        if purchase.get("status") != "cooling" or purchase.get("purchased", False):
+            continue
+        if purchase["id"] in settings.get("excluded_items", []):
+            continue
+        last_notification = purchase_timestamp(purchase, "last_notification")
+        if last_notification and int((now - last_notification) // 86400) < settings.get("frequency_days", 7):
+            continue
+        if purchase_timestamp(purchase, "cooling_until"):
+            pending.append(purchase["id"])
+    return pending
+
+
+def bench_notifications():
+    """Отметка уведомлений: по одной записи на покупку против mark_many_notified"""
+    import copy
+    from auth import AuthSystem, copy_for_update
+    from notification_manager import NotificationManager
+
+    count, batch = 5000, 50
+    with working_directory():
+        auth = AuthSystem()
+        auth.create_new_user("bench")
+        manager = NotificationManager(auth)
+        auth.update_user_data("bench", {"purchases": make_purchases(count)})
+        auth.switch_current_user("bench")
+        store = auth.get_purchase_store("bench")
+        cooling = store.ids_with_status("cooling")
+
+        single_ms = timed(lambda: [manager.mark_as_notified("bench", purchase_id)
+                                   for purchase_id in cooling[:batch]], repeat=1)
+        bulk_ms = timed(lambda: manager.mark_many_notified("bench", cooling[batch:2 * batch]), repeat=1)
+        assert all(auth.get_purchase("bench", purchase_id)["notified"] for purchase_id in cooling[:2 * batch])
+        # Отмеченные покупки снова в расписании - через frequency_days
+        assert all(("bench", purchase_id) in manager.scheduler.entries for purchase_id in cooling[:2 * batch])
+
+        # Сбой записи: ни расписание, ни колоночное хранилище не видят изменений
+        entries = dict(manager.scheduler.entries)
+        records = list(store.records)
+        user_store = auth.get_user_store("bench")
+
+        def failing_write(data):
+            raise OSError("нет места на диске")
+
+        user_store.write = failing_write
+        assert manager.mark_many_notified("bench", cooling[2 * batch:3 * batch]) == 0
+        del user_store.write
+        assert manager.scheduler.entries == entries
+        assert store.records == records
+        assert not auth.get_purchase("bench", cooling[2 * batch])["notified"]
+        # Колоночное хранилище ссылается на те же покупки, что и данные в памяти
+        assert {id(p) for p in store.records} == {id(p) for p in auth.users["bench"]["purchases"]}
+
+        # Копия для modify_user не копирует покупки
+        user = auth.users["bench"]
+        copy_ms = timed(lambda: copy_for_update(user))
+        deepcopy_ms = timed(lambda: copy.deepcopy(user))
+        assert copy_ms < deepcopy_ms
+
+        # Кнопка «Уведомления»: расписание вместо перебора всех покупок
+        manager.mark_many_notified("bench", cooling[2 * batch:-20])
+        now = time.time()
+        pending = manager.check_pending_notifications("bench", now)
+        assert sorted(n["purchase"]["id"] for n in pending) == sorted(legacy_pending_ids(auth.get_user_data("bench"), now))
+        assert len(pending) == 20
+        # Проверка не извлекает сроки из расписания
+        assert manager.check_pending_notifications("bench", now) == pending
+        scan_ms = timed(lambda: legacy_pending_ids(auth.get_user_data("bench"), now))
+        schedule_ms = timed(lambda: manager.check_pending_notifications("bench", now))
+        assert schedule_ms < scan_ms
+
+        # Разные пользователи из разных потоков: события покупок не теряются и не путаются
+        events = []
+        auth.add_listener(lambda username, action, item: events.append((username, action)))
+        users = ["alice", "bob", "carol", "dave"]
+        for username in users:
+            auth.create_new_user(username)
+
+        def add_many(username):
+            for i in range(25):
+                auth.add_purchase(username, {"name": f"Покупка {i}", "price": 1000, "category": "Хобби и развлечения"})
+
+        threads = [threading.Thread(target=add_many, args=(username,)) for username in users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert sorted(events) == sorted((username, "add") for username in users for _ in range(25))
+
+    assert bulk_ms < single_ms
+    print(f"{count} покупок, отметить {batch}: по одной {single_ms:.0f}мс, одной записью {bulk_ms:.0f}мс; "
+          f"сбой записи не меняет расписание: да")
+    print(f"Копия данных для изменения: deepcopy {deepcopy_ms:.1f}мс, без копии покупок {copy_ms:.2f}мс")
+    print(f"Кнопка «Уведомления», {len(pending)} из {count}: перебор {scan_ms:.1f}мс, расписание {schedule_ms:.2f}мс")
+
+
+class StubAuth:
+    """AuthSystem с одним пользователем в памяти"""
+
+    def __init__(self, user_data):
+        self.current_user = "bench"
+        self.user_data = user_data
+
+    def data_version(self, username):
+        return 1
+
+    def get_user_data(self, username):
+        return self.user_data
+
+
+def legacy_cooling_days(user_data, price, category):
+    """Дни охлаждения прежним расчетом calculate_cooling_period (перебор диапазонов)"""
+    if category in user_data.get("forbidden_categories", []):
+        return 0
+    price_days = 0
+    for period in user_data.get("cooling_periods", []):
+        if period.get("min_price", 0) <= price <= period.get("max_price", 0):
+            price_days = period.get("days", 0)
+            break
+
+    savings_days = 0
+    profile = user_data.get("personal_profile", {})
+    savings_per_month = profile.get("savings_per_month", 0)
+    if user_data.get("consider_savings", True) and savings_per_month > 0:
+        shortage = max(0, price - profile.get("current_savings", 0))
+        if shortage > 0:
+            savings_days = int(shortage / (savings_per_month / 30)) + 1
+    return max(price_days, savings_days)
+
+
+def bench_cooling_policy():
+    """Дни охлаждения: перебор диапазонов на каждый вызов против CoolingPolicy"""
+    import numpy as np
+    from cooling_manager import CoolingManager, CoolingPolicy
+
+    periods = [
+        {"min_price": 0, "max_price": 5000, "days": 1},
+        {"min_price": 5001, "max_price": 20000, "days": 3},
+        {"min_price": 20001, "max_price": 50000, "days": 7},
+        {"min_price": 50001, "max_price": 100000, "days": 14},
+        {"min_price": 100001, "max_price": 200000, "days": 30},
+        {"min_price": 200001, "max_price": 500000, "days": 60},
+        {"min_price": 500001, "max_price": 1000000, "days": 90}
+    ]
+    # Пересекающиеся диапазоны и пропуск между ними: побеждает первый подходящий
+    overlapping = [
+        {"min_price": 10000, "max_price": 60000, "days": 5},
+        {"min_price": 0, "max_price": 20000, "days": 2},
+        {"min_price": 70000, "max_price": 90000, "days": 9}
+    ]
+    prices = list(range(0, 1200000, 997)) + [5000, 5000.5, 5001, 20000, 1000000, 1000001]
+    categories = ["Электроника", "Хобби и развлечения"]
+
+    checked = 0
+    for cooling_periods in (periods, overlapping):
+        for savings_per_month in (0, 15000):
+            user_data = {
+                "forbidden_categories": ["Хобби и развлечения"],
+                "cooling_periods": cooling_periods,
+                "consider_savings": True,
+                "personal_profile": {"current_savings": 20000, "savings_per_month": savings_per_month}
+            }
+            manager = CoolingManager(StubAuth(user_data))
+            policy = CoolingPolicy(user_data)
+            for i, price in enumerate(prices):
+                category = categories[i % 2]
+                assert manager.calculate_cooling_period(price, category)["total_days"] == \
+                    legacy_cooling_days(user_data, price, category), (price, category)
+                assert manager.calculate_savings_based_days(price, user_data) == policy.savings_days(price)
+            many = np.maximum(policy.price_days_many(prices), policy.savings_days_many(prices))
+            assert many.tolist() == [legacy_cooling_days(user_data, price, "Электроника") for price in prices]
+            checked += 2 * len(prices)
+
+    user_data["cooling_periods"] = periods
+    policy = CoolingPolicy(user_data)
+    legacy_ms = timed(lambda: [legacy_cooling_days(user_data, price, "Электроника") for price in prices])
+    policy_ms = timed(lambda: [max(policy.price_days(price), policy.savings_days(price)) for price in prices])
+    many_ms = timed(lambda: np.maximum(policy.price_days_many(prices), policy.savings_days_many(prices)))
+    print(f"Совпадает с прежним расчетом: {checked} проверок")
+    print(f"{len(prices)} цен: перебор {legacy_ms:.1f}мс, CoolingPolicy {policy_ms:.1f}мс, "
+          f"на массиве {many_ms:.2f}мс")
+
+
+def bench_simulation():
+    """Моделирование охлаждения: цикл по покупкам против cooling_simulation"""
+    from cooling_manager import CoolingPolicy
+    from cooling_simulation import simulate_grid, simulate_history
+    from purchase_store import PurchaseColumns
+
+    user_data = {
+        "forbidden_categories": ["Хобби и развлечения"],
+        "cooling_periods": [
+            {"min_price": 0, "max_price": 5000, "days": 1},
+            {"min_price": 5001, "max_price": 20000, "days": 3},
+            {"min_price": 20001, "max_price": 50000, "days": 7},
+            {"min_price": 50001, "max_price": 100000, "days": 14},
+            {"min_price": 100001, "max_price": 1000000, "days": 30}
+        ],
+        "consider_savings": True,
+        "personal_profile": {"current_savings": 20000, "savings_per_month": 15000}
+    }
+    policy = CoolingPolicy(user_data)
+
+    print(f"{'покупок':>8} | {'цикл':>9} | {'NumPy':>8}")
+    for count in (1000, 10000, 100000):
+        purchases = make_purchases(count)
+        store = PurchaseColumns(purchases)
+
+        def loop():
+            total = 0
+            for purchase in purchases:
+                if purchase["category"] in policy.forbidden_categories:
+                    continue
+                price = purchase["price"]
+                total += max(policy.price_days(price), policy.savings_days(price))
+            return total
+
+        assert loop() == simulate_history(policy, store)["summary"]["total_days"]
+        if count == 1000:
+            days = simulate_history(policy, store)["total_days"].tolist()
+            assert days == [legacy_cooling_days(user_data, p["price"], p["category"]) for p in purchases]
+        loop_ms = timed(loop)
+        numpy_ms = timed(lambda: simulate_history(policy, store))
+        print(f"{count:>8} | {loop_ms:>7.1f}мс | {numpy_ms:>6.2f}мс")
+
+    prices = list(range(1000, 201000, 1000))
+    rates = list(range(0, 50500, 500))
+    grid = simulate_grid(policy, prices, rates)["total_days"]
+    assert grid.shape == (len(rates), len(prices))
+    for row in (0, 1, 37, len(rates) - 1):
+        what_if = dict(user_data, personal_profile={"current_savings": 20000, "savings_per_month": rates[row]})
+        assert grid[row].tolist() == [legacy_cooling_days(what_if, price, "Электроника") for price in prices]
+    grid_ms = timed(lambda: simulate_grid(policy, prices, rates))
+    print(f"Сетка {len(rates)}x{len(prices)}: {grid_ms:.2f}мс")
+
+
+def legacy_recommendation_message(kind, price, category, item_name, price_days=0, savings_days=0,
+                                  total_days=0, savings_per_month=0):
+    """Сообщение рекомендации в прежнем формате (до CoolingResult).
+
+    Прежние ветки immediate/default делали .replace(",", " ") по всему тексту
+    и заодно съедали запятые в советах; здесь пробелы ставятся только в цене.
+    """
+    from datetime import datetime, timedelta
+
+    money = f"{price:,} ₽".replace(",", " ")
+
+    if kind == "forbidden":
+        return (f"❌ **Категория '{category}' находится в вашем списке запрещенных покупок**\n\n"
+                "Рекомендуем отказаться от этой покупки. Вы добавили эту категорию в список "
+                "запрещенных, что говорит о желании контролировать подобные траты.")
+    if kind == "immediate":
+        return f"✅ **Анализ завершен: {item_name}**\n\n💰 **Цена:** {money}\n📁 **Категория:** {category}\n\n📊 **Рекомендации:**\n• По цене: можно покупать сразу\n\n💡 **Советы:**\n1. Убедитесь, что товар вам действительно нужен\n2. Проверьте наличие акций и скидок\n3. Сравните цены в других магазинах"
+    if kind == "default":
+        return f"✅ **Анализ: {item_name}**\n\n💰 **Цена:** {money}\n📁 **Категория:** {category}\n\n⏱️ **Рекомендуемый период охлаждения:** 7 дней\n\n💡 **Советы:**\n1. Подождите неделю перед покупкой\n2. Проверьте, действительно ли вам нужен этот товар\n3. Ищите альтернативы и скидки"
+
+    message = f"🎯 **Анализ завершен: {item_name}**\n\n"
+    message += f"💰 **Цена:** {price:,} ₽\n".replace(",", " ")
+    message += f"📁 **Категория:** {category}\n\n"
+    message += f"📊 **Рекомендации:**\n"
+    if price_days > 0:
+        message += f"• По цене: подумайте {price_days} дней\n"
+    if savings_days > 0:
+        message += f"• По накоплениям: потребуется {savings_days} дней\n"
+    message += f"\n⏱️ **Итоговый период охлаждения:** {total_days} дней\n"
+    if total_days > 0:
+        purchase_date = datetime.now() + timedelta(days=total_days)
+        message += f"📅 **Можете купить:** {purchase_date.strftime('%d.%m.%Y')}\n"
+    if savings_per_month > 0:
+        daily_save = savings_per_month / 30
+        days_to_save = int(price / daily_save) + 1
+        message += f"\n💵 **Накопления:**\n"
+        message += f"• При откладывании {int(daily_save):,} ₽/день: {days_to_save} дней\n".replace(",", " ")
+    message += f"\n💡 **Советы:**\n"
+    message += f"1. Используйте это время для поиска альтернатив\n"
+    message += f"2. Проверьте, не появились ли акции\n"
+    message += f"3. Убедитесь, что товар вам действительно нужен\n"
+    message += f"4. Рассмотрите покупку аналогичного товара б/у\n"
+    message += f"5. Сравните цены в разных магазинах\n"
+    return message
+
+
+def legacy_message_lines(message):
+    """Строки окна анализа прежним разбором текста рекомендации по значкам"""
+    headers = ("🎯 **", "✅ **", "❌ **", "💰 **", "📁 **", "📊 **", "⏱️ **", "📅 **", "💵 **", "💡 **")
+    lines = []
+    for line in message.split("\n"):
+        header = next((prefix for prefix in headers if line.startswith(prefix)), None)
+        if header:
+            lines.append(line.replace(header, "").replace("**", ""))
+        elif line.startswith("   • ") or line.startswith("• "):
+            lines.append("    " + (line[4:] if line.startswith("   • ") else line[2:]))
+        elif line.strip():
+            lines.append(line)
+    return lines
+
+
+def bench_recommendation():
+    """Окно рекомендации: прежняя сборка и разбор строки против кэшированных блоков; формат совпадает"""
+    from cooling_manager import CoolingManager
+    from recommendation import build_blocks, render_markdown
+
+    cases = [
+        # (накопления, откладывает в месяц, цена, категория)
+        (20000, 15000, 1500, "Одежда"),
+        (20000, 15000, 4999, "Электроника"),
+        (20000, 15000, 35000, "Электроника"),
+        (0, 9000, 120000, "Техника для дома"),
+        (500000, 0, 75000, "Спорт"),
+        (0, 0, 3000, "Хобби и развлечения"),
+        (1000, 0, 1000, "Книги"),
+    ]
+    checked = 0
+    for current_savings, savings_per_month, price, category in cases:
+        user_data = {
+            "forbidden_categories": ["Хобби и развлечения"],
+            "cooling_periods": [
+                {"min_price": 0, "max_price": 5000, "days": 0},
+                {"min_price": 5001, "max_price": 50000, "days": 7},
+                {"min_price": 50001, "max_price": 1000000, "days": 30}
+            ],
+            "consider_savings": True,
+            "personal_profile": {"current_savings": current_savings, "savings_per_month": savings_per_month}
+        }
+        manager = CoolingManager(StubAuth(user_data))
+        item_name = f"Товар за {price}"
+        result = manager.calculate_cooling_period(price, category, item_name)
+        expected = legacy_recommendation_message(
+            result["kind"], price, category, item_name, result["cooling_days"],
+            result["savings_based_days"], result["total_days"], savings_per_month)
+        assert result["message"] == expected, f"{result['kind']} {price}: {result['message']!r} != {expected!r}"
+        checked += 1
+
+        default = CoolingManager(StubAuth(user_data))
+        default.auth.current_user = None
+        result = default.calculate_cooling_period(price, category, item_name)
+        assert result["message"] == legacy_recommendation_message("default", price, category, item_name)
+        checked += 1
+
+    # Повторный показ той же рекомендации (перерисовка окна, повторный анализ):
+    # расчет охлаждения одинаков в обоих случаях, сравниваем только текст
+    user_data["personal_profile"] = {"current_savings": 20000, "savings_per_month": 15000}
+    result = CoolingManager(StubAuth(user_data)).calculate_cooling_period(35000, "Электроника", "Ноутбук")
+    blocks = result.blocks()
+    arguments = (result["kind"], result["item_name"], result["price"], result["category"],
+                 result["cooling_days"], result["savings_based_days"], result["total_days"],
+                 result.get("purchase_date"), result.get("daily_savings", 0), result.get("days_to_save", 0))
+    legacy = lambda: legacy_message_lines(legacy_recommendation_message(
+        "cooling", 35000, "Электроника", "Ноутбук", result["cooling_days"],
+        result["savings_based_days"], result["total_days"], 15000))
+    ui_lines = [f"    {value}" if style == "bullet" else f"{label} {value}".strip()
+                for style, icon, label, value in blocks]
+    assert ui_lines == legacy()
+
+    legacy_ms = timed(lambda: [legacy() for _ in range(1000)])
+    build_ms = timed(lambda: [build_blocks.__wrapped__(*arguments) for _ in range(1000)])
+    blocks_ms = timed(lambda: [result.blocks() for _ in range(1000)])
+    render_ms = timed(lambda: [render_markdown.__wrapped__(blocks, True) for _ in range(1000)])
+    cached_render_ms = timed(lambda: [render_markdown(blocks, True) for _ in range(1000)])
+    assert blocks_ms < build_ms < legacy_ms
+    assert cached_render_ms < render_ms
+    print(f"Формат совпадает с прежним: {checked} сообщений")
+    print(f"1000 показов окна: строка и разбор {legacy_ms:.1f}мс, сборка блоков {build_ms:.1f}мс, "
+          f"блоки из кэша {blocks_ms:.1f}мс")
+    print(f"1000 текстов Markdown: сборка {render_ms:.1f}мс, из кэша {cached_render_ms:.1f}мс")
+
+
+class StubChatServer:
+    """Локальная заглушка OpenAI Chat Completions API.
+
+    Отвечает на POST .../chat/completions с задержкой delay; ответ строит
+    reply(body) (по умолчанию - фиксированная цена). Первые fail_first
+    запросов получают 429 с Retry-After: 0. Запрос со "stream": true
+    получает ответ потоком SSE по словам, по token_delay секунд на слово
+    (без потока ответ отдается целиком после той же задержки). Каждое новое
+    соединение стоит connect_delay секунд (как TLS-рукопожатие у настоящего API).
+    Считает соединения, запросы и наибольшее число одновременно обрабатываемых
+    (запрос активен, пока ответ - и поток тоже - не отправлен целиком).
+    """
+
+    def __init__(self, reply=None, delay=0.0, fail_first=0, token_delay=0.0, connect_delay=0.0):
+        self.reply = reply or (lambda body: "12990")
+        self.delay = delay
+        self.fail_first = fail_first
+        self.token_delay = token_delay
+        self.connect_delay = connect_delay
+        self.connections = 0
+        self.calls = 0
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # keep-alive, как у настоящего API
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def setup(self):
+                super().setup()
+                with stub.lock:
+                    stub.connections += 1
+                time.sleep(stub.connect_delay)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                with stub.lock:
+                    stub.calls += 1
+                    failing = stub.calls <= stub.fail_first
+                    stub.active += 1
+                    stub.max_active = max(stub.max_active, stub.active)
+                try:
+                    self.respond(body, failing)
+                finally:
+                    with stub.lock:
+                        stub.active -= 1
+
+            def respond(self, body, failing):
+                time.sleep(stub.delay)
+                if failing:
+                    payload = json.dumps({"error": {"message": "Rate limit reached", "type": "requests"}}).encode("utf-8")
+                    self.send_response(429)
+                    self.send_header("Retry-After", "0")
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(payload)))
+                    self.end_headers()
+                    self.wfile.write(payload)
+                    return
+
+                text = stub.reply(body)
+                if body.get("stream"):
+                    self.stream_reply(text)
+                    return
+                # Без потока ответ приходит, когда сгенерированы все слова
+                time.sleep(stub.token_delay * len(text.split()))
+
+                payload = json.dumps({
+                    "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": body.get("model", "stub"),
+                    "choices": [{
+                        "index": 0,
+                        "message": {"role": "assistant", "content": text},
+                        "finish_reason": "stop"
+                    }],
+                    "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+                }).encode("utf-8")
+
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def stream_reply(self, text):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                try:
+                    for word in re.findall(r"\S+\s*", text):
+                        time.sleep(stub.token_delay)
+                        event = {"choices": [{"index": 0, "delta": {"content": word}}]}
+                        self.send_chunk(f"data: {json.dumps(event, ensure_ascii=False)}\n\n")
+                    self.send_chunk("data: [DONE]\n\n")
+                    self.wfile.write(b"0\r\n\r\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    # Клиент отменил ответ и закрыл соединение
+                    self.close_connection = True
+
+            def send_chunk(self, text):
+                data = text.encode("utf-8")
+                self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/v1"
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@contextmanager
+def working_directory():
+    """Временная рабочая папка (кэши модулей пишутся в текущую директорию)"""
+    previous = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            yield tmp
+        finally:
+            os.chdir(previous)
+
+
+def bench_price_async():
+    """estimate_price блокирует поток на время запроса, estimate_price_async - нет"""
+    from price_estimator import OpenAIPriceEstimator
+
+    with working_directory(), StubChatServer(delay=0.5) as stub:
+        estimator = OpenAIPriceEstimator("stub-key", api_base=stub.url)
+
+        start = time.perf_counter()
+        estimator.estimate_price("Наушники Sony WH-1000XM5", "Электроника", "Новая")
+        sync_ms = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        quick_price, future = estimator.estimate_price_async("Пылесос Dyson V15", "Бытовая техника", "Новая")
+        quick_ms = (time.perf_counter() - start) * 1000
+        final_price = future.result(timeout=10)
+        final_ms = (time.perf_counter() - start) * 1000
+
+        # Ответ модели сохранен в кэш: повторная оценка готова сразу и без запроса
+        cached_price, cached_future = estimator.estimate_price_async("Пылесос Dyson V15", "Бытовая техника", "Новая")
+        assert cached_future.done() and cached_price == final_price == cached_future.result()
+        estimator.shutdown()
+
+    assert sync_ms >= 500 and quick_ms < 100 and final_ms >= 500
+    assert stub.calls == 2
+
+    print(f"estimate_price (блокирующий): {sync_ms:.1f}мс")
+    print(f"estimate_price_async: быстрая цена {quick_price} ₽ за {quick_ms:.2f}мс, "
+          f"ответ модели {final_price} ₽ через {final_ms:.1f}мс")
+
+
+def bench_price_single_flight():
+    """Всплеск одинаковых запросов цены: сколько раз вызывается API"""
+    from price_estimator import OpenAIPriceEstimator
+
+    burst = 20
+    with working_directory(), StubChatServer(delay=0.3) as stub:
+        estimator = OpenAIPriceEstimator("stub-key", api_base=stub.url)
+        barrier = threading.Barrier(burst)
+        prices = []
+
+        def lookup():
+            barrier.wait()
+            prices.append(estimator.estimate_price("iPhone 15 Pro", "Электроника", "Новая"))
+
+        threads = [threading.Thread(target=lookup) for _ in range(burst)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        estimator.shutdown()
+
+    assert stub.calls == 1
+    assert len(prices) == burst and len(set(prices)) == 1
+    assert not estimator.inflight
+    print(f"Одновременных запросов: {burst}, обращений к API: {stub.calls}, "
+          f"разных ответов: {len(set(prices))}, время: {elapsed_ms:.1f}мс")
+
+
+def stub_price_reply(body):
+    """Ответ заглушки: JSON-массив для пакетного запроса, иначе одно число"""
+    content = body["messages"][-1]["content"]
+    if "JSON" in content:
+        count = len(re.findall(r"^\s*\d+\. ", content.split("Товары", 1)[1], re.M))
+        return json.dumps([9990 + i * 1000 for i in range(count)])
+    return "12990"
+
+
+def bench_price_batch():
+    """Корзина из 20 товаров: по одному запросу на товар против estimate_prices"""
+    from price_estimator import OpenAIPriceEstimator
+
+    categories = ["Электроника", "Одежда и обувь", "Бытовая техника", "Дом и ремонт"]
+    items = [(f"Товар №{i}", categories[i % len(categories)], "Новая") for i in range(20)]
+
+    with working_directory(), StubChatServer(reply=stub_price_reply, delay=0.2) as stub:
+        estimator = OpenAIPriceEstimator("stub-key", api_base=stub.url)
+        start = time.perf_counter()
+        single_prices = [estimator.estimate_price(*item) for item in items]
+        single_ms = (time.perf_counter() - start) * 1000
+        single_calls = stub.calls
+        estimator.shutdown()
+
+    with working_directory(), StubChatServer(reply=stub_price_reply, delay=0.2) as stub:
+        estimator = OpenAIPriceEstimator("stub-key", api_base=stub.url)
+        start = time.perf_counter()
+        batch_prices = estimator.estimate_prices(items)
+        batch_ms = (time.perf_counter() - start) * 1000
+        batch_calls = stub.calls
+
+        # Повтор корзины целиком из кэша
+        assert estimator.estimate_prices(items) == batch_prices and stub.calls == batch_calls
+        estimator.shutdown()
+
+    assert single_calls == len(items) and batch_calls == 1
+    assert len(batch_prices) == len(items) and all(batch_prices)
+    assert len(set(batch_prices)) == len(items) and len(set(single_prices)) == 1
+    print(f"По одному: {single_calls} запросов, {single_ms:.0f}мс")
+    print(f"Пакетом:   {batch_calls} запросов, {batch_ms:.0f}мс")
+
+
+def bench_price_cache():
+    """Кэш цен: перезапись всего price_cache.json на каждую оценку против LRU с отложенной записью"""
+    from cache_store import PersistentLRUCache
+    from price_estimator import OpenAIPriceEstimator
+
+    prefill, writes = 5000, 200
+    with working_directory():
+        estimator = OpenAIPriceEstimator("dummy_key", cache_capacity=prefill + writes)
+        for i in range(prefill):
+            estimator.save_to_cache(f"Товар №{i}", "Электроника", "Новая", 1000 + i, "fallback")
+        estimator.save_cache()
+        legacy = dict(estimator.price_cache.items())
+
+        def legacy_writes():
+            for i in range(writes):
+                legacy[f"new_{i}"] = {"price": i, "timestamp": "2024-01-01T00:00:00"}
+                with open("legacy_cache.json", "w", encoding="utf-8") as f:
+                    json.dump(legacy, f, ensure_ascii=False, indent=2)
+
+        def write_behind():
+            for i in range(writes):
+                estimator.save_to_cache(f"Новый товар №{i}", "Электроника", "Новая", 1000 + i, "fallback")
+            estimator.save_cache()
+
+        legacy_ms = timed(legacy_writes, repeat=1)
+        lru_ms = timed(write_behind, repeat=1)
+
+        for i in range(prefill):
+            estimator.get_cached_price(f"Товар №{i % 100}", "Электроника", "Новая")
+        stats = estimator.cache_stats()
+        estimator.shutdown()
+
+        # Отложенная запись ничего не теряет: на диске все записи
+        reloaded = PersistentLRUCache(estimator.price_cache.path, capacity=prefill + writes)
+        assert len(reloaded) == prefill + writes
+        assert reloaded.get(estimator.get_cache_key(f"Новый товар №{writes - 1}", "Электроника", "Новая"))["price"] == 1000 + writes - 1
+        reloaded.close()
+
+        # Вытеснение давно не использованных записей
+        small = PersistentLRUCache("small_cache.json", capacity=10, flush_interval=None)
+        for i in range(20):
+            small[f"key_{i}"] = i
+            small.get("key_0")
+        assert len(small) == 10 and "key_0" in small and "key_1" not in small
+        assert small.stats()["evictions"] == 10
+        small.close()
+
+    assert stats["hits"] == prefill and stats["misses"] == 0 and stats["evictions"] == 0
+    assert lru_ms < legacy_ms
+
+    print(f"{writes} новых оценок при {prefill} записях в кэше: "
+          f"запись на каждую {legacy_ms:.0f}мс, отложенная запись {lru_ms:.1f}мс")
+    print(f"Статистика кэша: {stats}")
+
+
+def bench_price_matching():
+    """Попадания в кэш цен для разных написаний одного товара: точный ключ против ItemIndex"""
+    from price_estimator import OpenAIPriceEstimator
+
+    products = [
+        ("iPhone 15 Pro 256GB", ["Apple iPhone 15 Pro (256 ГБ)", "Айфон 15 Pro 256 гб", "iphone 15 pro 256 gb новый"]),
+        ("Samsung Galaxy S24 Ultra 512 ГБ", ["Galaxy S24 Ultra 512GB", "Самсунг Галакси S24 Ultra 512гб",
+                                            "Samsung Galaxy S24 Ultra (512 GB) черный"]),
+        ("Наушники Sony WH-1000XM5", ["Sony WH-1000XM5 наушники", "Наушники Сони WH-1000XM5", "SONY WH 1000XM5"]),
+        ("Пылесос Dyson V15 Detect", ["Dyson V15 Detect пылесос", "Пылесос Дайсон V15 Detect", "Пылесос Dyson V15 Detect (новый)"]),
+        ("Кроссовки Nike Air Max 90", ["Nike Air Max 90 кроссовки", "Кроссовки Найк Air Max 90", "кроссовки nike air-max 90"]),
+        ("Xiaomi Redmi Note 13 Pro 8/256", ["Redmi Note 13 Pro 8/256", "Сяоми Редми Note 13 Pro 8/256",
+                                            "Xiaomi Redmi Note 13 Pro (8/256)"]),
+    ]
+    # Разные модели не должны совпадать
+    different = ["iPhone 14 Pro 256GB", "iPhone 15 Pro 128GB", "Чехол iPhone 15 Pro 256GB",
+                 "Galaxy S23 Ultra 512GB", "Пылесос Dyson V12 Detect"]
+
+    with working_directory():
+        estimator = OpenAIPriceEstimator("dummy_key")
+        for i in range(5000):
+            estimator.save_to_cache(f"Товар {i} модель {i * 7}", "Электроника", "Новая", 1000 + i, "fallback")
+        for i, (name, _) in enumerate(products):
+            estimator.save_to_cache(name, "Электроника", "Новая", 50000 + i, "openai")
+
+        queries = [variant for _, variants in products for variant in variants]
+        exact_hits = sum(estimator.get_cache_key(q, "Электроника", "Новая") in estimator.price_cache for q in queries)
+        fuzzy_hits = 0
+        for i, (_, variants) in enumerate(products):
+            for variant in variants:
+                cached, _ = estimator.find_cached(variant, "Электроника", "Новая")
+                if cached is not None:
+                    # Похожее название находит свой товар, а не соседний
+                    assert cached["price"] == 50000 + i, (variant, cached["item_name"])
+                    fuzzy_hits += 1
+        false_hits = sum(estimator.find_cached(q, "Электроника", "Новая")[0] is not None for q in different)
+        lookup_ms = timed(lambda: [estimator.find_cached(q, "Электроника", "Новая") for q in queries]) / len(queries)
+        estimator.shutdown()
+
+    assert false_hits == 0
+    assert fuzzy_hits >= len(queries) - 1 and fuzzy_hits > exact_hits
+
+    print(f"Вариантов написания: {len(queries)}; попаданий по точному ключу: {exact_hits}, "
+          f"с нормализацией и индексом: {fuzzy_hits}")
+    print(f"Ложных совпадений на {len(different)} других моделях: {false_hits}; "
+          f"поиск при 5000 записях: {lookup_ms:.3f}мс")
+
+
+def make_priced_items(count, seed=0):
+    """Синтетические товары с "рыночной" ценой, зависящей от типа, бренда и модели"""
+    import random
+
+    rng = random.Random(seed)
+    brands = {"Apple": 3.0, "Samsung": 2.0, "Xiaomi": 0.8, "Sony": 1.8, "Huawei": 1.0, "Bosch": 1.5, "Polaris": 0.6}
+    kinds = {"Смартфон": 40000, "Наушники": 8000, "Ноутбук": 70000, "Пылесос": 20000, "Часы": 15000, "Планшет": 35000}
+    items = []
+    for _ in range(count):
+        brand = rng.choice(list(brands))
+        kind = rng.choice(list(kinds))
+        model = rng.randint(1, 30)
+        price = brands[brand] * kinds[kind] * (1 + model / 60) * rng.uniform(0.9, 1.1)
+        items.append((f"{kind} {brand} X{model}", "Электроника", "Новая", int(price)))
+    return items
+
+
+def bench_local_model():
+    """Локальная модель цены: сколько запросов к API она экономит и насколько точна"""
+    import math
+    from price_estimator import OpenAIPriceEstimator
+
+    history = make_priced_items(3000, seed=1)
+    known = {item[0] for item in history}
+    # Только товары, которых нет в кэше
+    new_items = [item for item in make_priced_items(2000, seed=2) if item[0] not in known][:200]
+    truth = {name: price for name, _, _, price in history + new_items}
+
+    def reply(body):
+        content = body["messages"][-1]["content"]
+        name = re.search(r"Товар: (.+)", content).group(1).strip()
+        return str(truth[name])
+
+    with working_directory(), StubChatServer(reply=reply) as stub:
+        estimator = OpenAIPriceEstimator("stub-key", api_base=stub.url)
+        for name, category, condition, price in history:
+            estimator.save_to_cache(name, category, condition, price, "openai")
+
+        # Первый запуск: файла модели нет - обучение на всем кэше (так было при каждом запуске)
+        start = time.perf_counter()
+        estimator.local_model = estimator.load_local_model()
+        fit_ms = (time.perf_counter() - start) * 1000
+        estimator.save_local_model()
+
+        # Следующие запуски: состояние читается из файла, новых ответов в кэше нет
+        start = time.perf_counter()
+        restored = estimator.load_local_model()
+        load_ms = (time.perf_counter() - start) * 1000
+        assert restored.samples == estimator.local_model.samples
+        assert all(restored.predict(*item[:3]) == estimator.local_model.predict(*item[:3]) for item in new_items)
+
+        # Новый ответ в кэше после сохранения - при запуске модель доучивается только на нем
+        name, category, condition, price = new_items[0]
+        estimator.price_cache["late"] = {"price": price, "category": category, "item_name": name,
+                                         "condition": condition, "source": "openai",
+                                         "timestamp": "9999-01-01T00:00:00"}
+        assert estimator.load_local_model().samples == estimator.local_model.samples + 1
+        estimator.price_cache.pop("late")
+
+        predict_us = timed(lambda: [estimator.local_model.predict(*item[:3]) for item in new_items]) * 1000 / len(new_items)
+
+        errors = []
+        for name, category, condition, price in new_items:
+            estimate = estimator.estimate_price(name, category, condition)
+            errors.append(abs(math.log(estimate / price)))
+        estimator.shutdown()
+
+    errors.sort()
+    assert stub.calls < len(new_items) // 2
+    assert math.expm1(errors[len(errors) // 2]) < 0.15
+    print(f"Запуск модели: обучение на {len(history)} ответах {fit_ms:.0f}мс, "
+          f"загрузка сохраненной {load_ms:.0f}мс; прогноз: {predict_us:.0f}мкс")
+    print(f"Новых товаров: {len(new_items)}, запросов к API: {stub.calls}; "
+          f"медианная ошибка цены: {math.expm1(errors[len(errors) // 2]) * 100:.1f}%")
+
+
+def bench_fallback():
+    """Запасная оценка цены для большого списка товаров"""
+    from pricing_rules import PricingRules
+
+    rules = PricingRules()
+    purchases = make_purchases(100000)
+    names = [purchase["name"] + (" Xiaomi" if i % 3 == 0 else " Apple" if i % 5 == 0 else "")
+             for i, purchase in enumerate(purchases)]
+    categories = [purchase["category"] for purchase in purchases]
+
+    expected = [rules.fallback_estimate(name, category) for name, category in zip(names, categories)]
+    assert rules.fallback_estimate_many(names, categories).tolist() == expected
+    many_ms = timed(lambda: rules.fallback_estimate_many(names, categories))
+    print(f"{len(names)} товаров: fallback_estimate_many {many_ms:.0f}мс "
+          f"({many_ms * 1000 / len(names):.2f}мкс на товар)")
+
+
+def bench_api_client():
+    """Общий клиент API: новое соединение на запрос против пула, повторы после 429, лимит параллельности"""
+    import requests
+    from api_client import APIError, ChatClient
+
+    messages = [{"role": "user", "content": "Цена iPhone 15 Pro?"}]
+    count = 50
+    # 10мс на соединение - скромная оценка TLS-рукопожатия с api.openai.com
+    with StubChatServer(connect_delay=0.01) as stub:
+        def without_pool():
+            for _ in range(count):
+                requests.post(f"{stub.url}/chat/completions", json={"messages": messages}, timeout=5).json()
+
+        plain_ms = timed(without_pool, repeat=1)
+        plain_connections = stub.connections
+
+        client = ChatClient("stub-key", stub.url)
+        pooled_ms = timed(lambda: [client.chat(messages) for _ in range(count)], repeat=1)
+        pooled_connections = stub.connections - plain_connections
+        client.close()
+    assert plain_connections == count
+    assert pooled_connections == 1
+    assert pooled_ms < plain_ms
+    print(f"{count} запросов: requests.post {plain_ms:.0f}мс ({plain_connections} соединений), "
+          f"ChatClient (keep-alive) {pooled_ms:.0f}мс ({pooled_connections} соединение)")
+
+    with StubChatServer(fail_first=2) as stub:
+        client = ChatClient("stub-key", stub.url)
+        answer = client.chat(messages)
+        client.close()
+    assert answer == "12990" and stub.calls == 3 and client.retries == 2
+    print(f"Два ответа 429 подряд: ответ {answer!r}, запросов {stub.calls}, повторов {client.retries}")
+
+    with StubChatServer(delay=0.1) as stub:
+        client = ChatClient("stub-key", stub.url, max_concurrency=4)
+        threads = [threading.Thread(target=client.chat, args=(messages,)) for _ in range(16)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        client.close()
+    assert stub.max_active <= 4 and stub.calls == 16 and client.requests_sent == 16
+    print(f"16 потоков при max_concurrency=4: одновременно на сервере не больше {stub.max_active}")
+
+    # Поток ответа занимает слот лимитера, пока не дочитан
+    with StubChatServer(reply=lambda body: "слово " * 10, token_delay=0.01) as stub:
+        client = ChatClient("stub-key", stub.url, max_concurrency=2)
+        threads = [threading.Thread(target=lambda: list(client.stream_chat(messages))) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        client.close()
+    assert stub.max_active <= 2 and stub.calls == 6
+    print(f"6 потоков ответа при max_concurrency=2: одновременно на сервере не больше {stub.max_active}")
+
+    with StubChatServer(reply=lambda body: "слово " * 3) as stub:
+        client = ChatClient("stub-key", stub.url, max_concurrency=1)
+        stream = client.stream_chat(messages)
+        next(stream)
+        stream.close()
+        # Слот освобожден: следующий запрос не ждет
+        assert client.limiter.acquire(timeout=1)
+        client.limiter.release()
+        client.close()
+
+    class BrokenStream:
+        def iter_lines(self, chunk_size=None):
+            yield b"data: {not json"
+
+        def close(self):
+            pass
+
+    client = ChatClient("stub-key", "http://127.0.0.1:9")
+    client.post = lambda *args, **kwargs: BrokenStream()
+    try:
+        list(client.stream_chat(messages))
+        raise AssertionError("некорректный фрагмент потока не вызвал APIError")
+    except APIError as e:
+        print(f"Некорректный фрагмент потока: APIError({e})")
+    client.close()
+
+
+def bench_assistant_cache():
+    """Частые вопросы помощнику: каждый раз к API против кэша ответов"""
+    from openai_assistant import OpenAIAssistant, COMMON_QUESTIONS
+
+    rounds = 3
+    with working_directory(), StubChatServer(reply=lambda body: "Совет", delay=0.2) as stub:
+        assistant = OpenAIAssistant("sk-stub-key", api_base=stub.url)
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for question in COMMON_QUESTIONS:
+                assistant.generate_response("user", question)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        assistant.response_cache.flush()
+        size = os.path.getsize("assistant_cache.json")
+        first_round_calls = stub.calls
+
+        # После перезапуска ответы берутся с диска
+        restarted = OpenAIAssistant("sk-stub-key", api_base=stub.url)
+        for question in COMMON_QUESTIONS:
+            assert restarted.generate_response("other", question) == "Совет"
+        restarted_calls = stub.calls - first_round_calls
+
+    asked = rounds * len(COMMON_QUESTIONS)
+    assert first_round_calls == len(COMMON_QUESTIONS)
+    assert restarted_calls == 0
+    print(f"{asked} вопросов: без кэша {asked} запросов к API, с кэшем {first_round_calls}; "
+          f"время {elapsed_ms:.0f}мс, файл кэша {size} байт")
+
+
+def bench_chat_stream():
+    """Ответ помощника целиком против потока: через сколько пользователь видит текст"""
+    from openai_assistant import OpenAIAssistant
+
+    answer = " ".join(["Откладывайте"] + ["часть дохода каждый месяц"] * 40)
+    question = "Как накопить на квартиру за три года?"
+    with working_directory(), StubChatServer(reply=lambda body: answer, token_delay=0.01) as stub:
+        assistant = OpenAIAssistant("sk-stub-key", api_base=stub.url)
+        assistant.response_cache.capacity = 0
+
+        start = time.perf_counter()
+        assistant.generate_response("full", question)
+        full_ms = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        first_ms = None
+        chunks = []
+        for chunk in assistant.stream_response("stream", question):
+            if first_ms is None:
+                first_ms = (time.perf_counter() - start) * 1000
+            chunks.append(chunk)
+        stream_ms = (time.perf_counter() - start) * 1000
+        streamed = assistant.conversation_history["stream"]
+        assert len(chunks) > 1
+        assert [msg["role"] for msg in streamed] == ["user", "assistant"]
+        assert streamed[1]["content"] == assistant.conversation_history["full"][1]["content"]
+
+        cancel_event = threading.Event()
+        received = 0
+        for _ in assistant.stream_response("cancel", question, cancel_event):
+            received += 1
+            if received == 5:
+                cancel_event.set()
+        cancelled_history = len(assistant.conversation_history["cancel"])
+
+    assert first_ms < full_ms / 10
+    assert received == 5 and cancelled_history == 0
+    print(f"generate_response: ответ через {full_ms:.0f}мс")
+    print(f"stream_response: первый фрагмент через {first_ms:.0f}мс, весь ответ через {stream_ms:.0f}мс")
+    print(f"Отмена после 5 фрагментов: получено {received}, записей в истории {cancelled_history}")
+
+
+def bench_chat_context():
+    """Контекст пользователя для каждого хода чата: пересборка против кэша по версии данных"""
+    from auth import AuthSystem
+    from openai_assistant import OpenAIAssistant
+
+    turns = 200
+    with working_directory():
+        auth = AuthSystem()
+        auth.create_new_user("bench")
+        auth.update_user_data("bench", {"purchases": make_purchases(20000),
+                                        "personal_profile": {"monthly_income": 120000}})
+        assistant = OpenAIAssistant("sk-stub-key", auth)
+
+        def rebuild():
+            for _ in range(turns):
+                assistant.get_user_context("bench")
+
+        def cached():
+            for _ in range(turns):
+                assistant.get_system_prompt("bench")
+
+        rebuild_ms = timed(rebuild)
+        cached_ms = timed(cached)
+        before = assistant.get_system_prompt("bench")[1]
+        auth.add_purchase("bench", {"name": "Пылесос", "price": 30000, "category": "Бытовая техника"})
+        prompt, after = assistant.get_system_prompt("bench")
+        # Кэш отдает тот же промпт, что и полная пересборка
+        assert assistant.get_user_context("bench") in prompt
+
+    assert before != after
+    assert cached_ms < rebuild_ms
+    print(f"20000 покупок, {turns} ходов: пересборка {rebuild_ms:.1f}мс, "
+          f"кэш по версии {cached_ms:.1f}мс; после новой покупки контекст обновлен: {before != after}")
+
+
+def bench_chat_memory():
+    """Токены промпта в длинном диалоге: последние 20 реплик дословно против бюджета со сводкой"""
+    from chat_memory import count_message_tokens
+    from openai_assistant import OpenAIAssistant
+
+    long_answer = " ".join(["Откладывайте фиксированную часть дохода на отдельный накопительный счет."] * 30)
+
+    def reply(body):
+        if "Сожми разговор" in body["messages"][0]["content"]:
+            return "- Пользователь копит на квартиру, откладывает 20 000 ₽ в месяц."
+        return long_answer
+
+    turns = 30
+    with working_directory(), StubChatServer(reply=reply) as stub:
+        assistant = OpenAIAssistant("sk-stub-key", api_base=stub.url)
+        old_history = []
+        old_tokens = []
+        for turn in range(turns):
+            question = f"Как накопить на квартиру быстрее, вариант {turn}?"
+            system = [{"role": "system", "content": assistant.system_prompt}]
+            current = [{"role": "user", "content": question}]
+            old_tokens.append(count_message_tokens(system + old_history[-20:] + current))
+            old_history += current + [{"role": "assistant", "content": long_answer[:1500] + "..."}]
+            assistant.generate_response("user", question)
+        assistant.wait_for_summaries()
+        metrics = assistant.get_prompt_metrics("user")
+        api_calls = stub.calls
+        summary = assistant.conversation_summaries["user"]
+
+        # Вопрос больше потолка промпта не уходит в API
+        answer = assistant.generate_response("user", "Сколько откладывать на квартиру? " * 1000)
+        assert "слишком длинное" in answer and stub.calls == api_calls
+
+        # Тестовый режим (без ключа): счетчики токенов и статистика тоже доступны
+        offline = OpenAIAssistant("")
+        assert offline.test_mode and offline.get_token_count("guest") == 0
+        assert offline.get_prompt_metrics("guest")["turns"] == 0 and "hit_rate" in offline.response_cache_stats()
+
+    summary_calls = api_calls - turns
+    assert metrics["max"] <= assistant.max_prompt_tokens
+    assert summary.startswith("- Пользователь копит на квартиру")
+    print(f"{turns} ходов, старая история: в среднем {sum(old_tokens) / turns:.0f}, максимум {max(old_tokens)} токенов")
+    print(f"{turns} ходов, бюджет+сводка: в среднем {metrics['average']:.0f}, максимум {metrics['max']} токенов "
+          f"(потолок {assistant.max_prompt_tokens}); запросов к API {api_calls}, из них сводок в фоне {summary_calls}")
+
+
+def bench_chat_store():
+    """Открытие журнала чата: чтение всего файла против хвоста с конца"""
+    from chat_store import ChatLog
+    from persistence import loads
+
+    with working_directory():
+        for count in (1000, 100000):
+            path = f"chats/log_{count}.jsonl"
+            log = ChatLog(path, compact_bytes=float("inf"))
+            for i in range(count):
+                log.append("user" if i % 2 == 0 else "assistant", f"Сообщение №{i}: как накопить на покупку?")
+
+            def read_all():
+                with open(path, "rb") as f:
+                    return [loads(line) for line in f]
+
+            full_ms = timed(read_all)
+            tail_ms = timed(lambda: ChatLog(path))
+            opened = ChatLog(path)
+            page_ms = timed(lambda: opened.page_before(opened.tail[0]["n"], 30))
+            first_n = opened.tail[0]["n"]
+            page, has_more = opened.page_before(first_n, 30)
+            assert [record["n"] for record in opened.tail] == list(range(count - 49, count + 1))
+            assert [record["n"] for record in page] == list(range(first_n - 30, first_n)) and has_more
+            assert opened.next_n == count + 1
+            if count == 100000:
+                assert tail_ms < full_ms
+            print(f"{count} сообщений, {os.path.getsize(path) // 1024} КБ: весь файл {full_ms:.1f}мс, "
+                  f"хвост {tail_ms:.2f}мс, страница ранних {page_ms:.2f}мс")
+
+        opened.keep_messages = 1000
+        compact_ms = timed(opened.compact, repeat=1)
+        with open(path, "rb") as f:
+            kept = [loads(line)["n"] for line in f]
+        assert kept == list(range(count - 999, count + 1))
+        # Смещения после сжатия верны: страница читается с нового места
+        page, _ = opened.page_before(count - 9, 5)
+        assert [record["n"] for record in page] == list(range(count - 14, count - 9))
+
+        reopened = ChatLog(path)
+        assert reopened.tail[-1]["n"] == count and reopened.next_n == count + 1
+        print(f"Сжатие до {opened.keep_messages} записей: {compact_ms:.0f}мс, "
+              f"файл {os.path.getsize(path) // 1024} КБ, хвост после открытия: {len(reopened.tail)}")
+
+        # Недописанная последняя строка (сбой при записи) пропускается
+        with open(path, "ab") as f:
+            f.write(b'{"n": 100001, "role": "us')
+        assert ChatLog(path).tail[-1]["n"] == count
+
+
+def bench_chat_worker():
+    """Серия быстрых вопросов: поток на сообщение против ChatWorker (очередь, отмена, backpressure)"""
+    import queue
+    from chat_worker import ChatWorker
+    from openai_assistant import OpenAIAssistant
+
+    questions = [f"Как накопить на покупку №{i}?" for i in range(6)]
+    reply = lambda body: "Ответ на " + body["messages"][-1]["content"] + " " + "откладывайте " * 20
+
+    def drain(events, until):
+        finished = {}
+        while len(finished) < until:
+            event = events.get(timeout=10)
+            if event[0] in ("done", "cancelled", "error"):
+                finished[event[1]] = event[0]
+        return finished
+
+    with working_directory(), StubChatServer(reply=reply, token_delay=0.005) as stub:
+        assistant = OpenAIAssistant("sk-stub-key", api_base=stub.url)
+        assistant.response_cache.capacity = 0
+        threads = [threading.Thread(target=assistant.generate_response, args=("threads", question))
+                   for question in questions]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        order = [message["content"] for message in assistant.get_history("threads") if message["role"] == "user"]
+        print(f"Поток на сообщение: одновременно запросов {stub.max_active}, "
+              f"порядок в истории сохранен: {order == questions}")
+
+        stub.max_active = 0
+        worker = ChatWorker(assistant, max_pending=len(questions))
+        requests = [worker.submit("worker", question) for question in questions]
+        finished = drain(worker.events, len(requests))
+        order = [message["content"] for message in assistant.get_history("worker") if message["role"] == "user"]
+        print(f"ChatWorker: одновременно запросов {stub.max_active}, порядок в истории сохранен: {order == questions}")
+        assert order == questions and stub.max_active == 1
+        assert all(finished[request.request_id] == "done" for request in requests)
+
+        worker.events = queue.Queue()
+        calls = stub.calls
+        requests = [worker.submit("quick", question, supersede=True) for question in questions]
+        finished = drain(worker.events, len(requests))
+        answered = sum(status == "done" for status in finished.values())
+        print(f"Быстрые вопросы с заменой: отправлено {len(questions)}, отвечено {answered}, "
+              f"запросов к API {stub.calls - calls}")
+        # Отвечен только последний вопрос, остальные отменены
+        assert finished[requests[-1].request_id] == "done" and answered == 1
+        assert all(finished[request.request_id] == "cancelled" for request in requests[:-1])
+
+        worker.max_pending = 3
+        accepted = [worker.submit("burst", question) for question in questions]
+        print(f"Очередь на 3 вопроса: принято {sum(r is not None for r in accepted)} из {len(questions)}")
+        assert [r is not None for r in accepted] == [True] * 3 + [False] * 3
+        worker.shutdown()
+
+
+BENCHMARKS = {
+    "persistence": bench_persistence,
+    "notifications": bench_notifications,
+    "cooling_policy": bench_cooling_policy,
+    "simulation": bench_simulation,
+    "recommendation": bench_recommendation,
+    "price_async": bench_price_async,
+    "price_single_flight": bench_price_single_flight,
+    "price_batch": bench_price_batch,
+    "price_cache": bench_price_cache,
+    "price_matching": bench_price_matching,
+    "local_model": bench_local_model,
+    "fallback": bench_fallback,
+    "api_client": bench_api_client,
+    "assistant_cache": bench_assistant_cache,
+    "chat_stream": bench_chat_stream,
+    "chat_context": bench_chat_context,
+    "chat_memory": bench_chat_memory,
+    "chat_store": bench_chat_store,
+    "chat_worker": bench_chat_worker,
+}
+
+
+if __name__ == "__main__":
+    selected = sys.argv[1:] or list(BENCHMARKS)
+    for name in selected:
+        print(f"\n=== {name} ===")
+        BENCHMARKS[name]()
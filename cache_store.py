@@ -0,0 +1,182 @@
+import atexit
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from persistence import load_json, save_json
+
+
+class PersistentLRUCache:
+    """Кэш в памяти с ограничением размера (LRU), сроком жизни и отложенной записью.
+
+    Изменения помечают кэш "грязным"; на диск он пишется атомарно не чаще
+    раза в flush_interval секунд, а также при flush()/close() и выходе из
+    программы. Файл: {"version": 2, "entries": [[ключ, время записи, значение], ...]}
+    от давно использованных к недавним. Старый формат {ключ: значение} с полем
+    "timestamp" (ISO) в значении тоже читается.
+    """
+
+    FORMAT_VERSION = 2
+
+    def __init__(self, path, capacity=1000, ttl=None, flush_interval=30.0):
+        # Абсолютный путь: запись при выходе не должна зависеть от текущей папки
+        self.path = os.path.abspath(path)
+        self.capacity = capacity
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+
+        # ключ -> (время записи epoch, значение); порядок = порядок использования
+        self.entries = OrderedDict()
+        self.lock = threading.RLock()
+        # Сериализует записи на диск, чтобы старый снимок не затер новый
+        self.flush_lock = threading.Lock()
+        self.dirty = False
+        self.timer = None
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+        self.load()
+        atexit.register(self.flush)
+
+    def load(self):
+        try:
+            data = load_json(self.path, {})
+        except Exception as e:
+            print(f"[CACHE] Ошибка загрузки кэша {self.path}: {e}")
+            data = {}
+
+        if isinstance(data, dict) and data.get("version") == self.FORMAT_VERSION:
+            records = data.get("entries", [])
+        else:
+            records = [(key, self.legacy_stored_at(value), value) for key, value in data.items()]
+
+        now = time.time()
+        with self.lock:
+            for key, stored_at, value in records:
+                if not self.is_expired(stored_at, now):
+                    self.entries[key] = (stored_at, value)
+            self.evict()
+
+    def legacy_stored_at(self, value):
+        try:
+            return datetime.fromisoformat(value["timestamp"]).timestamp()
+        except (TypeError, KeyError, ValueError):
+            return time.time()
+
+    def is_expired(self, stored_at, now=None):
+        if self.ttl is None:
+            return False
+        return (now or time.time()) - stored_at >= self.ttl
+
+    def evict(self):
+        # Вытесняем давно неиспользованные записи сверх лимита
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+            self.dirty = True
+
+    def get(self, key, default=None):
+        """Значение по ключу (обновляет порядок LRU); просроченное удаляется"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and self.is_expired(entry[0]):
+                del self.entries[key]
+                self.expirations += 1
+                self.mark_dirty()
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return default
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, stored_at=None):
+        with self.lock:
+            self.entries[key] = (stored_at or time.time(), value)
+            self.entries.move_to_end(key)
+            self.evict()
+            self.mark_dirty()
+
+    def pop(self, key, default=None):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                return default
+            self.mark_dirty()
+            return entry[1]
+
+    def __contains__(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            return entry is not None and not self.is_expired(entry[0])
+
+    def __getitem__(self, key):
+        value = self.get(key, self)
+        if value is self:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def items(self):
+        """Актуальные пары (ключ, значение) без изменения порядка LRU"""
+        now = time.time()
+        with self.lock:
+            return [(key, value) for key, (stored_at, value) in self.entries.items()
+                    if not self.is_expired(stored_at, now)]
+
+    def mark_dirty(self):
+        self.dirty = True
+        if self.timer is None and self.flush_interval is not None:
+            self.timer = threading.Timer(self.flush_interval, self.flush)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def flush(self):
+        """Записывает кэш на диск, если он менялся"""
+        with self.flush_lock:
+            with self.lock:
+                if self.timer is not None:
+                    self.timer.cancel()
+                    self.timer = None
+                if not self.dirty:
+                    return False
+                records = [[key, stored_at, value] for key, (stored_at, value) in self.entries.items()]
+                self.dirty = False
+
+            try:
+                save_json(self.path, {"version": self.FORMAT_VERSION, "entries": records})
+                return True
+            except Exception as e:
+                print(f"[CACHE] Ошибка сохранения кэша {self.path}: {e}")
+                with self.lock:
+                    self.dirty = True
+                return False
+
+    def close(self):
+        self.flush()
+        atexit.unregister(self.flush)
+
+    def stats(self):
+        """Счетчики: попадания, промахи, вытеснения по размеру и по сроку"""
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "capacity": self.capacity,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations
+        }
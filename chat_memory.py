@@ -0,0 +1,93 @@
+"""
+Подсчет токенов и сжатие истории диалога AI помощника.
+
+Если установлен tiktoken, токены считаются тем же токенизатором, что и у
+модели; иначе - локальной оценкой по словам (кириллица дробится на токены
+мельче латиницы). Старые реплики, не влезающие в бюджет, сворачиваются в
+краткую сводку.
+"""
+import math
+import re
+from functools import lru_cache
+
+try:
+    import tiktoken
+    TIKTOKEN_AVAILABLE = True
+except ImportError:
+    TIKTOKEN_AVAILABLE = False
+
+# Служебные токены на каждое сообщение и на начало ответа (формат chat completions)
+MESSAGE_OVERHEAD_TOKENS = 4
+REPLY_PRIMING_TOKENS = 3
+
+TOKEN_PIECE_RE = re.compile(r"[a-z]+|[а-яё]+|\d+|[^\sa-zа-яё\d]", re.IGNORECASE)
+CYRILLIC_RE = re.compile(r"[а-яё]", re.IGNORECASE)
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model):
+    """Кодировка tiktoken для модели или None (нет библиотеки или файла словаря)"""
+    if not TIKTOKEN_AVAILABLE:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except Exception:
+        try:
+            return tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            print(f"[CHAT] tiktoken недоступен, используем оценку токенов: {e}")
+            return None
+
+
+def estimate_tokens(text):
+    """Оценка числа токенов без токенизатора модели"""
+    total = 0
+    for piece in TOKEN_PIECE_RE.findall(text):
+        if CYRILLIC_RE.match(piece):
+            total += math.ceil(len(piece) / 3)
+        elif piece.isalpha():
+            total += math.ceil(len(piece) / 4)
+        elif piece.isdigit():
+            total += math.ceil(len(piece) / 3)
+        else:
+            total += 1
+    return total
+
+
+@lru_cache(maxsize=4096)
+def count_tokens(text, model="gpt-3.5-turbo"):
+    """Число токенов в тексте"""
+    if not text:
+        return 0
+    encoding = get_encoding(model)
+    if encoding is not None:
+        return len(encoding.encode(text))
+    return estimate_tokens(text)
+
+
+def count_message_tokens(messages, model="gpt-3.5-turbo"):
+    """Токены списка сообщений вместе со служебными"""
+    return sum(count_tokens(message["content"], model) + MESSAGE_OVERHEAD_TOKENS
+               for message in messages)
+
+
+def first_sentence(text, limit):
+    sentence = re.split(r"(?<=[.!?])\s", text.strip(), maxsplit=1)[0]
+    if len(sentence) > limit:
+        sentence = sentence[:limit].rstrip() + "..."
+    return sentence
+
+
+def local_summary(previous_summary, messages, max_tokens, model="gpt-3.5-turbo"):
+    """Сводка без обращения к модели: вопросы пользователя и начало ответов.
+
+    Если сводка не влезает в max_tokens, отбрасываются самые старые пункты.
+    """
+    lines = previous_summary.splitlines() if previous_summary else []
+    for message in messages:
+        prefix = "Пользователь" if message["role"] == "user" else "Помощник"
+        lines.append(f"- {prefix}: {first_sentence(message['content'], 150)}")
+
+    while len(lines) > 1 and count_tokens("\n".join(lines), model) > max_tokens:
+        lines.pop(0)
+    return "\n".join(lines)
@@ -0,0 +1,201 @@
+"""
+Журнал чата с AI помощником: по файлу JSON Lines на пользователя.
+
+Записи только дописываются в конец: {"n": номер, "role": ..., "content": ...,
+"ts": epoch}; реплики вне контекста модели (тестовые ответы, ошибки) помечены
+"context": false. При открытии читается только хвост файла - с конца, поэтому
+старт не зависит от длины истории. Более ранние сообщения подгружаются
+страницами, а разросшийся файл сжимается до последних keep_messages записей.
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import deque
+from persistence import dumps, loads
+
+CHATS_DIR = "chats"
+READ_BLOCK = 64 * 1024
+
+
+class ChatLog:
+    def __init__(self, path, tail_size=50, compact_bytes=2 * 1024 * 1024, keep_messages=1000):
+        self.path = os.path.abspath(path)
+        self.compact_bytes = compact_bytes
+        self.keep_messages = keep_messages
+        self.lock = threading.RLock()
+
+        # Последние записи в памяти
+        self.tail = deque(maxlen=tail_size)
+        # Номер записи -> смещение строки в файле (для прочитанных записей)
+        self.offsets = {}
+        self.next_n = 1
+        self.size = 0
+
+        self.load_tail()
+
+    def load_tail(self):
+        with self.lock:
+            if not os.path.exists(self.path):
+                return
+            self.size = os.path.getsize(self.path)
+            for offset, record in self.read_before(self.size, self.tail.maxlen):
+                self.offsets[record["n"]] = offset
+                self.tail.append(record)
+            if self.tail:
+                self.next_n = self.tail[-1]["n"] + 1
+
+    def read_before(self, end, count):
+        """До count записей, которые кончаются до байта end: [(смещение, запись)] от старых к новым"""
+        lines = []
+        if end <= 0 or count <= 0:
+            return lines
+
+        with open(self.path, "rb") as f:
+            pos = end
+            buffer = b""
+            while len(lines) < count:
+                if pos == 0:
+                    # Дошли до начала файла: остаток буфера - первая строка
+                    if buffer.strip():
+                        lines.append((0, buffer))
+                    break
+                step = min(READ_BLOCK, pos)
+                pos -= step
+                f.seek(pos)
+                buffer = f.read(step) + buffer
+
+                parts = buffer.split(b"\n")
+                line_end = pos + len(buffer)
+                # parts[0] может быть неполной строкой - дочитаем на следующем шаге
+                for part in reversed(parts[1:]):
+                    line_start = line_end - len(part)
+                    if part.strip():
+                        lines.append((line_start, part))
+                        if len(lines) >= count:
+                            break
+                    line_end = line_start - 1
+                buffer = parts[0]
+
+        records = []
+        for offset, line in reversed(lines):
+            try:
+                records.append((offset, loads(line)))
+            except ValueError:
+                # Недописанная строка (сбой при записи) - пропускаем
+                continue
+        return records
+
+    def append(self, role, content, context=True):
+        """Дописывает реплику; возвращает ее номер"""
+        with self.lock:
+            record = {"n": self.next_n, "role": role, "content": content, "ts": int(time.time())}
+            if not context:
+                record["context"] = False
+            line = dumps(record) + b"\n"
+
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, "ab") as f:
+                f.write(line)
+            self.offsets[record["n"]] = self.size
+            self.size += len(line)
+            self.next_n += 1
+            self.tail.append(record)
+
+            if self.size > self.compact_bytes:
+                self.compact()
+            return record["n"]
+
+    def page_before(self, n, count):
+        """Страница из count записей старше записи n: (записи, есть ли еще более ранние)"""
+        with self.lock:
+            offset = self.find_offset(n)
+            if offset is None:
+                return [], False
+            page = self.read_before(offset, count)
+            for record_offset, record in page:
+                self.offsets[record["n"]] = record_offset
+            has_more = bool(page) and page[0][0] > 0
+            return [record for _, record in page], has_more
+
+    def find_offset(self, n):
+        """Смещение записи n; неизвестное ищем с конца файла"""
+        offset = self.offsets.get(n)
+        if offset is not None:
+            return offset
+
+        end = self.size
+        while end > 0:
+            page = self.read_before(end, 200)
+            if not page:
+                return None
+            for record_offset, record in page:
+                self.offsets[record["n"]] = record_offset
+            if n in self.offsets:
+                return self.offsets[n]
+            if page[0][1]["n"] < n:
+                # Записи n нет (удалена при сжатии)
+                return None
+            end = page[0][0]
+        return None
+
+    def compact(self):
+        """Оставляет в файле только последние keep_messages записей"""
+        with self.lock:
+            kept = self.read_before(self.size, self.keep_messages)
+            if not kept or kept[0][0] == 0:
+                return
+            cut = kept[0][0]
+
+            directory = os.path.dirname(self.path)
+            fd, tmp_path = tempfile.mkstemp(prefix=".tmp-", suffix=".jsonl", dir=directory)
+            try:
+                with os.fdopen(fd, "wb") as dst, open(self.path, "rb") as src:
+                    src.seek(cut)
+                    shutil.copyfileobj(src, dst)
+                    dst.flush()
+                    os.fsync(dst.fileno())
+                os.replace(tmp_path, self.path)
+            except BaseException:
+                try:
+                    os.unlink(tmp_path)
+                except OSError:
+                    pass
+                raise
+
+            self.offsets = {n: offset - cut for n, offset in self.offsets.items() if offset >= cut}
+            self.size -= cut
+            print(f"[CHAT] Журнал сжат до {len(kept)} записей: {os.path.basename(self.path)}")
+
+    def clear(self):
+        """Удаляет историю (номера записей продолжают расти)"""
+        with self.lock:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            self.tail.clear()
+            self.offsets.clear()
+            self.size = 0
+
+
+class ChatStore:
+    """Журналы чата пользователей (открываются по требованию)"""
+
+    def __init__(self, directory=CHATS_DIR, **log_options):
+        self.directory = directory
+        self.log_options = log_options
+        self.logs = {}
+        self.lock = threading.Lock()
+
+    def get_log_file(self, username):
+        name = hashlib.sha1(username.encode("utf-8")).hexdigest()[:16] + ".jsonl"
+        return os.path.join(self.directory, name)
+
+    def get_log(self, username):
+        with self.lock:
+            log = self.logs.get(username)
+            if log is None:
+                log = ChatLog(self.get_log_file(username), **self.log_options)
+                self.logs[username] = log
+            return log
@@ -0,0 +1,153 @@
+"""
+Очередь запросов к AI помощнику.
+
+Один долгоживущий поток с циклом asyncio обслуживает все вопросы чата:
+у каждого пользователя своя очередь, вопросы отвечаются строго по порядку,
+лишние отклоняются (не больше max_pending на пользователя), а вопрос можно
+отменить - и ожидающий, и уже отвечаемый. HTTP-клиент блокирующий, поэтому
+сам поток ответа читается в небольшом пуле потоков, а цикл asyncio управляет
+очередями. Результаты попадают в потокобезопасную queue.Queue, которую
+UI разбирает через root.after:
+
+    ("started", id) / ("delta", id, текст) / ("done", id, номера записей журнала или None)
+    ("cancelled", id) / ("error", id, текст)
+"""
+import asyncio
+import itertools
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ChatRequest:
+    def __init__(self, request_id, username, message):
+        self.request_id = request_id
+        self.username = username
+        self.message = message
+        self.cancel_event = threading.Event()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+
+class ChatWorker:
+    def __init__(self, assistant, events=None, max_pending=3, max_workers=4):
+        self.assistant = assistant
+        self.events = events if events is not None else queue.Queue()
+        self.max_pending = max_pending
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="chat-io")
+
+        # username -> запросы в очереди и в работе (доступ из UI и из цикла - под lock)
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+
+        # Только из потока цикла: username -> asyncio.Queue
+        self.queues = {}
+        self.consumers = {}
+
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self._run_loop, name="chat-worker", daemon=True)
+        self.thread.start()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+        self.loop.close()
+
+    def submit(self, username, message, supersede=False):
+        """Ставит вопрос в очередь пользователя; None - очередь полна.
+
+        supersede=True отменяет все еще не отвеченные вопросы пользователя.
+        """
+        with self.lock:
+            active = self.pending.setdefault(username, [])
+            if supersede:
+                for request in active:
+                    request.cancel()
+            if sum(not request.cancelled for request in active) >= self.max_pending:
+                return None
+            request = ChatRequest(next(self.ids), username, message)
+            active.append(request)
+
+        self.loop.call_soon_threadsafe(self._enqueue, request)
+        return request
+
+    def cancel(self, username=None):
+        """Отменяет вопросы пользователя (или всех пользователей)"""
+        with self.lock:
+            for name, requests in self.pending.items():
+                if username is None or name == username:
+                    for request in requests:
+                        request.cancel()
+
+    def _enqueue(self, request):
+        user_queue = self.queues.get(request.username)
+        if user_queue is None:
+            user_queue = asyncio.Queue()
+            self.queues[request.username] = user_queue
+            self.consumers[request.username] = self.loop.create_task(self._consume(user_queue))
+        user_queue.put_nowait(request)
+
+    async def _consume(self, user_queue):
+        # Вопросы одного пользователя - строго по очереди
+        while True:
+            request = await user_queue.get()
+            try:
+                if request.cancelled:
+                    self.events.put(("cancelled", request.request_id))
+                else:
+                    await self._process(request)
+            except Exception as e:
+                print(f"[CHAT] Ошибка обработки вопроса: {e}")
+                self.events.put(("error", request.request_id, f"Ошибка: {e}"))
+            finally:
+                with self.lock:
+                    requests = self.pending.get(request.username, [])
+                    if request in requests:
+                        requests.remove(request)
+
+    async def _process(self, request):
+        self.events.put(("started", request.request_id))
+        logged_before = self.assistant.last_logged.get(request.username)
+        stream = self.assistant.stream_response(request.username, request.message, request.cancel_event)
+        finished = object()
+        try:
+            while not request.cancelled:
+                delta = await self.loop.run_in_executor(self.executor, next, stream, finished)
+                if delta is finished:
+                    break
+                if not request.cancelled:
+                    self.events.put(("delta", request.request_id, delta))
+        finally:
+            # Закрываем поток ответа (и HTTP-соединение), если он не дочитан
+            try:
+                await self.loop.run_in_executor(self.executor, stream.close)
+            except (ValueError, RuntimeError):
+                # Остановка: генератор еще читается в пуле и завершится сам по cancel_event
+                pass
+
+        if request.cancelled:
+            self.events.put(("cancelled", request.request_id))
+            return
+        logged = self.assistant.last_logged.get(request.username)
+        self.events.put(("done", request.request_id, logged if logged != logged_before else None))
+
+    async def _stop(self):
+        for task in self.consumers.values():
+            task.cancel()
+        await asyncio.gather(*self.consumers.values(), return_exceptions=True)
+        self.loop.stop()
+
+    def shutdown(self, timeout=5.0):
+        """Отменяет все вопросы и останавливает цикл"""
+        self.cancel()
+        if self.loop.is_closed():
+            return
+        asyncio.run_coroutine_threadsafe(self._stop(), self.loop)
+        self.thread.join(timeout)
+        self.executor.shutdown(wait=False)
@@ -1,145 +1,289 @@
 import json
+from bisect import bisect_right
 from datetime import datetime, timedelta
+import numpy as np
+import cooling_simulation
+from recommendation import CoolingResult
+
+class CoolingPolicy:
+    """Настройки охлаждения пользователя, подготовленные для быстрых расчетов"""
+    
+    def __init__(self, user_data):
+        self.forbidden_categories = frozenset(user_data.get("forbidden_categories", []))
+        self.consider_savings = user_data.get("consider_savings", True)
+        
+        profile = user_data.get("personal_profile", {})
+        self.current_savings = profile.get("current_savings", 0)
+        self.savings_per_month = profile.get("savings_per_month", 0)
+        
+        # Диапазоны в исходном порядке (при пересечении побеждает первый подходящий)
+        self.periods = [
+            (period.get("min_price", 0), period.get("max_price", 0), period.get("days", 0))
+            for period in user_data.get("cooling_periods", [])
+            if period.get("min_price", 0) <= period.get("max_price", 0)
+        ]
+        
+        ordered = sorted(self.periods, key=lambda period: period[0])
+        self.min_prices = [period[0] for period in ordered]
+        self.max_prices = [period[1] for period in ordered]
+        self.days = [period[2] for period in ordered]
+        self.overlapping = any(
+            ordered[i + 1][0] <= ordered[i][1] for i in range(len(ordered) - 1)
+        )
+        
+        self.min_prices_array = np.array(self.min_prices, dtype=np.float64)
+        self.max_prices_array = np.array(self.max_prices, dtype=np.float64)
+        self.days_array = np.array(self.days, dtype=np.int64)
+    
+    def price_days(self, price):
+        """Дни охлаждения по цене: бинарный поиск по отсортированным границам"""
+        if self.overlapping:
+            for min_price, max_price, days in self.periods:
+                if min_price <= price <= max_price:
+                    return days
+            return 0
+        
+        i = bisect_right(self.min_prices, price) - 1
+        if i >= 0 and price <= self.max_prices[i]:
+            return self.days[i]
+        return 0
+    
+    def savings_days(self, price):
+        """Дни, за которые пользователь накопит недостающую сумму"""
+        if self.savings_per_month <= 0:
+            return 0
+        
+        shortage = max(0, price - self.current_savings)
+        if shortage <= 0:
+            return 0
+        
+        daily_savings = self.savings_per_month / 30
+        return int(shortage / daily_savings) + 1
+    
+    def price_days_many(self, prices):
+        """price_days для массива цен"""
+        prices = np.asarray(prices, dtype=np.float64)
+        result = np.zeros(prices.shape, dtype=np.int64)
+        if not self.periods:
+            return result
+        
+        if self.overlapping:
+            # Идем с конца, чтобы первый подходящий диапазон перезаписал остальные
+            for min_price, max_price, days in reversed(self.periods):
+                result[(prices >= min_price) & (prices <= max_price)] = days
+            return result
+        
+        idx = np.searchsorted(self.min_prices_array, prices, side="right") - 1
+        safe_idx = np.clip(idx, 0, len(self.periods) - 1)
+        matched = (idx >= 0) & (prices <= self.max_prices_array[safe_idx])
+        return np.where(matched, self.days_array[safe_idx], 0)
+    
+    def savings_days_many(self, prices, savings_per_month=None, current_savings=None):
+        """savings_days для массива цен.
+        
+        savings_per_month и current_savings по умолчанию берутся из профиля;
+        можно передать массивы - они транслируются (broadcast) вместе с ценами.
+        """
+        prices = np.asarray(prices, dtype=np.float64)
+        if savings_per_month is None:
+            savings_per_month = self.savings_per_month
+        if current_savings is None:
+            current_savings = self.current_savings
+        savings_per_month = np.asarray(savings_per_month, dtype=np.float64)
+        
+        shortage = np.maximum(0, prices - np.asarray(current_savings, dtype=np.float64))
+        daily_savings = np.where(savings_per_month > 0, savings_per_month, 1) / 30
+        days = np.floor(shortage / daily_savings).astype(np.int64) + 1
+        return np.where((shortage > 0) & (savings_per_month > 0), days, 0)
+    
+    def forbidden_mask(self, categories):
+        """Булева маска запрещенных категорий"""
+        categories = np.asarray(categories, dtype=str)
+        if not self.forbidden_categories or categories.size == 0:
+            return np.zeros(categories.shape, dtype=bool)
+        unique, inverse = np.unique(categories, return_inverse=True)
+        unique_forbidden = np.array([category in self.forbidden_categories for category in unique])
+        return unique_forbidden[inverse.reshape(categories.shape)]
 
 class CoolingManager:
     def __init__(self, auth_system):
         self.auth = auth_system
+        # username -> (версия данных, CoolingPolicy)
+        self.policy_cache = {}
+    
+    def get_policy(self, username=None):
+        """Скомпилированная политика охлаждения; пересобирается при изменении данных"""
+        username = username or self.auth.current_user
+        if not username:
+            return None
+        
+        version = self.auth.data_version(username)
+        cached = self.policy_cache.get(username)
+        if cached and cached[0] == version:
+            return cached[1]
+        
+        policy = CoolingPolicy(self.auth.get_user_data(username))
+        self.policy_cache[username] = (version, policy)
+        return policy
     
     def calculate_cooling_period(self, price, category, item_name=""):
-        """Рассчитывает период охлаждения"""
-        if not self.auth.current_user:
+        """Рассчитывает период охлаждения.
+        
+        Возвращает CoolingResult: числа, даты и вид рекомендации (kind);
+        блоки для UI - result.blocks(), текст message строится по запросу.
+        """
+        policy = self.get_policy()
+        if policy is None:
             return self.get_default_result(price, category, item_name)
-            
-        user_data = self.auth.get_user_data(self.auth.current_user)
         
         # 1. Проверка запрещенной категории
-        forbidden_categories = user_data.get("forbidden_categories", [])
-        if category in forbidden_categories:
-            return {
-                "recommended": False,
-                "reason": "Запрещенная категория",
-                "message": f"❌ **Категория '{category}' находится в вашем списке запрещенных покупок**\n\nРекомендуем отказаться от этой покупки. Вы добавили эту категорию в список запрещенных, что говорит о желании контролировать подобные траты.",
-                "cooling_days": 0,
-                "savings_based_days": 0,
-                "total_days": 0
-            }
+        if category in policy.forbidden_categories:
+            return CoolingResult(
+                kind="forbidden",
+                recommended=False,
+                reason="Запрещенная категория",
+                item_name=item_name,
+                price=price,
+                category=category,
+                cooling_days=0,
+                savings_based_days=0,
+                total_days=0
+            )
         
         # 2. Расчет дней охлаждения на основе цены
-        cooling_periods = user_data.get("cooling_periods", [])
-        price_days = 0
-        
-        for period in cooling_periods:
-            min_price = period.get("min_price", 0)
-            max_price = period.get("max_price", 0)
-            days = period.get("days", 0)
-            
-            if min_price <= price <= max_price:
-                price_days = days
-                break
+        price_days = policy.price_days(price)
         
         # 3. Расчет дней на основе накоплений (если включено)
         savings_days = 0
-        consider_savings = user_data.get("consider_savings", True)
-        
-        if consider_savings:
-            savings_days = self.calculate_savings_based_days(price, user_data)
+        if policy.consider_savings:
+            savings_days = policy.savings_days(price)
         
         # 4. Итоговый период охлаждения
         total_days = max(price_days, savings_days)
         
         if total_days <= 0:
-            return {
-                "recommended": True,
-                "reason": "Можно покупать сразу",
-                "message": f"✅ **Анализ завершен: {item_name}**\n\n💰 **Цена:** {price:,} ₽\n📁 **Категория:** {category}\n\n📊 **Рекомендации:**\n• По цене: можно покупать сразу\n\n💡 **Советы:**\n1. Убедитесь, что товар вам действительно нужен\n2. Проверьте наличие акций и скидок\n3. Сравните цены в других магазинах".replace(",", " "),
-                "cooling_days": price_days,
-                "savings_based_days": savings_days,
-                "total_days": 0
-            }
+            return CoolingResult(
+                kind="immediate",
+                recommended=True,
+                reason="Можно покупать сразу",
+                item_name=item_name,
+                price=price,
+                category=category,
+                cooling_days=price_days,
+                savings_based_days=savings_days,
+                total_days=0
+            )
         
-        # Формирование сообщения
-        message = self.generate_recommendation_message(
-            price, category, item_name, price_days, savings_days, total_days
+        cooling_until = datetime.now() + timedelta(days=total_days)
+        result = CoolingResult(
+            kind="cooling",
+            recommended=True,
+            reason="Требуется охлаждение",
+            item_name=item_name,
+            price=price,
+            category=category,
+            cooling_days=price_days,
+            savings_based_days=savings_days,
+            total_days=total_days,
+            cooling_until=cooling_until.strftime("%Y-%m-%d %H:%M:%S"),
+            purchase_date=cooling_until.strftime("%d.%m.%Y")
         )
         
-        return {
-            "recommended": True,
-            "reason": "Требуется охлаждение",
-            "message": message,
-            "cooling_days": price_days,
-            "savings_based_days": savings_days,
-            "total_days": total_days
-        }
+        if policy.savings_per_month > 0:
+            daily_save = policy.savings_per_month / 30
+            result["daily_savings"] = int(daily_save)
+            result["days_to_save"] = int(price / daily_save) + 1
+        
+        return result
     
     def get_default_result(self, price, category, item_name):
         """Возвращает результат по умолчанию, если нет пользователя"""
-        return {
-            "recommended": True,
-            "reason": "Стандартный анализ",
-            "message": f"✅ **Анализ: {item_name}**\n\n💰 **Цена:** {price:,} ₽\n📁 **Категория:** {category}\n\n⏱️ **Рекомендуемый период охлаждения:** 7 дней\n\n💡 **Советы:**\n1. Подождите неделю перед покупкой\n2. Проверьте, действительно ли вам нужен этот товар\n3. Ищите альтернативы и скидки".replace(",", " "),
-            "cooling_days": 7,
-            "savings_based_days": 0,
-            "total_days": 7
-        }
+        return CoolingResult(
+            kind="default",
+            recommended=True,
+            reason="Стандартный анализ",
+            item_name=item_name,
+            price=price,
+            category=category,
+            cooling_days=7,
+            savings_based_days=0,
+            total_days=7
+        )
     
     def calculate_savings_based_days(self, price, user_data):
         """Рассчитывает дни на основе накоплений"""
-        profile = user_data.get("personal_profile", {})
+        return CoolingPolicy(user_data).savings_days(price)
+    
+    def calculate_many(self, prices, categories):
+        """Векторный расчет охлаждения для набора цен и категорий (what-if анализ).
         
-        current_savings = profile.get("current_savings", 0)
-        savings_per_month = profile.get("savings_per_month", 0)
+        Возвращает массивы NumPy той же длины: price_days, savings_days,
+        total_days и forbidden (запрещенная категория - total_days = 0),
+        а также сводку summary.
+        """
+        prices = np.asarray(prices, dtype=np.float64)
+        policy = self.get_policy()
         
-        if savings_per_month <= 0:
-            return 0
+        if policy is None:
+            default_days = np.full(prices.shape, 7, dtype=np.int64)
+            zeros = np.zeros(prices.shape, dtype=np.int64)
+            return {
+                "price_days": default_days,
+                "savings_days": zeros,
+                "total_days": default_days.copy(),
+                "forbidden": np.zeros(prices.shape, dtype=bool),
+                "summary": cooling_simulation.summarize(default_days, default_days, zeros, np.zeros(prices.shape, dtype=bool))
+            }
         
-        shortage = max(0, price - current_savings)
+        return cooling_simulation.simulate(policy, prices, categories)
+    
+    def simulate_history(self, changes=None, since=None, until=None):
+        """Что было бы с историей покупок при других настройках.
         
-        if shortage <= 0:
-            return 0
+        changes - измененные поля настроек (cooling_periods, forbidden_categories,
+        consider_savings, personal_profile); since/until - период в секундах epoch.
+        """
+        policy = self.get_policy()
+        if policy is None:
+            return None
         
-        daily_savings = savings_per_month / 30
-        days_needed = int(shortage / daily_savings) + 1
+        store = self.auth.get_purchase_store(self.auth.current_user)
+        if not changes:
+            return cooling_simulation.simulate_history(policy, store, since, until)["summary"]
         
-        return days_needed
+        user_data = self.auth.get_user_data(self.auth.current_user)
+        user_data.update(changes)
+        candidate = CoolingPolicy(user_data)
+        return cooling_simulation.compare_policies(policy, candidate, store, since, until)
+    
+    def simulate_grid(self, prices, savings_rates):
+        """Дни охлаждения по сетке цен и норм накоплений в месяц"""
+        policy = self.get_policy()
+        if policy is None:
+            return None
+        return cooling_simulation.simulate_grid(policy, prices, savings_rates)
     
     def generate_recommendation_message(self, price, category, item_name, price_days, savings_days, total_days):
-        """Генерирует рекомендательное сообщение"""
-        message = f"🎯 **Анализ завершен: {item_name}**\n\n"
-        message += f"💰 **Цена:** {price:,} ₽\n".replace(",", " ")
-        message += f"📁 **Категория:** {category}\n\n"
-        
-        message += f"📊 **Рекомендации:**\n"
-        
-        if price_days > 0:
-            message += f"• По цене: подумайте {price_days} дней\n"
-        
-        if savings_days > 0:
-            message += f"• По накоплениям: потребуется {savings_days} дней\n"
-        
-        message += f"\n⏱️ **Итоговый период охлаждения:** {total_days} дней\n"
-        
+        """Генерирует рекомендательное сообщение (Markdown)"""
+        result = CoolingResult(
+            kind="cooling",
+            item_name=item_name,
+            price=price,
+            category=category,
+            cooling_days=price_days,
+            savings_based_days=savings_days,
+            total_days=total_days
+        )
         if total_days > 0:
-            purchase_date = datetime.now() + timedelta(days=total_days)
-            message += f"📅 **Можете купить:** {purchase_date.strftime('%d.%m.%Y')}\n"
+            result["purchase_date"] = (datetime.now() + timedelta(days=total_days)).strftime("%d.%m.%Y")
         
-        user_data = self.auth.get_user_data(self.auth.current_user)
-        profile = user_data.get("personal_profile", {})
-        savings_per_month = profile.get("savings_per_month", 0)
-        
-        if savings_per_month > 0:
-            daily_save = savings_per_month / 30
-            days_to_save = int(price / daily_save) + 1
-            message += f"\n💵 **Накопления:**\n"
-            message += f"• При откладывании {int(daily_save):,} ₽/день: {days_to_save} дней\n".replace(",", " ")
-        
-        message += f"\n💡 **Советы:**\n"
-        message += f"1. Используйте это время для поиска альтернатив\n"
-        message += f"2. Проверьте, не появились ли акции\n"
-        message += f"3. Убедитесь, что товар вам действительно нужен\n"
-        message += f"4. Рассмотрите покупку аналогичного товара б/у\n"
-        message += f"5. Сравните цены в разных магазинах\n"
-        
-        return message
+        policy = self.get_policy()
+        if policy and policy.savings_per_month > 0:
+            daily_save = policy.savings_per_month / 30
+            result["daily_savings"] = int(daily_save)
+            result["days_to_save"] = int(price / daily_save) + 1
+        
+        return result["message"]
     
     def create_purchase_item(self, item_name, price, category, cooling_result):
         """Создает объект покупки для сохранения"""
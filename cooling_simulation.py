@@ -0,0 +1,101 @@
+"""
+Пакетное моделирование охлаждения ("что если") для бюджетных разборов.
+
+Считает правила CoolingPolicy сразу по массивам NumPy: по всей истории
+покупок пользователя или по сетке гипотетических цен и норм накоплений.
+"""
+import numpy as np
+
+def simulate(policy, prices, categories=None, savings_per_month=None, current_savings=None, forbidden=None):
+    """Дни охлаждения по каждой позиции и сводка.
+
+    categories - названия категорий (или готовая маска forbidden);
+    savings_per_month/current_savings - число или массив вместо данных профиля.
+    """
+    prices = np.asarray(prices, dtype=np.float64)
+
+    price_days = policy.price_days_many(prices)
+    if policy.consider_savings:
+        savings_days = policy.savings_days_many(prices, savings_per_month, current_savings)
+    else:
+        savings_days = np.zeros(prices.shape, dtype=np.int64)
+    price_days, savings_days = np.broadcast_arrays(price_days, savings_days)
+
+    if forbidden is None:
+        if categories is None:
+            forbidden = np.zeros(prices.shape, dtype=bool)
+        else:
+            forbidden = policy.forbidden_mask(categories)
+    forbidden = np.broadcast_to(forbidden, price_days.shape)
+
+    price_days = np.where(forbidden, 0, price_days)
+    savings_days = np.where(forbidden, 0, savings_days)
+    total_days = np.maximum(price_days, savings_days)
+
+    return {
+        "price_days": price_days,
+        "savings_days": savings_days,
+        "total_days": total_days,
+        "forbidden": forbidden,
+        "summary": summarize(total_days, price_days, savings_days, forbidden)
+    }
+
+def summarize(total_days, price_days, savings_days, forbidden):
+    """Агрегаты по результатам моделирования"""
+    items = int(total_days.size)
+    return {
+        "items": items,
+        "forbidden": int(np.count_nonzero(forbidden)),
+        "cooled": int(np.count_nonzero(total_days)),
+        "total_days": int(total_days.sum()),
+        "average_days": float(total_days.mean()) if items else 0.0,
+        "max_days": int(total_days.max()) if items else 0,
+        # Позиции, где срок определили накопления, а не ценовой диапазон
+        "savings_limited": int(np.count_nonzero(savings_days > price_days))
+    }
+
+def history_arrays(store, since=None, until=None):
+    """Цены и маска строк из PurchaseColumns с фильтром по дате добавления (epoch)"""
+    size = store.size
+    mask = np.ones(size, dtype=bool)
+    if since is not None:
+        mask &= store.added_at[:size] >= since
+    if until is not None:
+        mask &= store.added_at[:size] < until
+    return store.price[:size][mask], store.category[:size][mask], mask
+
+def simulate_history(policy, store, since=None, until=None):
+    """Прогоняет политику по истории покупок (PurchaseColumns)"""
+    prices, category_codes, _ = history_arrays(store, since, until)
+    # Запрет проверяем по словарю категорий, а не по каждой строке
+    forbidden_codes = np.array(
+        [category in policy.forbidden_categories for category in store.categories],
+        dtype=bool
+    )
+    if forbidden_codes.size:
+        forbidden = forbidden_codes[category_codes]
+    else:
+        forbidden = np.zeros(prices.shape, dtype=bool)
+    return simulate(policy, prices, forbidden=forbidden)
+
+def compare_policies(base_policy, candidate_policy, store, since=None, until=None):
+    """Сравнивает две политики на одной истории покупок"""
+    base = simulate_history(base_policy, store, since, until)
+    candidate = simulate_history(candidate_policy, store, since, until)
+    delta = candidate["total_days"] - base["total_days"]
+    return {
+        "base": base["summary"],
+        "candidate": candidate["summary"],
+        "days_delta": int(delta.sum()),
+        "items_longer": int(np.count_nonzero(delta > 0)),
+        "items_shorter": int(np.count_nonzero(delta < 0))
+    }
+
+def simulate_grid(policy, prices, savings_rates, current_savings=None):
+    """Сетка "цена x норма накоплений в месяц".
+
+    Возвращает результат simulate с массивами формы (len(savings_rates), len(prices)).
+    """
+    prices = np.asarray(prices, dtype=np.float64)[np.newaxis, :]
+    savings_rates = np.asarray(savings_rates, dtype=np.float64)[:, np.newaxis]
+    return simulate(policy, prices, savings_per_month=savings_rates, current_savings=current_savings)
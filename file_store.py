@@ -0,0 +1,149 @@
+import copy
+import os
+import threading
+import time
+from persistence import load_json, save_json
+
+if os.name == "nt":
+    import msvcrt
+else:
+    import fcntl
+
+
+class FileLock:
+    """Рекомендательная межпроцессная блокировка через файл <path>.lock"""
+
+    def __init__(self, path, timeout=10.0):
+        self.lock_path = path + ".lock"
+        self.timeout = timeout
+        self.handle = None
+        self.depth = 0
+        # Потоки одного процесса сериализуем обычным RLock,
+        # между процессами работает блокировка файла
+        self.thread_lock = threading.RLock()
+
+    def _try_lock(self):
+        if os.name == "nt":
+            self.handle.seek(0)
+            msvcrt.locking(self.handle.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            fcntl.flock(self.handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+    def _unlock(self):
+        if os.name == "nt":
+            self.handle.seek(0)
+            msvcrt.locking(self.handle.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            fcntl.flock(self.handle.fileno(), fcntl.LOCK_UN)
+
+    def acquire(self):
+        if not self.thread_lock.acquire(timeout=self.timeout):
+            raise TimeoutError(f"Не удалось заблокировать {self.lock_path}")
+
+        if self.depth > 0:
+            self.depth += 1
+            return
+
+        try:
+            directory = os.path.dirname(os.path.abspath(self.lock_path))
+            os.makedirs(directory, exist_ok=True)
+            self.handle = open(self.lock_path, "a+b")
+
+            deadline = time.monotonic() + self.timeout
+            while True:
+                try:
+                    self._try_lock()
+                    break
+                except OSError:
+                    if time.monotonic() >= deadline:
+                        raise TimeoutError(f"Файл {self.lock_path} занят другим процессом")
+                    time.sleep(0.05)
+        except BaseException:
+            if self.handle:
+                self.handle.close()
+                self.handle = None
+            self.thread_lock.release()
+            raise
+
+        self.depth = 1
+
+    def release(self):
+        self.depth -= 1
+        if self.depth == 0:
+            try:
+                self._unlock()
+            finally:
+                self.handle.close()
+                self.handle = None
+        self.thread_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+
+class JsonFileStore:
+    """JSON-файл, который безопасно делят несколько процессов T-Assistant.
+
+    Перечитывает файл только если он изменился на диске (mtime/inode/размер),
+    пишет атомарно под блокировкой, поддерживает compare-and-swap.
+    """
+
+    def __init__(self, path, default=None):
+        self.path = path
+        self.default = default
+        self.lock = FileLock(path)
+        self.data = None
+        self.signature = None
+
+    def stat_signature(self):
+        """Отпечаток файла на диске; None, если файла нет"""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_ino, st.st_size)
+
+    def changed(self):
+        """Изменился ли файл с момента последнего чтения/записи"""
+        return self.data is None or self.stat_signature() != self.signature
+
+    def read(self):
+        """Возвращает данные, перечитывая файл только при изменении"""
+        if self.changed():
+            with self.lock:
+                self.signature = self.stat_signature()
+                data = load_json(self.path)
+                self.data = data if data is not None else copy.deepcopy(self.default)
+        return self.data
+
+    def write(self, data):
+        """Записывает данные (блокировка берется автоматически)"""
+        with self.lock:
+            save_json(self.path, data)
+            self.data = data
+            self.signature = self.stat_signature()
+
+    def compare_and_swap(self, expected_signature, data):
+        """Записывает данные, только если файл не менялся с expected_signature"""
+        with self.lock:
+            if self.stat_signature() != expected_signature:
+                return False
+            self.write(data)
+            return True
+
+    def update(self, mutate):
+        """Читает свежие данные под блокировкой, применяет mutate и сохраняет.
+
+        mutate получает данные и возвращает результат; запись происходит,
+        только если результат истинный.
+        """
+        with self.lock:
+            data = self.read()
+            result = mutate(data)
+            if result:
+                self.write(data)
+            return result
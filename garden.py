@@ -1,17 +1,15 @@
-import json
+from persistence import load_json, save_json
 
 GARDEN_FILE = "garden.json"
 
 def load_garden():
     try:
-        with open(GARDEN_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
+        return load_json(GARDEN_FILE, {"saved":0,"saved_count":0})
     except:
         return {"saved":0,"saved_count":0}
 
 def save_garden(state):
     try:
-        with open(GARDEN_FILE, "w", encoding="utf-8") as f:
-            json.dump(state, f, ensure_ascii=False, indent=2)
+        save_json(GARDEN_FILE, state)
     except:
         pass
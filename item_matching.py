@@ -0,0 +1,176 @@
+"""
+Нормализация названий товаров и поиск почти-дубликатов в кэше цен.
+
+"iPhone 15 Pro 256GB" и "Apple iPhone 15 Pro (256 ГБ)" приводятся к одному
+набору токенов; для остальных расхождений используется индекс символьных
+триграмм с мерой Дайса внутри одной категории и состояния.
+"""
+import re
+import threading
+from collections import Counter
+
+# Русские написания брендов -> латиница
+BRAND_ALIASES = {
+    "эпл": "apple", "эппл": "apple", "айфон": "iphone", "айпад": "ipad", "макбук": "macbook",
+    "аирподс": "airpods", "самсунг": "samsung", "галакси": "galaxy", "сяоми": "xiaomi",
+    "ксиоми": "xiaomi", "редми": "redmi", "хуавей": "huawei", "хонор": "honor",
+    "сони": "sony", "плейстейшн": "playstation", "дайсон": "dyson", "бош": "bosch",
+    "филипс": "philips", "леново": "lenovo", "асус": "asus", "найк": "nike",
+    "адидас": "adidas", "пума": "puma", "икеа": "ikea", "поко": "poco", "реалми": "realme",
+}
+
+# Линейка -> бренд, который часто не пишут
+IMPLIED_BRANDS = {
+    "iphone": "apple", "ipad": "apple", "macbook": "apple", "airpods": "apple",
+    "galaxy": "samsung", "redmi": "xiaomi", "poco": "xiaomi",
+    "playstation": "sony", "xbox": "microsoft",
+}
+
+UNIT_ALIASES = {
+    "gb": "gb", "гб": "gb", "tb": "tb", "тб": "tb", "mb": "mb", "мб": "mb",
+    "мп": "mp", "mp": "mp", "вт": "w", "w": "w", "мм": "mm", "mm": "mm",
+    "см": "cm", "cm": "cm", "л": "l", "l": "l", "кг": "kg", "kg": "kg",
+}
+
+STOP_WORDS = {"новый", "новая", "новое", "оригинал", "оригинальный", "original", "для", "и", "с", "new"}
+
+# Аксессуары стоят на порядки дешевле самого товара: "чехол iPhone" != "iPhone"
+ACCESSORY_WORDS = {
+    "чехол", "case", "стекло", "пленка", "кабель", "cable", "зарядка", "зарядное",
+    "адаптер", "ремешок", "держатель", "подставка", "коробка", "запчасть", "аккумулятор",
+    "насадка", "фильтр", "картридж",
+}
+
+TOKEN_RE = re.compile(r"[a-zа-я]+|\d+")
+
+def normalize_tokens(name):
+    """Токены названия: нижний регистр, бренды и единицы в едином написании"""
+    raw = TOKEN_RE.findall(name.lower().replace("ё", "е"))
+
+    tokens = []
+    for token in raw:
+        if token in STOP_WORDS:
+            continue
+        token = BRAND_ALIASES.get(token, token)
+        unit = UNIT_ALIASES.get(token)
+        # "256 ГБ" и "256GB" -> "256gb"
+        if unit and tokens and tokens[-1].isdigit():
+            tokens[-1] += unit
+            continue
+        tokens.append(token)
+
+    for token in list(tokens):
+        brand = IMPLIED_BRANDS.get(token)
+        if brand and brand not in tokens:
+            tokens.append(brand)
+    return tokens
+
+def normalize_name(name):
+    """Каноническая строка названия (порядок слов не важен)"""
+    return " ".join(sorted(set(normalize_tokens(name))))
+
+def guard_tokens(canonical):
+    """Токены, которые должны совпадать точно: числа и признаки аксессуара"""
+    return frozenset(token for token in canonical.split()
+                     if token in ACCESSORY_WORDS or any(ch.isdigit() for ch in token))
+
+def trigrams(text):
+    padded = f" {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class ItemIndex:
+    """Индекс названий для поиска похожих товаров.
+
+    Записи разбиты по (категория, состояние); внутри группы - инвертированный
+    индекс триграмм. Числа в названии (модель, объем памяти) и слова-аксессуары
+    должны совпадать точно, чтобы "iPhone 14" или "чехол iPhone 15" не
+    выдавались за "iPhone 15".
+    """
+
+    def __init__(self, threshold=0.8):
+        self.threshold = threshold
+        # (категория, состояние) -> {триграмма: set(ключей)}
+        self.postings = {}
+        # ключ -> (группа, каноническое название, триграммы, guard_tokens)
+        self.entries = {}
+        # (группа, каноническое название) -> ключ
+        self.exact = {}
+        self.lock = threading.RLock()
+
+    def group_key(self, category, condition):
+        return (category.lower(), condition.lower())
+
+    def add(self, key, item_name, category, condition):
+        with self.lock:
+            self._add(key, item_name, category, condition)
+
+    def _add(self, key, item_name, category, condition):
+        self._remove(key)
+        group = self.group_key(category, condition)
+        canonical = normalize_name(item_name)
+        grams = trigrams(canonical)
+        guards = guard_tokens(canonical)
+
+        self.entries[key] = (group, canonical, grams, guards)
+        self.exact[(group, canonical)] = key
+        postings = self.postings.setdefault(group, {})
+        for gram in grams:
+            postings.setdefault(gram, set()).add(key)
+
+    def remove(self, key):
+        with self.lock:
+            self._remove(key)
+
+    def _remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        group, canonical, grams, _ = entry
+        if self.exact.get((group, canonical)) == key:
+            del self.exact[(group, canonical)]
+        postings = self.postings.get(group, {})
+        for gram in grams:
+            keys = postings.get(gram)
+            if keys:
+                keys.discard(key)
+                if not keys:
+                    del postings[gram]
+
+    def find(self, item_name, category, condition):
+        """Самый похожий ключ: (ключ, сходство 0..1) или None"""
+        group = self.group_key(category, condition)
+        canonical = normalize_name(item_name)
+        if not canonical:
+            return None
+
+        with self.lock:
+            return self._find(group, canonical)
+
+    def _find(self, group, canonical):
+        key = self.exact.get((group, canonical))
+        if key is not None:
+            return key, 1.0
+
+        postings = self.postings.get(group)
+        if not postings:
+            return None
+
+        grams = trigrams(canonical)
+        shared = Counter()
+        for gram in grams:
+            for candidate in postings.get(gram, ()):
+                shared[candidate] += 1
+
+        guards = guard_tokens(canonical)
+        best = None
+        for candidate, common in shared.items():
+            candidate_grams, candidate_guards = self.entries[candidate][2:]
+            if candidate_guards != guards:
+                continue
+            score = 2 * common / (len(grams) + len(candidate_grams))
+            if score >= self.threshold and (best is None or score > best[1]):
+                best = (candidate, score)
+        return best
+
+    def __len__(self):
+        return len(self.entries)
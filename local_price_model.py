@@ -0,0 +1,218 @@
+"""
+Локальная модель цены без сети.
+
+Линейная регрессия log(цены) по хэшированным признакам названия (слова,
+пары слов, символьные триграммы), категории и состояния. Обучается
+онлайн (AdaGrad + L2) на ответах OpenAI из кэша и отвечает за микросекунды.
+Состояние (веса, накопители AdaGrad, счетчики признаков) сохраняется в
+бинарный файл, чтобы при запуске не обучаться заново на всем кэше.
+"""
+import math
+import os
+import struct
+import tempfile
+import threading
+import zlib
+from array import array
+from item_matching import normalize_tokens
+from persistence import dumps, loads
+
+MODEL_FORMAT_VERSION = 1
+
+class LocalPriceModel:
+    def __init__(self, dimensions=2 ** 18, learning_rate=0.3, l2=1e-6, epochs=3):
+        self.dimensions = dimensions
+        self.mask = dimensions - 1
+        self.learning_rate = learning_rate
+        self.l2 = l2
+        self.epochs = epochs
+
+        self.weights = array("d", bytes(8 * dimensions))
+        self.grad_squares = array("d", bytes(8 * dimensions))
+        # Сколько обучающих примеров видел каждый признак - для уверенности
+        self.feature_counts = array("l", bytes(array("l").itemsize * dimensions))
+        self.bias = 0.0
+        self.samples = 0
+
+        # Средняя ошибка прогноза до обучения (в log-пространстве) по категориям
+        self.category_errors = {}
+        # Метка времени самого нового обучающего примера (ISO) - с нее доучиваемся при запуске
+        self.trained_until = ""
+        # Обучение идет и из рабочих потоков оценщика
+        self.lock = threading.RLock()
+        self.dirty = False
+
+    def hash_feature(self, feature):
+        return zlib.crc32(feature.encode("utf-8")) & self.mask
+
+    def name_features(self, item_name):
+        tokens = normalize_tokens(item_name)
+        features = set()
+        for token in tokens:
+            features.add("w:" + token)
+            padded = f"#{token}#"
+            for i in range(len(padded) - 2):
+                features.add("c:" + padded[i:i + 3])
+        for first, second in zip(tokens, tokens[1:]):
+            features.add(f"b:{first}_{second}")
+        return features
+
+    def featurize(self, item_name, category, condition):
+        """Индексы признаков и общий вес (нормировка по длине названия)"""
+        name_features = self.name_features(item_name)
+        scale = 1.0 / math.sqrt(len(name_features)) if name_features else 0.0
+        name_indices = [self.hash_feature(feature) for feature in name_features]
+        context_indices = [
+            self.hash_feature("cat:" + category),
+            self.hash_feature("cond:" + condition),
+            self.hash_feature(f"cc:{category}_{condition}")
+        ]
+        return name_indices, scale, context_indices
+
+    def raw_predict(self, name_indices, scale, context_indices):
+        weights = self.weights
+        total = self.bias
+        for index in name_indices:
+            total += weights[index] * scale
+        for index in context_indices:
+            total += weights[index]
+        return total
+
+    def learn(self, item_name, category, condition, price, timestamp=None):
+        """Один шаг онлайн-обучения на известной цене (timestamp - время примера, ISO)"""
+        if not price or price <= 0:
+            return
+        target = math.log(price)
+        name_indices, scale, context_indices = self.featurize(item_name, category, condition)
+
+        with self.lock:
+            if self.samples == 0:
+                self.bias = target
+
+            # Ошибку считаем до обучения на примере - честная оценка качества
+            error = self.raw_predict(name_indices, scale, context_indices) - target
+            # Начинаем с пессимистичной ошибки 1.0, чтобы на паре примеров модель не была "уверена"
+            previous = self.category_errors.get(category, 1.0)
+            self.category_errors[category] = 0.9 * previous + 0.1 * abs(error)
+
+            self.step(name_indices, scale, context_indices, error)
+            for index in name_indices:
+                self.feature_counts[index] += 1
+            self.samples += 1
+            if timestamp and timestamp > self.trained_until:
+                self.trained_until = timestamp
+            self.dirty = True
+
+    def step(self, name_indices, scale, context_indices, error):
+        weights, grad_squares = self.weights, self.grad_squares
+        rate, l2 = self.learning_rate, self.l2
+
+        self.bias -= 0.05 * error
+        for index, value in [(i, scale) for i in name_indices] + [(i, 1.0) for i in context_indices]:
+            gradient = error * value + l2 * weights[index]
+            grad_squares[index] += gradient * gradient
+            weights[index] -= rate * gradient / math.sqrt(grad_squares[index] + 1e-8)
+
+    def fit(self, samples):
+        """Обучение на [(название, категория, состояние, цена[, время]), ...] за несколько проходов"""
+        samples = [sample for sample in samples if sample[3] and sample[3] > 0]
+        with self.lock:
+            for sample in samples:
+                self.learn(*sample)
+            # Дополнительные проходы без подсчета признаков и ошибок
+            for _ in range(self.epochs - 1):
+                for item_name, category, condition, price, *_ in samples:
+                    name_indices, scale, context_indices = self.featurize(item_name, category, condition)
+                    error = self.raw_predict(name_indices, scale, context_indices) - math.log(price)
+                    self.step(name_indices, scale, context_indices, error)
+
+    def save(self, path):
+        """Атомарно сохраняет состояние: длина заголовка, JSON-заголовок, сжатые массивы"""
+        with self.lock:
+            if not self.dirty:
+                return False
+            header = dumps({
+                "version": MODEL_FORMAT_VERSION,
+                "dimensions": self.dimensions,
+                "counts_itemsize": self.feature_counts.itemsize,
+                "bias": self.bias,
+                "samples": self.samples,
+                "category_errors": self.category_errors,
+                "trained_until": self.trained_until
+            })
+            raw = self.weights.tobytes() + self.grad_squares.tobytes() + self.feature_counts.tobytes()
+            self.dirty = False
+
+        # Массивы почти пустые - сжимаются во много раз даже на быстром уровне
+        payload = zlib.compress(raw, 1)
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix=".tmp-", suffix=".bin", dir=directory)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(struct.pack("<I", len(header)))
+                f.write(header)
+                f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            with self.lock:
+                self.dirty = True
+            raise
+        return True
+
+    def load(self, path):
+        """Загружает состояние из save(); False - файла нет или он несовместим"""
+        if not os.path.exists(path):
+            return False
+        with open(path, "rb") as f:
+            data = f.read()
+
+        header_size = struct.unpack_from("<I", data)[0]
+        header = loads(data[4:4 + header_size])
+        if (header.get("version") != MODEL_FORMAT_VERSION
+                or header.get("dimensions") != self.dimensions
+                or header.get("counts_itemsize") != self.feature_counts.itemsize):
+            return False
+
+        raw = zlib.decompress(data[4 + header_size:])
+        float_size = 8 * self.dimensions
+        weights = array("d")
+        weights.frombytes(raw[:float_size])
+        grad_squares = array("d")
+        grad_squares.frombytes(raw[float_size:2 * float_size])
+        feature_counts = array("l")
+        feature_counts.frombytes(raw[2 * float_size:])
+        if len(feature_counts) != self.dimensions:
+            return False
+
+        with self.lock:
+            self.weights, self.grad_squares, self.feature_counts = weights, grad_squares, feature_counts
+            self.bias = header["bias"]
+            self.samples = header["samples"]
+            self.category_errors = header["category_errors"]
+            self.trained_until = header["trained_until"]
+            self.dirty = False
+        return True
+
+    def predict(self, item_name, category, condition):
+        """(цена, уверенность 0..1); без обучающих данных - (None, 0.0)"""
+        if self.samples == 0:
+            return None, 0.0
+        name_indices, scale, context_indices = self.featurize(item_name, category, condition)
+        price = math.exp(self.raw_predict(name_indices, scale, context_indices))
+        return int(price), self.confidence(name_indices, category)
+
+    def confidence(self, name_indices, category):
+        """Насколько знакомы признаки названия и насколько точна модель в категории"""
+        if not name_indices:
+            return 0.0
+        counts = self.feature_counts
+        coverage = sum(min(counts[index], 3) for index in name_indices) / (3 * len(name_indices))
+        error = self.category_errors.get(category, 1.0)
+        return coverage * math.exp(-2 * error)
@@ -2,11 +2,14 @@ import tkinter as tk
 from tkinter import ttk, messagebox
 import queue
 import threading
+import time
 from datetime import datetime
-from auth import AuthSystem
+from auth import AuthSystem, purchase_timestamp
 from cooling_manager import CoolingManager
 from notification_manager import NotificationManager
+from notification_daemon import NotificationDaemon
 from scanner import start_scanner
+from persistence import save_json
 
 try:
     from openai_config import OPENAI_API_KEY
@@ -103,9 +106,8 @@ def init_application():
     print("\n📝 Динамические файлы:")
     for filename, default_content in dynamic_files.items():
         if not Path(filename).exists():
-            import json
-            with open(filename, 'w', encoding='utf-8') as f:
-                json.dump(default_content, f, indent=2, ensure_ascii=False)
+            # Шаблоны пользователь правит руками - оставляем с отступами
+            save_json(filename, default_content, pretty=True)
             print(f"  📄 {filename}: создан (шаблон)")
         else:
             print(f"  📄 {filename}: уже существует")
@@ -203,6 +205,24 @@ class RoundedButton(tk.Canvas):
         self.draw()
 
 class MainApplication:
+    # Чат: сообщений на страницу журнала и максимум сообщений на экране
+    CHAT_PAGE_SIZE = 30
+    MAX_CHAT_MESSAGES = 120
+    
+    # Оформление блоков рекомендации: стиль -> (шрифт, цвет темы, отступ pady, перенос)
+    RESULT_BLOCK_STYLES = {
+        "title": (("Arial", 14, "bold"), "text", (0, 10), False),
+        "price": (("Arial", 12, "bold"), "text", (5, 0), False),
+        "category": (("Arial", 11), "secondary", (5, 0), False),
+        "section": (("Arial", 12, "bold"), "text", (15, 5), False),
+        "total": (("Arial", 11, "bold"), "accent", (5, 0), False),
+        "date": (("Arial", 11), "success", (5, 0), False),
+        "savings": (("Arial", 11), "info", (5, 0), False),
+        "bullet": (("Arial", 10), "secondary", 2, True),
+        "tip": (("Arial", 10, "bold"), "text", 5, True),
+        "text": (("Arial", 10), "secondary", 3, True),
+    }
+    
     def __init__(self):
         self.root = tk.Tk()
         self.root.title("T-Assistant")
@@ -234,13 +254,22 @@ class MainApplication:
         self.auth_system = AuthSystem()
         self.cooling_manager = CoolingManager(self.auth_system)
         self.notification_manager = NotificationManager(self.auth_system)
+        self.notification_queue = queue.Queue()
+        self.notification_daemon = NotificationDaemon(self.notification_manager, self.notification_queue)
         self.trigger_queue = queue.Queue()
         self.scanner_running = False
         self.scanner_thread = None
         self.current_user = None
         self.content_container = None
         self.current_screen = None
-        self.chat_history = []
+        # Журнал чата на экране: номер самой ранней показанной записи, есть ли более ранние
+        self.chat_oldest_n = None
+        self.chat_has_more = False
+        self.chat_more_button = None
+        self.chat_scroll_ready = False
+        # Вопросы AI помощнику идут через ChatWorker; id запроса -> состояние пузыря ответа
+        self.chat_worker = None
+        self.chat_requests = {}
         # Монки-патчим Canvas для поддержки закругленных прямоугольников
         def create_rounded_rect(self, x1, y1, x2, y2, r, **kwargs):
             points = [
@@ -261,6 +290,8 @@ class MainApplication:
         self.ai_assistant = None
         self.init_openai_assistant()
         self.root.after(1000, self.check_scanner_queue)
+        self.notification_daemon.start()
+        self.root.after(1000, self.check_notification_queue)
    
 
     def show_navigation(self, show=True):
@@ -338,6 +369,65 @@ class MainApplication:
         if hasattr(self, 'root') and self.root:
             self.root.after(1000, self.check_scanner_queue)
     
+    def check_notification_queue(self):
+        """Показывает уведомления по срокам, которые нашел фоновый поток.
+        
+        Показанными отмечаются только уведомления текущего пользователя;
+        сроки остальных пересчитаются из их данных при входе.
+        """
+        try:
+            while not self.notification_queue.empty():
+                due_keys = self.notification_queue.get_nowait()
+                due_keys = [key for key in due_keys if key[0] == self.current_user]
+                notifications = self.notification_manager.build_due_notifications(due_keys)
+                if notifications:
+                    self.show_purchase_notifications(notifications)
+                    purchase_ids = [n["purchase"]["id"] for n in notifications]
+                    self.notification_manager.mark_many_notified(self.current_user, purchase_ids)
+        except queue.Empty:
+            pass
+        except Exception as e:
+            print(f"Ошибка обработки очереди уведомлений: {e}")
+        
+        if hasattr(self, 'root') and self.root:
+            self.root.after(1000, self.check_notification_queue)
+    
+    def show_purchase_notifications(self, notifications):
+        """Окно с напоминаниями об отложенных покупках"""
+        window = tk.Toplevel(self.root)
+        window.title("Уведомления")
+        window.configure(bg=self.DARK_THEME["bg"])
+        window.attributes("-topmost", True)
+        x = self.root.winfo_x() + 25
+        y = self.root.winfo_y() + 200
+        window.geometry(f"400x420+{x}+{y}")
+        
+        header = tk.Frame(window, bg=self.DARK_THEME["accent"], height=70)
+        header.pack(fill=tk.X)
+        header.pack_propagate(False)
+        tk.Label(header, text=f"🔔 Уведомления ({len(notifications)})",
+                font=("Arial", 16, "bold"), fg="#000000",
+                bg=self.DARK_THEME["accent"]).pack(pady=20)
+        
+        content = tk.Frame(window, bg=self.DARK_THEME["bg"], padx=16, pady=16)
+        content.pack(fill=tk.BOTH, expand=True)
+        for notification in notifications:
+            color = self.DARK_THEME["success"] if notification["type"] == "cooling_ended" else self.DARK_THEME["warning"]
+            card = tk.Frame(content, bg=self.DARK_THEME["surface"],
+                           highlightbackground=color, highlightthickness=1)
+            card.pack(fill=tk.X, pady=(0, 8))
+            tk.Label(card, text=notification["message"], font=("Arial", 11),
+                    fg=self.DARK_THEME["text"], bg=self.DARK_THEME["surface"],
+                    wraplength=330, justify=tk.LEFT).pack(anchor=tk.W, padx=12, pady=10)
+        
+        close_btn = tk.Button(window, text="Понятно",
+                             font=("Arial", 12, "bold"),
+                             bg=self.DARK_THEME["accent"], fg="#000000",
+                             relief=tk.FLAT, bd=0,
+                             command=window.destroy,
+                             padx=0, pady=10)
+        close_btn.pack(side=tk.BOTTOM, fill=tk.X, padx=16, pady=16)
+    
     def show_scanner_notification(self, host, context):
         """Показывает уведомление о новой покупке (облегчённая версия без контекста)."""
         notification_window = tk.Toplevel(self.root)
@@ -1056,6 +1146,8 @@ class MainApplication:
                                           fg=theme["text"])
 
     def clear_content(self):
+        # Уходим с экрана - потоковые ответы чата больше некому показывать
+        self.cancel_chat_streams()
         if self.content_container:
             self.content_container.destroy()
         
@@ -1073,7 +1165,10 @@ class MainApplication:
             api_key = self.get_openai_api_key()
             if api_key and api_key != "your-api-key-here":
                 from openai_assistant import OpenAIAssistant
+                from chat_worker import ChatWorker
                 self.ai_assistant = OpenAIAssistant(api_key, self.auth_system)
+                self.chat_worker = ChatWorker(self.ai_assistant)
+                self.root.after(50, self.check_chat_queue)
                 print("✅ OpenAI помощник инициализирован")
                 return True
             else:
@@ -2110,7 +2205,7 @@ class MainApplication:
             
             # Отображаем покупки
             purchases_sorted = sorted(purchases, 
-                                     key=lambda x: x.get("added_at", ""), 
+                                     key=lambda x: x.get("added_at_ts") or 0, 
                                      reverse=True)
             self.display_purchases(purchases_sorted)
         
@@ -2127,10 +2222,10 @@ class MainApplication:
         for widget in self.purchases_container.winfo_children():
             widget.destroy()
         current_filter = self.purchase_filter_var.get()
-        if current_filter == "Охлаждение":
-            filtered = [p for p in purchases if p.get("status") == "cooling"]
-        elif current_filter == "Купленные":
-            filtered = [p for p in purchases if p.get("status") == "purchased"]
+        filter_statuses = {"Охлаждение": "cooling", "Купленные": "purchased"}
+        if current_filter in filter_statuses:
+            store = self.auth_system.get_purchase_store(self.current_user)
+            filtered = store.purchases_with_status(filter_statuses[current_filter])
         else:
             filtered = purchases
         if not filtered:
@@ -2253,15 +2348,15 @@ class MainApplication:
             
             cooling_until = purchase.get("cooling_until", "")
             try:
-                if cooling_until:
-                    cooling_until_dt = datetime.strptime(cooling_until, "%Y-%m-%d %H:%M:%S")
-                    now = datetime.now()
-                    if cooling_until_dt > now:
-                        days_left = (cooling_until_dt - now).days
+                cooling_until_ts = purchase_timestamp(purchase, "cooling_until")
+                if cooling_until_ts:
+                    seconds_left = cooling_until_ts - time.time()
+                    if seconds_left > 0:
+                        days_left = int(seconds_left // 86400)
                         if days_left > 0:
                             time_text = f"⏰ Осталось: {days_left} дней"
                         else:
-                            hours_left = (cooling_until_dt - now).seconds // 3600
+                            hours_left = int(seconds_left // 3600)
                             time_text = f"⏰ Осталось: {hours_left} часов"
                     else:
                         time_text = "✅ Можно покупать"
@@ -2458,17 +2553,13 @@ class MainApplication:
     def delete_purchase(self, purchase_id):
         if messagebox.askyesno("Подтверждение", "Вы уверены, что хотите удалить эту покупку?"):
             try:
-                user_data = self.auth_system.get_user_data(self.current_user)
-                purchases = user_data.get("purchases", [])
-                new_purchases = [p for p in purchases if p.get("id") != purchase_id]
-                if len(new_purchases) < len(purchases):
-                    if self.auth_system.update_user_data(self.current_user, {"purchases": new_purchases}):
-                        messagebox.showinfo("Успех", "Покупка удалена")
-                        self.show_purchases_screen()
-                    else:
-                        messagebox.showerror("Ошибка", "Не удалось удалить покупку")
-                else:
+                if self.auth_system.get_purchase(self.current_user, purchase_id) is None:
                     messagebox.showerror("Ошибка", "Покупка не найдена")
+                elif self.auth_system.delete_purchase(self.current_user, purchase_id):
+                    messagebox.showinfo("Успех", "Покупка удалена")
+                    self.show_purchases_screen()
+                else:
+                    messagebox.showerror("Ошибка", "Не удалось удалить покупку")
             except Exception as e:
                 messagebox.showerror("Ошибка", f"Ошибка при удалении: {str(e)}")
     
@@ -2477,7 +2568,7 @@ class MainApplication:
             user_data = self.auth_system.get_user_data(self.current_user)
             purchases = user_data.get("purchases", [])
             purchases_sorted = sorted(purchases, 
-                                     key=lambda x: x.get("added_at", ""), 
+                                     key=lambda x: x.get("added_at_ts") or 0, 
                                      reverse=True)
             self.display_purchases(purchases_sorted)
         except Exception as e:
@@ -2600,65 +2691,18 @@ class MainApplication:
             canvas.configure(yscrollcommand=scrollbar.set)
             canvas.pack(side="left", fill="both", expand=True)
             scrollbar.pack(side="right", fill="y")
-            message = cooling_result.get("message", "")
-            lines = message.split('\n')
-            for line in lines:
-                if line.startswith("🎯 **") or line.startswith("✅ **") or line.startswith("❌ **"):
-                    text = line.replace("🎯 **", "").replace("✅ **", "").replace("❌ **", "").replace("**", "")
-                    tk.Label(scrollable_frame, text=text, 
-                            font=("Arial", 14, "bold"), fg=self.DARK_THEME["text"], 
-                            bg=self.DARK_THEME["bg"]).pack(anchor=tk.W, pady=(0, 10))
-                elif line.startswith("💰 **"):
-                    text = line.replace("💰 **", "").replace("**", "")
-                    tk.Label(scrollable_frame, text=text, 
-                            font=("Arial", 12, "bold"), fg=self.DARK_THEME["text"], 
-                            bg=self.DARK_THEME["bg"]).pack(anchor=tk.W, pady=(5, 0))
-                elif line.startswith("📁 **"):
-                    text = line.replace("📁 **", "").replace("**", "")
-                    tk.Label(scrollable_frame, text=text, 
-                            font=("Arial", 11), fg=self.DARK_THEME["secondary"], 
-                            bg=self.DARK_THEME["bg"]).pack(anchor=tk.W, pady=(5, 0))
-                elif line.startswith("📊 **"):
-                    text = line.replace("📊 **", "").replace("**", "")
-                    tk.Label(scrollable_frame, text=text, 
-                            font=("Arial", 12, "bold"), fg=self.DARK_THEME["text"], 
-                            bg=self.DARK_THEME["bg"]).pack(anchor=tk.W, pady=(15, 5))
-                elif line.startswith("⏱️ **"):
-                    text = line.replace("⏱️ **", "").replace("**", "")
-                    tk.Label(scrollable_frame, text=text, 
-                            font=("Arial", 11, "bold"), fg=self.DARK_THEME["accent"], 
-                            bg=self.DARK_THEME["bg"]).pack(anchor=tk.W, pady=(5, 0))
-                elif line.startswith("📅 **"):
-                    text = line.replace("📅 **", "").replace("**", "")
-                    tk.Label(scrollable_frame, text=text, 
-                            font=("Arial", 11), fg=self.DARK_THEME["success"], 
-                            bg=self.DARK_THEME["bg"]).pack(anchor=tk.W, pady=(5, 0))
-                elif line.startswith("💵 **"):
-                    text = line.replace("💵 **", "").replace("**", "")
-                    tk.Label(scrollable_frame, text=text, 
-                            font=("Arial", 11), fg=self.DARK_THEME["info"], 
-                            bg=self.DARK_THEME["bg"]).pack(anchor=tk.W, pady=(5, 0))
-                elif line.startswith("💡 **"):
-                    text = line.replace("💡 **", "").replace("**", "")
-                    tk.Label(scrollable_frame, text=text, 
-                            font=("Arial", 12, "bold"), fg=self.DARK_THEME["text"], 
-                            bg=self.DARK_THEME["bg"]).pack(anchor=tk.W, pady=(15, 5))
-                elif line.startswith("   • ") or line.startswith("• "):
-                    text = line[4:] if line.startswith("   • ") else line[2:]
-                    tk.Label(scrollable_frame, text=f"    {text}", 
-                            font=("Arial", 10), fg=self.DARK_THEME["secondary"], 
-                            bg=self.DARK_THEME["bg"], 
-                            wraplength=300, justify=tk.LEFT).pack(anchor=tk.W, pady=2)
-                elif line.startswith("1.") or line.startswith("2.") or line.startswith("3."):
-                    tk.Label(scrollable_frame, text=line, 
-                            font=("Arial", 10, "bold"), fg=self.DARK_THEME["text"], 
-                            bg=self.DARK_THEME["bg"],
-                            wraplength=300, justify=tk.LEFT).pack(anchor=tk.W, pady=5)
-                elif line.strip():
-                    tk.Label(scrollable_frame, text=line, 
-                            font=("Arial", 10), fg=self.DARK_THEME["secondary"], 
-                            bg=self.DARK_THEME["bg"],
-                            wraplength=300, justify=tk.LEFT).pack(anchor=tk.W, pady=3)
+            for style, icon, label, value in cooling_result.blocks():
+                font, color, pady, wrap = self.RESULT_BLOCK_STYLES[style]
+                if style == "bullet":
+                    text = f"    {value}"
+                else:
+                    text = f"{label} {value}".strip()
+                label_widget = tk.Label(scrollable_frame, text=text, 
+                                        font=font, fg=self.DARK_THEME[color], 
+                                        bg=self.DARK_THEME["bg"])
+                if wrap:
+                    label_widget.configure(wraplength=300, justify=tk.LEFT)
+                label_widget.pack(anchor=tk.W, pady=pady)
             button_frame = tk.Frame(result_window, bg=self.DARK_THEME["bg"], pady=16)
             button_frame.pack(fill=tk.X, padx=16)
             if cooling_result.get("recommended", True) and cooling_result.get("total_days", 0) > 0:
@@ -2748,7 +2792,7 @@ class MainApplication:
         self.chat_container = tk.Frame(chat_canvas, bg=self.DARK_THEME["bg"])
         self.chat_container.bind("<Configure>", lambda e: chat_canvas.configure(scrollregion=chat_canvas.bbox("all")))
         chat_canvas.create_window((0, 0), window=self.chat_container, anchor="nw", width=440)
-        chat_canvas.configure(yscrollcommand=scrollbar.set)
+        chat_canvas.configure(yscrollcommand=lambda first, last: self.on_chat_scroll(scrollbar, first, last))
         chat_canvas.pack(side="left", fill="both", expand=True)
         scrollbar.pack(side="right", fill="y")
         input_frame = tk.Frame(main_container, bg=self.DARK_THEME["bg"])
@@ -2805,6 +2849,8 @@ class MainApplication:
                              command=self.clear_openai_chat,
                              padx=12, pady=6)
         clear_btn.pack(side=tk.LEFT)
+        if self.load_chat_history():
+            return
         welcome_message = "Привет! Я ваш финансовый помощник на базе OpenAI GPT. 🤖\n\n"
         welcome_message += "Могу помочь с:\n"
         welcome_message += "• Анализом покупок\n• Составлением бюджета\n• Советами по экономии\n"
@@ -2812,12 +2858,12 @@ class MainApplication:
         welcome_message += "Задавайте вопросы или используйте быстрые вопросы выше!"
         self.show_ai_message("🤖 Финансовый помощник", welcome_message)
     
-    def show_user_message(self, message):
-        from datetime import datetime
+    def show_user_message(self, message, before=None, timestamp=None, chat_n=None):
         theme = self.DARK_THEME  # Добавь эту строку
         
         message_frame = tk.Frame(self.chat_container, bg=theme["bg"])
-        message_frame.pack(fill=tk.X, pady=(0, 12))
+        message_frame.pack(fill=tk.X, pady=(0, 12), before=before)
+        message_frame.chat_n = chat_n
         
         # Замени primary_light на accent или добавь прозрачность
         msg_container = tk.Frame(message_frame, bg=theme["accent"])
@@ -2833,22 +2879,20 @@ class MainApplication:
                                wraplength=280, justify=tk.LEFT)
         message_label.pack(anchor=tk.E, padx=12, pady=(0, 8))
         
-        time_str = datetime.now().strftime("%H:%M")
-        tk.Label(msg_container, text=time_str, 
+        tk.Label(msg_container, text=self.format_chat_time(timestamp), 
                 font=("Arial", 9), fg="#666666",  # Темно-серый
                 bg=theme["accent"]).pack(anchor=tk.E, padx=12, pady=(0, 8))
         
-        self.chat_container.update_idletasks()
-        canvas = self.chat_container.master
-        if canvas:
-            canvas.yview_moveto(1.0)
+        if before is None:
+            self.after_chat_message_added()
+        return message_label
 
-    def show_ai_message(self, sender, message):
-        from datetime import datetime
+    def show_ai_message(self, sender, message, before=None, timestamp=None, chat_n=None):
         theme = self.DARK_THEME  # Добавь эту строку
         
         message_frame = tk.Frame(self.chat_container, bg=theme["bg"])
-        message_frame.pack(fill=tk.X, pady=(0, 12))
+        message_frame.pack(fill=tk.X, pady=(0, 12), before=before)
+        message_frame.chat_n = chat_n
         
         msg_container = tk.Frame(message_frame, bg=theme["surface"])
         msg_container.pack(anchor=tk.W, padx=8)
@@ -2863,40 +2907,188 @@ class MainApplication:
                             wraplength=280, justify=tk.LEFT)
         message_label.pack(anchor=tk.W, padx=12, pady=(0, 8))
         
-        time_str = datetime.now().strftime("%H:%M")
-        tk.Label(msg_container, text=time_str, 
+        tk.Label(msg_container, text=self.format_chat_time(timestamp), 
                 font=("Arial", 9), fg=theme["text_disabled"], 
                 bg=theme["surface"]).pack(anchor=tk.W, padx=12, pady=(0, 8))
         
+        if before is None:
+            self.after_chat_message_added()
+        return message_label
+
+    def format_chat_time(self, timestamp=None):
+        moment = datetime.fromtimestamp(timestamp) if timestamp else datetime.now()
+        if moment.date() == datetime.now().date():
+            return moment.strftime("%H:%M")
+        return moment.strftime("%d.%m %H:%M")
+
+    def after_chat_message_added(self):
+        """Новое сообщение внизу: убираем лишние старые и прокручиваем вниз"""
+        self.trim_chat_messages()
         self.chat_container.update_idletasks()
         canvas = self.chat_container.master
         if canvas:
             canvas.yview_moveto(1.0)
 
-    def send_openai_message(self):
+    def chat_message_frames(self):
+        return [widget for widget in self.chat_container.winfo_children() if hasattr(widget, "chat_n")]
+
+    def trim_chat_messages(self):
+        """Держит на экране не больше MAX_CHAT_MESSAGES сообщений; убранные можно подгрузить из журнала"""
+        frames = self.chat_message_frames()
+        excess = len(frames) - self.MAX_CHAT_MESSAGES
+        if excess <= 0:
+            return
+        for frame in frames[:excess]:
+            frame.destroy()
+        remaining = [frame.chat_n for frame in frames[excess:] if frame.chat_n is not None]
+        if remaining:
+            self.chat_oldest_n = min(remaining)
+            self.chat_has_more = True
+            self.show_more_button()
+
+    def get_chat_log(self):
+        if self.ai_assistant and self.current_user:
+            return self.ai_assistant.chat_store.get_log(self.current_user)
+        return None
+
+    def show_chat_record(self, record, before=None):
+        if record["role"] == "user":
+            self.show_user_message(record["content"], before, record.get("ts"), record["n"])
+        else:
+            self.show_ai_message("🤖 Финансовый помощник", record["content"], before, record.get("ts"), record["n"])
+
+    def load_chat_history(self):
+        """Последняя страница журнала чата; более ранние - по прокрутке вверх. True, если история есть"""
+        self.chat_oldest_n = None
+        self.chat_has_more = False
+        self.chat_more_button = None
+        self.chat_scroll_ready = False
+        log = self.get_chat_log()
+        records = list(log.tail)[-self.CHAT_PAGE_SIZE:] if log else []
+        for record in records:
+            self.show_chat_record(record)
+        if records:
+            self.chat_oldest_n = records[0]["n"]
+            self.chat_has_more = log.offsets.get(self.chat_oldest_n, 0) > 0
+            if self.chat_has_more:
+                self.show_more_button()
+        # Автоподгрузку по прокрутке включаем после первой отрисовки
+        self.root.after_idle(lambda: setattr(self, "chat_scroll_ready", True))
+        return bool(records)
+
+    def show_more_button(self):
+        if self.chat_more_button is not None and self.chat_more_button.winfo_exists():
+            return
+        frames = self.chat_message_frames()
+        self.chat_more_button = tk.Button(self.chat_container, text="⬆ Показать ранние сообщения",
+                                          font=("Arial", 10),
+                                          bg=self.DARK_THEME["surface"], fg=self.DARK_THEME["text"],
+                                          relief=tk.FLAT, bd=0,
+                                          command=self.load_older_messages,
+                                          padx=12, pady=6)
+        self.chat_more_button.pack(pady=(0, 12), before=frames[0] if frames else None)
+
+    def load_older_messages(self):
+        """Подгружает страницу более ранних сообщений над показанными"""
+        log = self.get_chat_log()
+        if log is None or not self.chat_has_more or self.chat_oldest_n is None:
+            return
+        records, self.chat_has_more = log.page_before(self.chat_oldest_n, self.CHAT_PAGE_SIZE)
+
+        canvas = self.chat_container.master
+        old_height = self.chat_container.winfo_height()
+        first_visible = canvas.yview()[0]
+        frames = self.chat_message_frames()
+        anchor = frames[0] if frames else None
+        for record in records:
+            self.show_chat_record(record, before=anchor)
+        if records:
+            self.chat_oldest_n = records[0]["n"]
+        if not self.chat_has_more and self.chat_more_button is not None:
+            self.chat_more_button.destroy()
+            self.chat_more_button = None
+
+        # Сохраняем видимое место: сдвигаем прокрутку на высоту добавленных сообщений
+        self.chat_container.update_idletasks()
+        new_height = self.chat_container.winfo_height()
+        if new_height > 0:
+            canvas.yview_moveto((first_visible * old_height + new_height - old_height) / new_height)
+
+    def on_chat_scroll(self, scrollbar, first, last):
+        scrollbar.set(first, last)
+        # Долистали до верха длинной ленты - подгружаем более ранние сообщения
+        if self.chat_scroll_ready and self.chat_has_more and float(first) <= 0.0 and float(last) < 1.0:
+            self.chat_scroll_ready = False
+            self.root.after_idle(self.load_older_messages)
+            self.root.after(300, lambda: setattr(self, "chat_scroll_ready", True))
+
+    def send_openai_message(self, supersede=False):
         if not self.ai_assistant:
             self.show_ai_message("❌ Ошибка", "AI помощник не инициализирован")
             return
         message = self.chat_input.get("1.0", tk.END).strip()
         if not message:
             return
-        self.show_user_message(message)
+        request = self.chat_worker.submit(self.current_user, message, supersede=supersede)
+        if request is None:
+            # Очередь полна - вопрос остается в поле ввода
+            self.show_ai_message("⏳ Подождите", "Помощник еще отвечает на предыдущие вопросы.")
+            return
+        user_label = self.show_user_message(message)
         self.chat_input.delete("1.0", tk.END)
-        loading_msg = self.show_loading_message()
+        self.chat_requests[request.request_id] = {
+            "user_label": user_label,
+            "loading": self.show_loading_message(),
+            "label": None,
+            "text": ""
+        }
+    
+    def check_chat_queue(self):
+        """Разбирает события ChatWorker: фрагменты ответа, завершение, отмену"""
         try:
-            import threading
-            def get_response():
-                try:
-                    response = self.ai_assistant.generate_response(self.current_user, message)
-                    self.root.after(0, lambda: self.update_chat_response(loading_msg, response))
-                except Exception as e:
-                    error_msg = f"Ошибка: {str(e)}"
-                    self.root.after(0, lambda: self.update_chat_response(loading_msg, error_msg))
-            thread = threading.Thread(target=get_response, daemon=True)
-            thread.start()
+            while True:
+                event = self.chat_worker.events.get_nowait()
+                state = self.chat_requests.get(event[1])
+                if state is not None:
+                    self.handle_chat_event(state, event)
+        except queue.Empty:
+            pass
         except Exception as e:
-            self.remove_loading_message(loading_msg)
-            self.show_ai_message("❌ Ошибка", f"Не удалось отправить сообщение: {str(e)}")
+            print(f"Ошибка обработки очереди чата: {e}")
+        
+        if hasattr(self, 'root') and self.root:
+            self.root.after(50, self.check_chat_queue)
+    
+    def handle_chat_event(self, state, event):
+        kind, request_id = event[0], event[1]
+        if kind in ("delta", "error"):
+            if state["label"] is None:
+                # Первый фрагмент заменяет индикатор "Думаю..."
+                self.remove_loading_message(state["loading"])
+                state["label"] = self.show_ai_message("🤖 Финансовый помощник", "")
+            state["text"] += event[2]
+            if state["label"].winfo_exists():
+                state["label"].config(text=state["text"])
+                self.chat_container.update_idletasks()
+                self.chat_container.master.yview_moveto(1.0)
+        
+        if kind in ("done", "cancelled", "error"):
+            self.chat_requests.pop(request_id, None)
+            if state["label"] is None:
+                self.remove_loading_message(state["loading"])
+            if kind == "cancelled" and state["label"] is not None and state["label"].winfo_exists():
+                state["label"].config(text=state["text"] + "\n\n⏹ Ответ отменен")
+            # Номера записей журнала - чтобы после прокрутки подгружать сообщения без пропусков
+            if kind == "done" and event[2] is not None:
+                for label, chat_n in zip((state["user_label"], state["label"]), event[2]):
+                    if label is not None and label.winfo_exists():
+                        label.master.master.chat_n = chat_n
+    
+    def cancel_chat_streams(self):
+        """Прерывает все ожидающие и идущие ответы AI помощника"""
+        if self.chat_worker:
+            self.chat_worker.cancel()
+        self.chat_requests.clear()
     
     def on_enter_pressed(self, event):
         if not event.state & 0x1:
@@ -2908,14 +3100,19 @@ class MainApplication:
         question_text = question.split(maxsplit=1)[-1]
         self.chat_input.delete("1.0", tk.END)
         self.chat_input.insert("1.0", question_text)
-        self.send_openai_message()
+        # Новый быстрый вопрос заменяет еще не отвеченные
+        self.send_openai_message(supersede=True)
     
     def clear_openai_chat(self):
+        self.cancel_chat_streams()
         if self.ai_assistant and self.current_user:
             result = self.ai_assistant.clear_history(self.current_user)
             self.show_ai_message("🧹 Очистка", result)
         for widget in self.chat_container.winfo_children():
             widget.destroy()
+        self.chat_oldest_n = None
+        self.chat_has_more = False
+        self.chat_more_button = None
         self.show_ai_message("🤖 Финансовый помощник", 
                            "История очищена. Чем могу помочь?")
     
@@ -2943,10 +3140,6 @@ class MainApplication:
         if message_frame.winfo_exists():
             message_frame.destroy()
 
-    def update_chat_response(self, loading_frame, response):
-        self.remove_loading_message(loading_frame)
-        self.show_ai_message("🤖 Финансовый помощник", response)
-
     def show_no_ai_warning(self):
         self.clear_content()
         self.show_navigation(True)
@@ -3330,15 +3523,14 @@ class MainApplication:
         analyze_btn.pack(fill=tk.X)
     
     def show_statistics_screen(self):
-        user_data = self.auth_system.get_user_data(self.current_user)
-        purchases = user_data.get("purchases", [])
-        if not purchases:
+        store = self.auth_system.get_purchase_store(self.current_user)
+        if not store.count():
             messagebox.showinfo("Статистика", "У вас пока нет покупок для анализа")
             return
-        total_purchases = len(purchases)
-        cooling_purchases = len([p for p in purchases if p.get("status") == "cooling"])
-        purchased_items = len([p for p in purchases if p.get("status") == "purchased"])
-        total_value = sum(p.get("price", 0) for p in purchases)
+        total_purchases = store.count()
+        cooling_purchases = store.count("cooling")
+        purchased_items = store.count("purchased")
+        total_value = int(store.total_price())
         stats_window = tk.Toplevel(self.root)
         stats_window.title("Статистика")
         stats_window.geometry("350x400")
@@ -3807,6 +3999,7 @@ class MainApplication:
             self.navigation_frame = None
 
         # Сбрасываем текущего пользователя
+        self.auth_system.logout()
         self.current_user = None
 
         # Возвращаемся на экран логина
@@ -3887,6 +4080,7 @@ class MainApplication:
 
     
     def logout(self):
+        self.auth_system.logout()
         self.current_user = None
         self.stop_scanner()
         # self.show_auth_screen() old
@@ -3895,6 +4089,9 @@ class MainApplication:
     
     def run(self):
         self.root.mainloop()
+        self.notification_daemon.stop()
+        if self.chat_worker:
+            self.chat_worker.shutdown()
 
 if __name__ == "__main__":
     app = MainApplication()
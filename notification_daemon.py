@@ -0,0 +1,42 @@
+import threading
+
+class NotificationDaemon:
+    """Фоновая доставка уведомлений об охлаждении.
+
+    Поток спит до ближайшего срока в расписании NotificationManager и
+    кладет в очередь наступившие ключи [(username, purchase_id), ...].
+    Данные пользователей поток не трогает: уведомления собирает, показывает
+    и отмечает показанными UI в своем потоке (разбирая очередь через
+    root.after).
+    """
+
+    def __init__(self, notification_manager, event_queue):
+        self.manager = notification_manager
+        self.queue = event_queue
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name="notification-daemon", daemon=True)
+        self.thread.start()
+        print("[NOTIFY] Фоновые уведомления запущены")
+
+    def stop(self):
+        self.running = False
+        # Будим поток, чтобы он увидел флаг остановки
+        with self.manager.scheduler.condition:
+            self.manager.scheduler.condition.notify_all()
+
+    def run(self):
+        while self.running:
+            try:
+                due_keys = self.manager.scheduler.pop_due()
+                if due_keys:
+                    self.queue.put(due_keys)
+                    continue
+            except Exception as e:
+                print(f"[NOTIFY] Ошибка фоновых уведомлений: {e}")
+            self.manager.scheduler.wait_until_due()
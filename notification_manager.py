@@ -1,81 +1,130 @@
 import json
+import time
 from datetime import datetime, timedelta
+from auth import edit_purchases, purchase_timestamp, stamp_purchase_times
+from notification_scheduler import NotificationScheduler, next_due_time, SECONDS_PER_DAY
 
 class NotificationManager:
     def __init__(self, auth_system):
         self.auth = auth_system
+        # Сроки уведомлений держим в куче и обновляем по событиям AuthSystem
+        self.scheduler = NotificationScheduler()
+        self.auth.add_listener(self.on_purchases_changed)
     
-    def check_pending_notifications(self, username):
-        """Проверяет, нужно ли отправлять уведомления"""
-        user_data = self.auth.get_user_data(username)
-        purchases = user_data.get("purchases", [])
-        notification_settings = user_data.get("notification_settings", {})
-        
-        if not notification_settings.get("enabled", True):
-            return []
-        
-        frequency_days = notification_settings.get("frequency_days", 7)
-        excluded_items = notification_settings.get("excluded_items", [])
+    def on_purchases_changed(self, username, action, item):
+        """Инкрементально обновляет расписание при изменении покупок"""
+        if action in ("add", "update"):
+            settings = self.auth.get_user_data(username).get("notification_settings", {})
+            self.scheduler.schedule(username, item, settings)
+        elif action == "delete":
+            self.scheduler.remove(username, item)
+        elif action == "unload":
+            self.scheduler.clear_user(username)
+        else:
+            self.scheduler.rebuild(username, self.auth.get_user_data(username))
+    
+    def build_notification(self, purchase, now=None):
+        """Формирует уведомление по покупке, у которой наступил срок"""
+        now = time.time() if now is None else now
+        cooling_until = purchase_timestamp(purchase, "cooling_until")
+        if cooling_until <= now:
+            return {
+                "purchase": purchase,
+                "type": "cooling_ended",
+                "message": f"✅ Период охлаждения для '{purchase['name']}' завершен!\nВы можете совершить покупку."
+            }
         
-        pending_notifications = []
+        # Регулярное напоминание
+        days_left = int((cooling_until - now) // SECONDS_PER_DAY)
+        until_date = datetime.fromtimestamp(cooling_until)
+        return {
+            "purchase": purchase,
+            "type": "reminder",
+            "message": f"⏳ Напоминание о покупке: '{purchase['name']}'\nОхлаждение до: {until_date.strftime('%d.%m.%Y')}\nОсталось дней: {days_left}"
+        }
+    
+    def get_due_notifications(self, now=None):
+        """Уведомления, срок которых наступил (по расписанию, без перебора покупок).
         
-        for purchase in purchases:
-            if purchase.get("status") != "cooling" or purchase.get("purchased", False):
+        Извлеченные покупки снова попадут в расписание после mark_as_notified.
+        """
+        now = time.time() if now is None else now
+        return self.build_due_notifications(self.scheduler.pop_due(now), now)
+    
+    def build_due_notifications(self, due_keys, now=None):
+        """Уведомления по извлеченным из расписания ключам [(username, purchase_id), ...]"""
+        now = time.time() if now is None else now
+        notifications = []
+        users = {}
+        for username, purchase_id in due_keys:
+            if username not in users:
+                settings = self.auth.get_user_data(username).get("notification_settings", {})
+                users[username] = (self.auth.get_purchase_store(username), settings)
+            store, settings = users[username]
+            purchase = store.get(purchase_id)
+            if purchase is None:
+                continue
+            # Срок мог сдвинуться, если данные поменял другой процесс
+            due = next_due_time(purchase, settings)
+            if due is None:
                 continue
-            
-            if purchase["id"] in excluded_items:
+            if due > now:
+                self.scheduler.schedule(username, purchase, settings)
                 continue
-            
-            # Проверяем, было ли уже уведомление
-            last_notification = purchase.get("last_notification")
-            if last_notification:
-                last_date = datetime.strptime(last_notification, "%Y-%m-%d %H:%M:%S")
-                days_since_last = (datetime.now() - last_date).days
-                if days_since_last < frequency_days:
-                    continue
-            
-            # Проверяем, истек ли период охлаждения
-            cooling_until = purchase.get("cooling_until")
-            if cooling_until:
-                until_date = datetime.strptime(cooling_until, "%Y-%m-%d %H:%M:%S")
-                if until_date <= datetime.now():
-                    pending_notifications.append({
-                        "purchase": purchase,
-                        "type": "cooling_ended",
-                        "message": f"✅ Период охлаждения для '{purchase['name']}' завершен!\nВы можете совершить покупку."
-                    })
-                else:
-                    # Регулярное напоминание
-                    days_left = (until_date - datetime.now()).days
-                    pending_notifications.append({
-                        "purchase": purchase,
-                        "type": "reminder",
-                        "message": f"⏳ Напоминание о покупке: '{purchase['name']}'\nОхлаждение до: {until_date.strftime('%d.%m.%Y')}\nОсталось дней: {days_left}"
-                    })
+            notification = self.build_notification(purchase.copy(), now)
+            notification["username"] = username
+            notifications.append(notification)
+        return notifications
+    
+    def check_pending_notifications(self, username, now=None):
+        """Уведомления пользователя, срок которых наступил (по расписанию, без извлечения)"""
+        now = time.time() if now is None else now
+        return self.build_due_notifications(self.scheduler.peek_due(now, username), now)
+    
+    def update_purchases(self, username, purchase_ids, change):
+        """Применяет change(purchase) к набору покупок за один проход и одну запись.
+        
+        Возвращает количество измененных покупок.
+        """
+        wanted = set(purchase_ids)
+        if not wanted:
+            return 0
+        
+        def apply(user):
+            edited = edit_purchases(user, wanted)
+            for purchase in edited.values():
+                change(purchase)
+                stamp_purchase_times(purchase)
+                self.auth.defer_change("update", purchase)
+            return len(edited)
+        
+        return self.auth.modify_user(username, apply) or 0
+    
+    def mark_many_notified(self, username, purchase_ids):
+        """Отмечает несколько покупок как уведомленные одной записью"""
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        
+        def change(purchase):
+            purchase["last_notification"] = now
+            purchase["notified"] = True
+        
+        return self.update_purchases(username, purchase_ids, change)
+    
+    def mark_many_purchased(self, username, purchase_ids):
+        """Отмечает несколько покупок как совершенные одной записью"""
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        
+        def change(purchase):
+            purchase["purchased"] = True
+            purchase["purchased_at"] = now
+            purchase["status"] = "purchased"
         
-        return pending_notifications
+        return self.update_purchases(username, purchase_ids, change)
     
     def mark_as_notified(self, username, purchase_id):
         """Отмечает покупку как уведомленную"""
-        users = self.auth.load_users()
-        if username in users and "purchases" in users[username]:
-            for purchase in users[username]["purchases"]:
-                if purchase.get("id") == purchase_id:
-                    purchase["last_notification"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                    purchase["notified"] = True
-                    self.auth.save_users()
-                    return True
-        return False
+        return self.mark_many_notified(username, [purchase_id]) > 0
     
     def mark_as_purchased(self, username, purchase_id):
         """Отмечает покупку как совершенную"""
-        users = self.auth.load_users()
-        if username in users and "purchases" in users[username]:
-            for purchase in users[username]["purchases"]:
-                if purchase.get("id") == purchase_id:
-                    purchase["purchased"] = True
-                    purchase["purchased_at"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                    purchase["status"] = "purchased"
-                    self.auth.save_users()
-                    return True
-        return False
\ No newline at end of file
+        return self.mark_many_purchased(username, [purchase_id]) > 0
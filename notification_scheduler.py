@@ -0,0 +1,136 @@
+import heapq
+import itertools
+import threading
+import time
+from auth import purchase_timestamp
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+def next_due_time(purchase, notification_settings):
+    """Когда по покупке нужно следующее уведомление (секунды epoch) или None.
+
+    Только покупки на охлаждении с датой окончания, не чаще раза в
+    frequency_days; если уведомлений еще не было - уведомляем сразу.
+    """
+    if not notification_settings.get("enabled", True):
+        return None
+    if purchase.get("status") != "cooling" or purchase.get("purchased", False):
+        return None
+    if purchase.get("id") in notification_settings.get("excluded_items", []):
+        return None
+    if not purchase_timestamp(purchase, "cooling_until"):
+        return None
+
+    last_notification = purchase_timestamp(purchase, "last_notification")
+    if not last_notification:
+        return 0
+    frequency_days = notification_settings.get("frequency_days", 7)
+    return last_notification + frequency_days * SECONDS_PER_DAY
+
+
+class NotificationScheduler:
+    """Min-heap сроков уведомлений: (время, покупка) без полного перебора.
+
+    Устаревшие записи кучи не удаляются сразу, а пропускаются при извлечении
+    (актуальная версия ключа хранится в self.entries).
+    """
+
+    def __init__(self):
+        self.heap = []
+        self.entries = {}
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+
+    def schedule(self, username, purchase, notification_settings):
+        """Добавляет или пересчитывает срок уведомления по покупке"""
+        due = next_due_time(purchase, notification_settings)
+        key = (username, purchase.get("id"))
+        with self.condition:
+            if due is None:
+                self.entries.pop(key, None)
+            else:
+                seq = next(self.counter)
+                self.entries[key] = (due, seq)
+                heapq.heappush(self.heap, (due, seq, key))
+            self.condition.notify_all()
+
+    def remove(self, username, purchase_id):
+        with self.condition:
+            self.entries.pop((username, purchase_id), None)
+            self.condition.notify_all()
+
+    def clear_user(self, username):
+        """Убирает все сроки пользователя"""
+        with self.condition:
+            for key in [key for key in self.entries if key[0] == username]:
+                del self.entries[key]
+            self.condition.notify_all()
+
+    def rebuild(self, username, user_data):
+        """Пересчитывает сроки пользователя (вход, смена настроек, чужая запись)"""
+        settings = user_data.get("notification_settings", {})
+        with self.condition:
+            self.clear_user(username)
+            for purchase in user_data.get("purchases", []):
+                self.schedule(username, purchase, settings)
+            self._compact()
+
+    def _compact(self):
+        # Если устаревших записей стало больше половины - пересобираем кучу
+        if len(self.heap) > 2 * len(self.entries) + 64:
+            self.heap = [(due, seq, key) for key, (due, seq) in self.entries.items()]
+            heapq.heapify(self.heap)
+
+    def _peek(self):
+        while self.heap:
+            due, seq, key = self.heap[0]
+            if self.entries.get(key) == (due, seq):
+                return due
+            heapq.heappop(self.heap)
+        return None
+
+    def next_due(self):
+        """Ближайший срок (секунды epoch) или None, если ждать нечего"""
+        with self.condition:
+            return self._peek()
+
+    def pop_due(self, now=None):
+        """Извлекает все наступившие сроки: [(username, purchase_id), ...]"""
+        now = time.time() if now is None else now
+        due_keys = []
+        with self.condition:
+            while True:
+                due = self._peek()
+                if due is None or due > now:
+                    break
+                _, _, key = heapq.heappop(self.heap)
+                del self.entries[key]
+                due_keys.append(key)
+        return due_keys
+
+    def peek_due(self, now=None, username=None):
+        """Наступившие сроки без извлечения: [(username, purchase_id), ...].
+
+        Достает их из кучи и кладет обратно - заодно выбрасывает устаревшие записи.
+        """
+        now = time.time() if now is None else now
+        popped = []
+        with self.condition:
+            while True:
+                due = self._peek()
+                if due is None or due > now:
+                    break
+                popped.append(heapq.heappop(self.heap))
+            for item in popped:
+                heapq.heappush(self.heap, item)
+        return [key for _, _, key in popped if username is None or key[0] == username]
+
+    def wait_until_due(self, timeout=None):
+        """Спит до ближайшего срока или до изменения расписания"""
+        with self.condition:
+            due = self._peek()
+            delay = None if due is None else max(0.0, due - time.time())
+            if timeout is not None:
+                delay = timeout if delay is None else min(delay, timeout)
+            if delay is None or delay > 0:
+                self.condition.wait(delay)
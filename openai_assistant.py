@@ -1,58 +1,84 @@
 # openai_assistant.py
 from typing import Dict, List, Optional, Tuple
+import hashlib
 import json
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from cache_store import PersistentLRUCache
+from chat_memory import REPLY_PRIMING_TOKENS, count_message_tokens, count_tokens, local_summary
+from chat_store import ChatStore
 
 try:
-    import openai
+    from api_client import (get_client, AuthenticationError, InvalidRequestError,
+                            QuotaExceededError, RateLimitError)
     OPENAI_AVAILABLE = True
 except ImportError:
     OPENAI_AVAILABLE = False
-    print("⚠️ Модуль openai не установлен. Установите: pip install openai")
+    print("⚠️ Модуль requests не установлен. Установите: pip install requests")
+
+RESPONSE_CACHE_FILE = "assistant_cache.json"
+
+SUMMARY_PROMPT = """Сожми разговор финансового помощника с пользователем в краткую сводку на русском.
+Сохрани суммы, цели, решения пользователя и данные советы. Не больше 5 пунктов, без вступления."""
+
+# Частые вопросы (в т.ч. быстрые вопросы чата): ответ на них не зависит от
+# предыдущих реплик, поэтому берется из кэша и посреди диалога
+COMMON_QUESTIONS = [
+    "Как экономить на покупках?",
+    "Стоит ли покупать новый iPhone?",
+    "Как составить семейный бюджет?",
+    "Как накопить на квартиру?",
+    "Взять кредит или копить?",
+    "Проанализируй мои покупки",
+    "Как накопить на покупку?",
+    "Стоит ли покупать в кредит?",
+]
+
+QUESTION_TOKEN_RE = re.compile(r"[a-zа-я0-9]+")
+
+def normalize_question(question: str) -> str:
+    """Вопрос без регистра, пунктуации и эмодзи: "Взять кредит или копить?" -> взять кредит или копить"""
+    return " ".join(QUESTION_TOKEN_RE.findall(question.lower().replace("ё", "е")))
 
 class OpenAIAssistant:
-    def __init__(self, api_key: str, auth_system=None):
+    def __init__(self, api_key: str, auth_system=None, api_base: Optional[str] = None,
+                 response_cache_capacity: int = 500, response_cache_ttl: float = 3 * 24 * 3600,
+                 chat_store: Optional[ChatStore] = None):
         """
         Инициализация OpenAI помощника
         
         Args:
             api_key: API ключ от OpenAI
             auth_system: Система аутентификации
+            api_base: Адрес API (по умолчанию OPENAI_API_BASE или api.openai.com)
+            response_cache_capacity: Сколько ответов хранить в кэше
+            response_cache_ttl: Срок жизни ответа в кэше, секунды
+            chat_store: Журналы чата пользователей (по умолчанию папка chats/)
         """
         self.auth_system = auth_system
         self.api_key = api_key
         self.is_initialized = False
         
-        # Проверяем, доступен ли модуль openai
-        if not OPENAI_AVAILABLE:
-            print("❌ Модуль openai не установлен. AI помощник будет работать в тестовом режиме.")
-            self.test_mode = True
-            return
+        # История диалогов для каждого пользователя
+        self.conversation_history = {}
+        # Сводка старых реплик, не влезших в бюджет истории. Сначала она
+        # собирается локально (сразу, без API), потом уточняется моделью в фоне
+        self.conversation_summaries = {}
+        # username -> свернутые реплики, которые модель еще не учла
+        self.summary_backlog = {}
+        # username -> сводка, на которую опирается следующее уточнение моделью
+        self.summary_base = {}
+        # Пользователи, для которых уточнение уже поставлено в очередь
+        self.summary_jobs = set()
+        self.summary_lock = threading.Lock()
+        self.summary_executor = None
         
-        # Проверяем API ключ
-        if not api_key or api_key.strip() == "" or api_key == "your-api-key-here":
-            print("⚠️ API ключ не указан или некорректен. AI помощник будет работать в тестовом режиме.")
-            self.test_mode = True
-            return
-        
-        try:
-            # Инициализируем клиент OpenAI (для версии 1.x и выше)
-            if hasattr(openai, 'OpenAI'):
-                self.client = openai.OpenAI(api_key=api_key)
-                self.api_version = "v1+"
-            else:
-                # Для старых версий (0.28 и ниже)
-                openai.api_key = api_key
-                self.client = None
-                self.api_version = "v0"
-            
-            self.test_mode = False
-            self.is_initialized = True
-            print("✅ OpenAI помощник инициализирован")
-            
-        except Exception as e:
-            print(f"❌ Ошибка инициализации OpenAI: {e}")
-            self.test_mode = True
+        # Журнал чата на диске - нужен и в тестовом режиме, чтобы UI показывал историю
+        self.chat_store = chat_store or ChatStore()
+        # username -> (номер реплики пользователя, номер ответа) последнего обмена в журнале
+        self.last_logged = {}
         
         # Системный промпт для ограничения тематики
         self.system_prompt = """Ты - финансовый консультант и помощник по покупкам в приложении MindGuard.
@@ -91,11 +117,18 @@ class OpenAIAssistant:
         - Адаптируй советы под финансовую ситуацию пользователя
         """
         
-        # История диалогов для каждого пользователя
-        self.conversation_history = {}
+        # Системный промпт с контекстом: username -> (версия данных, промпт, хэш промпта)
+        self.context_cache = {}
         
-        # Максимальная длина истории (память)
-        self.max_history_messages = 10
+        # Бюджет токенов: весь промпт, дословная история, сводка. История
+        # сворачивается, когда превысит бюджет в compact_trigger раз (до бюджета)
+        self.max_prompt_tokens = 3000
+        self.history_token_budget = 1500
+        self.compact_trigger = 1.5
+        self.summary_max_tokens = 300
+        
+        # Метрики: username -> {"turns", "last", "max", "total"} токенов промпта
+        self.prompt_metrics = {}
         
         # Модель GPT (можно изменить на gpt-4 если есть доступ)
         self.model = "gpt-3.5-turbo"
@@ -103,6 +136,40 @@ class OpenAIAssistant:
         # Параметры генерации
         self.temperature = 0.7
         self.max_tokens = 800
+        self.max_response_chars = 1500
+        
+        # Кэш ответов: ключ - вопрос + контекст пользователя + настройки модели
+        self.common_questions = {normalize_question(question) for question in COMMON_QUESTIONS}
+        self.response_cache = PersistentLRUCache(
+            RESPONSE_CACHE_FILE,
+            capacity=response_cache_capacity,
+            ttl=response_cache_ttl
+        )
+        
+        # Клиент API - последним: в тестовом режиме остальные поля тоже нужны
+        # Проверяем, доступен ли модуль openai
+        if not OPENAI_AVAILABLE:
+            print("❌ Модуль requests не установлен. AI помощник будет работать в тестовом режиме.")
+            self.test_mode = True
+            return
+        
+        # Проверяем API ключ
+        if not api_key or api_key.strip() == "" or api_key == "your-api-key-here":
+            print("⚠️ API ключ не указан или некорректен. AI помощник будет работать в тестовом режиме.")
+            self.test_mode = True
+            return
+        
+        try:
+            # Общий HTTP-клиент: пул соединений, таймауты, повторы при 429/5xx
+            self.client = get_client(api_key, api_base)
+            
+            self.test_mode = False
+            self.is_initialized = True
+            print("✅ OpenAI помощник инициализирован")
+            
+        except Exception as e:
+            print(f"❌ Ошибка инициализации OpenAI: {e}")
+            self.test_mode = True
     
     def get_user_context(self, username: str) -> str:
         """Получает контекст пользователя для персонализации ответов"""
@@ -131,25 +198,20 @@ class OpenAIAssistant:
             if current_savings > 0:
                 context_parts.append(f"Текущие накопления: {current_savings:,} ₽".replace(",", " "))
             
-            # Покупки пользователя
-            purchases = user_data.get("purchases", [])
-            if purchases:
-                cooling_count = len([p for p in purchases if p.get("status") == "cooling"])
-                purchased_count = len([p for p in purchases if p.get("status") == "purchased"])
-                total_spent = sum(p.get("price", 0) for p in purchases if p.get("status") == "purchased")
+            # Покупки пользователя (агрегаты из колоночного хранилища)
+            store = self.auth_system.get_purchase_store(username)
+            if store.count():
+                cooling_count = store.count("cooling")
+                purchased_count = store.count("purchased")
+                total_spent = int(store.total_price("purchased"))
                 
                 context_parts.append(f"Покупок на охлаждении: {cooling_count}")
                 context_parts.append(f"Завершенных покупок: {purchased_count}")
                 context_parts.append(f"Всего потрачено: {total_spent:,} ₽".replace(",", " "))
                 
                 # Популярные категории
-                categories = {}
-                for purchase in purchases:
-                    category = purchase.get("category", "Другое")
-                    categories[category] = categories.get(category, 0) + 1
-                
-                if categories:
-                    top_categories = sorted(categories.items(), key=lambda x: x[1], reverse=True)[:3]
+                top_categories = store.top_categories(3)
+                if top_categories:
                     category_text = "Частые категории: " + ", ".join([f"{cat} ({count})" for cat, count in top_categories])
                     context_parts.append(category_text)
             
@@ -166,6 +228,50 @@ class OpenAIAssistant:
             print(f"Ошибка получения контекста: {e}")
             return ""
     
+    def get_system_prompt(self, username: str) -> Tuple[str, str]:
+        """Системный промпт с контекстом пользователя и его хэш.
+        
+        Контекст пересобирается, только когда меняется версия данных
+        пользователя (auth_system.data_version); иначе ход диалога не
+        трогает ни профиль, ни покупки.
+        """
+        version = self.auth_system.data_version(username) if self.auth_system else None
+        cached = self.context_cache.get(username)
+        if cached is not None and cached[0] == version:
+            return cached[1], cached[2]
+        
+        user_context = self.get_user_context(username)
+        full_system_prompt = self.system_prompt
+        if user_context:
+            full_system_prompt += f"\n\n{user_context}\n\nПомни эту информацию при ответе, но не упоминай явно, что у тебя есть эти данные."
+        prompt_digest = hashlib.sha1(full_system_prompt.encode("utf-8")).hexdigest()
+        
+        self.context_cache[username] = (version, full_system_prompt, prompt_digest)
+        return full_system_prompt, prompt_digest
+    
+    def get_response_cache_key(self, user_message: str, prompt_digest: str) -> Optional[str]:
+        """Ключ кэша ответа или None, если вопрос пустой после нормализации.
+        
+        prompt_digest - хэш системного промпта с контекстом пользователя,
+        поэтому изменение профиля или покупок дает новый ключ.
+        """
+        question = normalize_question(user_message)
+        if not question:
+            return None
+        settings = f"{self.model}|{self.temperature}|{self.max_tokens}"
+        digest = hashlib.sha1(f"{settings}\n{prompt_digest}\n{question}".encode("utf-8"))
+        return digest.hexdigest()[:24]
+    
+    def is_cacheable(self, username: str, user_message: str) -> bool:
+        """Отвечать из кэша можно в начале диалога или на частый вопрос"""
+        if not self.conversation_history.get(username) and not self.conversation_summaries.get(username):
+            return True
+        return normalize_question(user_message) in self.common_questions
+    
+    def response_cache_stats(self) -> Dict:
+        """Статистика кэша ответов"""
+        return self.response_cache.stats()
+    
     def validate_finance_question(self, question: str) -> Tuple[bool, str]:
         """Проверяет, относится ли вопрос к финансам/покупкам"""
         question_lower = question.lower().strip()
@@ -274,121 +380,334 @@ class OpenAIAssistant:
         Returns:
             Ответ от GPT или сообщение об ошибке
         """
-        # Если в тестовом режиме, возвращаем тестовый ответ
-        if self.test_mode or not self.is_initialized:
-            return self._generate_test_response(username, user_message)
-        
         try:
-            # Валидация вопроса
-            is_valid, validation_message = self.validate_finance_question(user_message)
-            if not is_valid:
-                return f"🤖 Финансовый помощник: {validation_message}. Пожалуйста, задайте вопрос о покупках или финансах."
-            
-            # Инициализация истории для нового пользователя
-            if username not in self.conversation_history:
-                self.conversation_history[username] = []
-            
-            # Получаем контекст пользователя
-            user_context = self.get_user_context(username)
-            
-            # Формируем полный системный промпт с контекстом
-            full_system_prompt = self.system_prompt
-            if user_context:
-                full_system_prompt += f"\n\n{user_context}\n\nПомни эту информацию при ответе, но не упоминай явно, что у тебя есть эти данные."
-            
-            # Подготавливаем сообщения для API
-            messages = [
-                {"role": "system", "content": full_system_prompt}
-            ]
-            
-            # Добавляем историю диалога (последние N сообщений)
-            user_history = self.conversation_history[username]
-            history_to_include = user_history[-self.max_history_messages*2:]  # Умножаем на 2 (пользователь + ассистент)
-            
-            for msg in history_to_include:
-                messages.append(msg)
-            
-            # Добавляем текущее сообщение пользователя
-            messages.append({"role": "user", "content": user_message})
-            
-            # Вызываем OpenAI API (версия 1.x)
-            if self.api_version == "v1+" and hasattr(self, 'client'):
-                response = self.client.chat.completions.create(
-                    model=self.model,
-                    messages=messages,
-                    temperature=self.temperature,
-                    max_tokens=self.max_tokens,
-                    top_p=0.9,
-                    frequency_penalty=0.1,  # Снижаем повторение
-                    presence_penalty=0.1    # Поощряем разнообразие
-                )
-                ai_response = response.choices[0].message.content.strip()
+            ready_response, messages, cache_key = self._prepare_request(username, user_message)
+            if ready_response is not None:
+                return ready_response
             
-            # Старая версия API (0.28 и ниже)
-            elif self.api_version == "v0":
-                response = openai.ChatCompletion.create(
-                    model=self.model,
-                    messages=messages,
-                    temperature=self.temperature,
-                    max_tokens=self.max_tokens,
-                    top_p=0.9,
-                    frequency_penalty=0.1,
-                    presence_penalty=0.1
-                )
-                ai_response = response.choices[0].message.content.strip()
-            
-            else:
-                return "🤖 Финансовый помощник: Ошибка конфигурации API."
+            # Вызываем OpenAI API
+            ai_response = self.client.chat(messages, **self._generation_params())
             
             # Обрабатываем слишком длинные ответы
-            if len(ai_response) > 1500:
-                ai_response = ai_response[:1500] + "..."
-            
-            # Сохраняем в историю
-            self.conversation_history[username].append({"role": "user", "content": user_message})
-            self.conversation_history[username].append({"role": "assistant", "content": ai_response})
-            
-            # Ограничиваем длину истории
-            if len(self.conversation_history[username]) > self.max_history_messages * 2:
-                self.conversation_history[username] = self.conversation_history[username][-self.max_history_messages*2:]
+            if len(ai_response) > self.max_response_chars:
+                ai_response = ai_response[:self.max_response_chars] + "..."
             
+            self._complete_response(username, user_message, ai_response, cache_key)
             return ai_response
             
         except Exception as e:
-            error_msg = str(e).lower()
+            return self._error_response(e, username, user_message)
+    
+    def stream_response(self, username: str, user_message: str, cancel_event=None):
+        """
+        Генератор ответа по частям: фрагменты текста отдаются по мере генерации
+        
+        Args:
+            username: Имя пользователя
+            user_message: Сообщение пользователя
+            cancel_event: threading.Event; если установлен - поток прерывается,
+                а неполный ответ не попадает ни в историю, ни в кэш
             
-            if 'authentication' in error_msg or 'api key' in error_msg:
-                return "🤖 Финансовый помощник: Ошибка аутентификации. Проверьте API ключ в config.py."
-            elif 'rate limit' in error_msg:
-                return "🤖 Финансовый помощник: Превышен лимит запросов. Подождите немного."
-            elif 'insufficient_quota' in error_msg:
-                return "🤖 Финансовый помощник: Превышена квота использования API. Проверьте баланс на platform.openai.com."
-            elif 'invalid request' in error_msg:
-                return f"🤖 Финансовый помощник: Ошибка запроса: {str(e)[:100]}"
+        Yields:
+            Фрагменты ответа (готовые ответы - тестовые, из кэша, ошибки - одним фрагментом)
+        """
+        try:
+            ready_response, messages, cache_key = self._prepare_request(username, user_message)
+        except Exception as e:
+            yield self._error_response(e, username, user_message)
+            return
+        if ready_response is not None:
+            yield ready_response
+            return
+        
+        parts = []
+        length = 0
+        try:
+            for delta in self.client.stream_chat(messages, cancel_event=cancel_event,
+                                                 **self._generation_params()):
+                # Обрезаем слишком длинные ответы, как и в generate_response
+                if length + len(delta) > self.max_response_chars:
+                    delta = delta[:self.max_response_chars - length] + "..."
+                    parts.append(delta)
+                    yield delta
+                    break
+                parts.append(delta)
+                length += len(delta)
+                yield delta
+        except Exception as e:
+            if not parts:
+                yield self._error_response(e, username, user_message)
             else:
                 print(f"Ошибка OpenAI: {e}")
-                # Возвращаем тестовый ответ в случае ошибки
-                return self._generate_test_response(username, user_message)
+                note = "\n\n⚠️ Ответ прерван из-за ошибки соединения."
+                self._log_exchange(username, user_message, "".join(parts) + note, context=False)
+                yield note
+            return
+        
+        if cancel_event is not None and cancel_event.is_set():
+            print(f"[CHAT] Ответ отменен: {user_message[:50]}")
+            return
+        if parts:
+            self._complete_response(username, user_message, "".join(parts).strip(), cache_key)
+    
+    def _generation_params(self) -> Dict:
+        return {
+            "model": self.model,
+            "temperature": self.temperature,
+            "max_tokens": self.max_tokens,
+            "top_p": 0.9,
+            "frequency_penalty": 0.1,  # Снижаем повторение
+            "presence_penalty": 0.1    # Поощряем разнообразие
+        }
+    
+    def _prepare_request(self, username: str, user_message: str):
+        """(готовый ответ или None, сообщения для API, ключ кэша ответа)"""
+        # Если в тестовом режиме, возвращаем тестовый ответ
+        if self.test_mode or not self.is_initialized:
+            response = self._generate_test_response(username, user_message)
+            self._log_exchange(username, user_message, response, context=False)
+            return response, None, None
+        
+        # Валидация вопроса
+        is_valid, validation_message = self.validate_finance_question(user_message)
+        if not is_valid:
+            response = f"🤖 Финансовый помощник: {validation_message}. Пожалуйста, задайте вопрос о покупках или финансах."
+            self._log_exchange(username, user_message, response, context=False)
+            return response, None, None
+        
+        # История пользователя (после перезапуска - из журнала чата)
+        self.get_history(username)
+        
+        # Системный промпт с контекстом пользователя (из кэша, если данные не менялись)
+        full_system_prompt, prompt_digest = self.get_system_prompt(username)
+        
+        # Повторный вопрос с тем же контекстом - ответ из кэша, без запроса к API
+        cache_key = None
+        if self.is_cacheable(username, user_message):
+            cache_key = self.get_response_cache_key(user_message, prompt_digest)
+        if cache_key:
+            cached_response = self.response_cache.get(cache_key)
+            if cached_response is not None:
+                print(f"[CHAT] Ответ из кэша: {user_message[:50]}")
+                self._remember(username, user_message, cached_response)
+                return cached_response, None, cache_key
+        
+        # Подготавливаем сообщения для API
+        messages = [
+            {"role": "system", "content": full_system_prompt}
+        ]
+        summary = self.conversation_summaries.get(username)
+        if summary:
+            messages.append({"role": "system", "content": f"Краткое содержание предыдущего разговора:\n{summary}"})
+        current = {"role": "user", "content": user_message}
+        
+        # Вопрос, который сам по себе не влезает в потолок промпта, не отправляем
+        fixed_tokens = count_message_tokens(messages + [current], self.model) + REPLY_PRIMING_TOKENS
+        if fixed_tokens > self.max_prompt_tokens:
+            message_tokens = count_tokens(user_message, self.model)
+            limit = self.max_prompt_tokens - (fixed_tokens - message_tokens)
+            response = (f"🤖 Финансовый помощник: сообщение слишком длинное (~{message_tokens} токенов, "
+                        f"можно до {max(limit, 0)}). Пожалуйста, сократите его.")
+            self._log_exchange(username, user_message, response, context=False)
+            return response, None, None
+        
+        # История диалога - сколько влезает в потолок промпта, начиная с новых реплик
+        history = []
+        history_tokens = 0
+        for msg in reversed(self.conversation_history[username]):
+            tokens = count_message_tokens([msg], self.model)
+            if fixed_tokens + history_tokens + tokens > self.max_prompt_tokens:
+                break
+            history.append(msg)
+            history_tokens += tokens
+        history.reverse()
+        
+        messages.extend(history)
+        messages.append(current)
+        self._record_prompt_tokens(username, fixed_tokens + history_tokens)
+        return None, messages, cache_key
+    
+    def _complete_response(self, username: str, user_message: str, ai_response: str, cache_key: Optional[str]):
+        """Полный ответ модели: в кэш и в историю диалога"""
+        if cache_key:
+            self.response_cache.set(cache_key, ai_response)
+        self._remember(username, user_message, ai_response)
+    
+    def _error_response(self, error: Exception, username: str, user_message: str) -> str:
+        """Сообщение пользователю по ошибке API"""
+        if isinstance(error, AuthenticationError):
+            response = "🤖 Финансовый помощник: Ошибка аутентификации. Проверьте API ключ в config.py."
+        elif isinstance(error, QuotaExceededError):
+            response = "🤖 Финансовый помощник: Превышена квота использования API. Проверьте баланс на platform.openai.com."
+        elif isinstance(error, RateLimitError):
+            # Клиент уже повторил запрос с паузами - лимит не отпустил
+            response = "🤖 Финансовый помощник: Превышен лимит запросов. Подождите немного."
+        elif isinstance(error, InvalidRequestError):
+            response = f"🤖 Финансовый помощник: Ошибка запроса: {str(error)[:100]}"
+        else:
+            print(f"Ошибка OpenAI: {error}")
+            # Возвращаем тестовый ответ в случае ошибки
+            response = self._generate_test_response(username, user_message)
+        self._log_exchange(username, user_message, response, context=False)
+        return response
+    
+    def get_history(self, username: str) -> List[Dict]:
+        """История диалога в памяти; при первом обращении - из хвоста журнала чата"""
+        if username not in self.conversation_history:
+            tail = self.chat_store.get_log(username).tail
+            self.conversation_history[username] = [
+                {"role": record["role"], "content": record["content"]}
+                for record in tail if record.get("context", True)
+            ]
+        return self.conversation_history[username]
+    
+    def _log_exchange(self, username: str, user_message: str, ai_response: str, context: bool = True):
+        """Дописывает вопрос и ответ в журнал чата"""
+        try:
+            log = self.chat_store.get_log(username)
+            user_n = log.append("user", user_message, context)
+            answer_n = log.append("assistant", ai_response, context)
+            self.last_logged[username] = (user_n, answer_n)
+        except Exception as e:
+            print(f"[CHAT] Ошибка записи журнала чата: {e}")
+    
+    def _remember(self, username: str, user_message: str, ai_response: str):
+        """Сохраняет реплики в историю диалога и журнал чата"""
+        history = self.get_history(username)
+        history.append({"role": "user", "content": user_message})
+        history.append({"role": "assistant", "content": ai_response})
+        self._log_exchange(username, user_message, ai_response)
+        self._compact_history(username)
+    
+    def _compact_history(self, username: str):
+        """Сворачивает старые реплики в сводку, если история превысила бюджет.
+        
+        Сворачиваем с гистерезисом: только когда история больше бюджета в
+        compact_trigger раз, и сразу до бюджета. Ответ пользователю не ждет
+        модель - сводка обновляется локально, а уточнение моделью идет в фоне,
+        когда свернутых реплик наберется на бюджет истории.
+        """
+        history = self.conversation_history[username]
+        if count_message_tokens(history, self.model) <= self.history_token_budget * self.compact_trigger:
+            return
+        
+        keep_tokens = 0
+        split = len(history)
+        while split > 0:
+            tokens = count_message_tokens([history[split - 1]], self.model)
+            if keep_tokens + tokens > self.history_token_budget:
+                break
+            keep_tokens += tokens
+            split -= 1
+        # Свежую пару "вопрос - ответ" оставляем дословно всегда
+        split = min(split, max(len(history) - 2, 0))
+        old_messages, self.conversation_history[username] = history[:split], history[split:]
+        if not old_messages:
+            return
+        
+        with self.summary_lock:
+            backlog = self.summary_backlog.setdefault(username, [])
+            backlog.extend(old_messages)
+            self.conversation_summaries[username] = local_summary(
+                self.conversation_summaries.get(username, ""), old_messages, self.summary_max_tokens, self.model
+            )
+            refine = (username not in self.summary_jobs
+                      and count_message_tokens(backlog, self.model) >= self.history_token_budget)
+            if refine:
+                self.summary_jobs.add(username)
+        print(f"[CHAT] В сводку свернуто реплик: {len(old_messages)} "
+              f"(сводка {count_tokens(self.conversation_summaries[username], self.model)} токенов)")
+        
+        if refine:
+            if self.summary_executor is None:
+                self.summary_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="chat-summary")
+            self.summary_executor.submit(self._refine_summary, username)
+    
+    def _refine_summary(self, username: str):
+        """Фоновое уточнение сводки моделью по накопленным свернутым репликам"""
+        with self.summary_lock:
+            base = self.summary_base.get(username, "")
+            messages = list(self.summary_backlog.get(username, []))
+        
+        try:
+            refined = self._summarize(base, messages)
+        except Exception as e:
+            print(f"[CHAT] Сводка моделью не удалась, остается локальная: {e}")
+            refined = None
+        
+        with self.summary_lock:
+            self.summary_jobs.discard(username)
+            backlog = self.summary_backlog.get(username, [])
+            if backlog[:len(messages)] != messages:
+                # История очищена, пока модель писала сводку
+                return
+            rest = backlog[len(messages):]
+            self.summary_backlog[username] = rest
+            if refined is None:
+                # Дальше уточняем от локальной сводки, чтобы не потерять эти реплики
+                self.summary_base[username] = local_summary(base, messages, self.summary_max_tokens, self.model)
+                return
+            self.summary_base[username] = refined
+            self.conversation_summaries[username] = (
+                local_summary(refined, rest, self.summary_max_tokens, self.model) if rest else refined
+            )
+    
+    def _summarize(self, previous_summary: str, messages: List[Dict]) -> str:
+        """Сводка моделью (ошибки API пробрасываются)"""
+        transcript = "\n".join(
+            f"{'Пользователь' if msg['role'] == 'user' else 'Помощник'}: {msg['content']}" for msg in messages
+        )
+        if previous_summary:
+            transcript = f"Предыдущая сводка:\n{previous_summary}\n\nНовые реплики:\n{transcript}"
+        return self.client.chat(
+            [{"role": "system", "content": SUMMARY_PROMPT}, {"role": "user", "content": transcript}],
+            model=self.model,
+            temperature=0.2,
+            max_tokens=self.summary_max_tokens,
+            max_retries=1
+        )
+    
+    def wait_for_summaries(self):
+        """Дожидается фоновых уточнений сводок (для замеров)"""
+        if self.summary_executor is not None:
+            self.summary_executor.shutdown(wait=True)
+            self.summary_executor = None
+    
+    def _record_prompt_tokens(self, username: str, tokens: int):
+        metrics = self.prompt_metrics.setdefault(username, {"turns": 0, "last": 0, "max": 0, "total": 0})
+        metrics["turns"] += 1
+        metrics["last"] = tokens
+        metrics["max"] = max(metrics["max"], tokens)
+        metrics["total"] += tokens
+        print(f"[CHAT] Промпт: {tokens} токенов (потолок {self.max_prompt_tokens})")
+    
+    def get_prompt_metrics(self, username: str) -> Dict:
+        """Токены промпта по ходам диалога: число ходов, последний, максимум, среднее"""
+        metrics = dict(self.prompt_metrics.get(username, {"turns": 0, "last": 0, "max": 0, "total": 0}))
+        metrics["average"] = metrics["total"] / metrics["turns"] if metrics["turns"] else 0.0
+        return metrics
     
     def clear_history(self, username: str = None):
         """Очищает историю диалога"""
-        if username and username in self.conversation_history:
+        if username:
             self.conversation_history[username] = []
+            with self.summary_lock:
+                self.conversation_summaries.pop(username, None)
+                self.summary_backlog.pop(username, None)
+                self.summary_base.pop(username, None)
+            self.chat_store.get_log(username).clear()
             return f"История диалога для {username} очищена."
-        elif not username:
+        else:
             self.conversation_history = {}
+            with self.summary_lock:
+                self.conversation_summaries = {}
+                self.summary_backlog = {}
+                self.summary_base = {}
+            for log in list(self.chat_store.logs.values()):
+                log.clear()
             return "Вся история диалогов очищена."
-        return "Пользователь не найден."
     
     def get_token_count(self, username: str) -> int:
-        """Возвращает приблизительное количество токенов в истории"""
-        if username not in self.conversation_history:
-            return 0
-        
-        total_tokens = 0
-        for message in self.conversation_history[username]:
-            # Приблизительный подсчет: 1 токен ≈ 0.75 слова на русском
-            words = len(message['content'].split())
-            total_tokens += int(words / 0.75)
-        
-        return total_tokens
\ No newline at end of file
+        """Возвращает количество токенов в истории (вместе со сводкой)"""
+        total_tokens = count_message_tokens(self.get_history(username), self.model)
+        return total_tokens + count_tokens(self.conversation_summaries.get(username, ""), self.model)
\ No newline at end of file
@@ -0,0 +1,71 @@
+import io
+import json
+import os
+import tempfile
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+
+def dumps(data, pretty=False):
+    """Кодирует данные в JSON (bytes, UTF-8)"""
+    if ORJSON_AVAILABLE:
+        option = orjson.OPT_NON_STR_KEYS
+        if pretty:
+            option |= orjson.OPT_INDENT_2
+        try:
+            return orjson.dumps(data, option=option)
+        except TypeError:
+            # orjson не умеет, например, int > 64 бит - отдаем stdlib
+            pass
+    if pretty:
+        return json.dumps(data, ensure_ascii=False, indent=2).encode("utf-8")
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def loads(raw):
+    """Декодирует JSON из bytes или str"""
+    if ORJSON_AVAILABLE:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+def load_json(path, default=None):
+    """Читает JSON-файл; если файла нет - возвращает default"""
+    if not os.path.exists(path):
+        return default
+    with open(path, "rb") as f:
+        return loads(f.read())
+
+
+def save_json(path, data, pretty=False):
+    """Атомарно записывает JSON: пишем во временный файл рядом и переименовываем"""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+
+    fd, tmp_path = tempfile.mkstemp(prefix=".tmp-", suffix=".json", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            if ORJSON_AVAILABLE:
+                f.write(dumps(data, pretty))
+            else:
+                # stdlib пишет в файл кусками, не собирая всю строку в памяти
+                writer = io.TextIOWrapper(f, encoding="utf-8")
+                if pretty:
+                    json.dump(data, writer, ensure_ascii=False, indent=2)
+                else:
+                    json.dump(data, writer, ensure_ascii=False, separators=(",", ":"))
+                writer.flush()
+                writer.detach()
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
@@ -1,56 +1,133 @@
-import openai
 import os
 import json
 import re
+import atexit
 from datetime import datetime, timedelta
-import requests
 from typing import Optional, Dict, List
 import time
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from api_client import get_client
+from cache_store import PersistentLRUCache
+from item_matching import ItemIndex
+from local_price_model import LocalPriceModel
+from pricing_rules import PricingRules
 
 class OpenAIPriceEstimator:
-    def __init__(self, api_key: str):
-        """Инициализация с ключом OpenAI"""
+    def __init__(self, api_key: str, api_base: Optional[str] = None,
+                 request_timeout: float = 15, max_retries: int = 1, max_workers: int = 4,
+                 cache_capacity: int = 5000, cache_flush_interval: float = 30.0,
+                 match_threshold: float = 0.8, local_confidence: float = 0.85,
+                 local_fallback_confidence: float = 0.3):
+        """Инициализация с ключом OpenAI.
+        
+        api_base позволяет направить запросы на другой сервер (например,
+        локальную заглушку в benchmark.py); по умолчанию берется OPENAI_API_BASE.
+        """
+        self.api_base = api_base
+        self.request_timeout = request_timeout
+        # Оценка цены не должна ждать долго: при сбое лучше быстрый fallback
+        self.max_retries = max_retries
+        
+        # Пул для estimate_price_async создается при первом обращении
+        self.max_workers = max_workers
+        self.executor = None
+        
+        # Идущие запросы к API: ключ кэша -> Future (single-flight)
+        self.inflight = {}
+        self.inflight_lock = threading.Lock()
+        
         if api_key == "dummy_key" or not api_key:
             self.api_key = None
+            self.client = None
             self.openai_available = False
             print("[PRICE] OpenAI не доступен, используется fallback режим")
         else:
-            openai.api_key = api_key
+            # Общий с AI-помощником пул соединений, повторы и лимит параллельности
+            self.client = get_client(api_key, api_base)
             self.api_key = api_key
             self.openai_available = True
             print("[PRICE] OpenAI Price Estimator инициализирован")
         
+        # Базовые цены категорий, бренды и скидки (pricing_rules.json)
+        self.pricing_rules = PricingRules.load()
+        
         self.cache_file = "price_cache.json"
+        self.cache_capacity = cache_capacity
+        self.cache_flush_interval = cache_flush_interval
         self.price_cache = self.load_cache()
+        
+        # Поиск похожих названий в кэше ("Apple iPhone 15 Pro (256 ГБ)" ~ "iPhone 15 Pro 256GB")
+        self.item_index = ItemIndex(threshold=match_threshold)
+        for cache_key, data in self.price_cache.items():
+            if "item_name" in data:
+                self.item_index.add(cache_key, data["item_name"], data.get("category", ""), data.get("condition", ""))
+        
+        # Локальная модель учится только на ответах OpenAI. При уверенности
+        # >= local_confidence запрос к API не делается, при >= local_fallback_confidence
+        # модель заменяет fallback_estimate
+        self.local_confidence = local_confidence
+        self.local_fallback_confidence = local_fallback_confidence
+        self.model_file = os.path.splitext(self.price_cache.path)[0] + "_model.bin"
+        self.local_model = self.load_local_model()
+        atexit.register(self.save_local_model)
     
-    def load_cache(self) -> Dict:
-        """Загружает кэш цен из файла"""
+    def load_cache(self) -> PersistentLRUCache:
+        """Загружает кэш цен: LRU на cache_capacity записей, срок жизни 7 дней"""
+        return PersistentLRUCache(
+            self.cache_file,
+            capacity=self.cache_capacity,
+            ttl=timedelta(days=7).total_seconds(),
+            flush_interval=self.cache_flush_interval
+        )
+    
+    def load_local_model(self) -> LocalPriceModel:
+        """Локальная модель: сохраненное состояние плюс дообучение на новых ответах OpenAI из кэша.
+        
+        Без файла модели (первый запуск) обучается на всем кэше за несколько проходов.
+        """
+        model = LocalPriceModel()
         try:
-            if os.path.exists(self.cache_file):
-                with open(self.cache_file, 'r', encoding='utf-8') as f:
-                    cache = json.load(f)
-                    
-                    cleaned_cache = {}
-                    current_time = datetime.now().isoformat()
-                    
-                    for key, data in cache.items():
-                        if "timestamp" in data:
-                            cache_time = datetime.fromisoformat(data["timestamp"])
-                            if datetime.now() - cache_time < timedelta(days=7):
-                                cleaned_cache[key] = data
-                    
-                    return cleaned_cache
+            loaded = model.load(self.model_file)
         except Exception as e:
-            print(f"[CACHE] Ошибка загрузки кэша: {e}")
-        return {}
+            print(f"[PRICE] Ошибка загрузки локальной модели: {e}")
+            loaded = False
+        if not loaded:
+            model = LocalPriceModel()
+        
+        samples = sorted(
+            ((data["item_name"], data.get("category", ""), data.get("condition", ""),
+              data["price"], data.get("timestamp", ""))
+             for _, data in self.price_cache.items()
+             if data.get("source") == "openai" and "item_name" in data
+             and data.get("timestamp", "") > model.trained_until),
+            key=lambda sample: sample[4]
+        )
+        if loaded:
+            for sample in samples:
+                model.learn(*sample)
+        else:
+            model.fit(samples)
+        if samples:
+            action = "дообучена" if loaded else "обучена"
+            print(f"[PRICE] Локальная модель {action} на {len(samples)} ответах из кэша")
+        return model
     
-    def save_cache(self):
-        """Сохраняет кэш в файл"""
+    def save_local_model(self):
+        """Сохраняет состояние локальной модели, если она училась"""
         try:
-            with open(self.cache_file, 'w', encoding='utf-8') as f:
-                json.dump(self.price_cache, f, ensure_ascii=False, indent=2)
+            self.local_model.save(self.model_file)
         except Exception as e:
-            print(f"[CACHE] Ошибка сохранения кэша: {e}")
+            print(f"[PRICE] Ошибка сохранения локальной модели: {e}")
+    
+    def save_cache(self):
+        """Сбрасывает накопленные изменения кэша и локальной модели на диск"""
+        self.price_cache.flush()
+        self.save_local_model()
+    
+    def cache_stats(self) -> Dict:
+        """Попадания, промахи и вытеснения кэша цен"""
+        return self.price_cache.stats()
     
     def get_cache_key(self, item_name: str, category: str, condition: str) -> str:
         """Создает ключ для кэша"""
@@ -58,27 +135,56 @@ class OpenAIPriceEstimator:
         key = re.sub(r'[^a-zа-я0-9_]', '', key)
         return key
     
+    def find_cached(self, item_name: str, category: str, condition: str):
+        """Запись кэша для товара: точное совпадение ключа или похожее название
+        той же категории и состояния. Возвращает (запись, сходство) или (None, 0)."""
+        cache_key = self.get_cache_key(item_name, category, condition)
+        cache_data = self.price_cache.get(cache_key)
+        if cache_data is not None:
+            return cache_data, 1.0
+        
+        match = self.item_index.find(item_name, category, condition)
+        if match is None:
+            return None, 0.0
+        
+        match_key, score = match
+        cache_data = self.price_cache.get(match_key)
+        if cache_data is None:
+            # Запись вытеснена или устарела
+            self.item_index.remove(match_key)
+            return None, 0.0
+        return cache_data, score
+    
     def get_cached_price(self, item_name: str, category: str, condition: str) -> Optional[int]:
         """Получает цену из кэша"""
-        cache_key = self.get_cache_key(item_name, category, condition)
-        if cache_key in self.price_cache:
-            cache_data = self.price_cache[cache_key]
+        cache_data, score = self.find_cached(item_name, category, condition)
+        if cache_data is None:
+            return None
+        if score < 1.0:
+            print(f"[CACHE] Похожий товар в кэше: {item_name} ~ {cache_data['item_name']} "
+                  f"(сходство {score:.2f}) -> {cache_data['price']} ₽")
+        else:
             print(f"[CACHE] Найдена в кэше: {item_name} -> {cache_data['price']} ₽")
-            return cache_data["price"]
-        return None
+        return cache_data["price"]
     
     def save_to_cache(self, item_name: str, category: str, condition: str, price: int, source: str):
-        """Сохраняет цену в кэш"""
+        """Сохраняет цену в кэш (на диск - отложенно, см. PersistentLRUCache).
+        
+        Ответы OpenAI сразу идут в обучение локальной модели.
+        """
         cache_key = self.get_cache_key(item_name, category, condition)
+        timestamp = datetime.now().isoformat()
         self.price_cache[cache_key] = {
             "price": price,
             "category": category,
             "item_name": item_name,
             "condition": condition,
             "source": source,
-            "timestamp": datetime.now().isoformat()
+            "timestamp": timestamp
         }
-        self.save_cache()
+        self.item_index.add(cache_key, item_name, category, condition)
+        if source == "openai":
+            self.local_model.learn(item_name, category, condition, price, timestamp)
     
     def estimate_with_openai(self, item_name: str, category: str, condition: str) -> Optional[int]:
         """Оценивает цену с помощью OpenAI"""
@@ -117,18 +223,18 @@ class OpenAIPriceEstimator:
             
             Твой ответ:"""
             
-            response = openai.ChatCompletion.create(
+            answer = self.client.chat(
                 model="gpt-3.5-turbo",
                 messages=[
                     {"role": "system", "content": "Ты - эксперт по ценам на российских маркетплейсах. Отвечай только числом."},
                     {"role": "user", "content": prompt}
                 ],
                 temperature=0.3,
-                max_tokens=50
+                max_tokens=50,
+                timeout=self.request_timeout,
+                max_retries=self.max_retries
             )
             
-            answer = response.choices[0].message.content.strip()
-            
             numbers = re.findall(r'\d+', answer.replace(' ', ''))
             if numbers:
                 price = int(numbers[0])
@@ -141,6 +247,133 @@ class OpenAIPriceEstimator:
             print(f"[OPENAI] Ошибка при запросе к OpenAI: {e}")
             return None
     
+    def estimate_batch_with_openai(self, items: List[tuple]) -> List[Optional[int]]:
+        """Оценивает несколько товаров одним запросом к OpenAI.
+        
+        items - [(название, категория, состояние), ...]; возвращает цены
+        в том же порядке, None - для позиций, которые не удалось разобрать.
+        """
+        if not self.openai_available or not items:
+            return [None] * len(items)
+        
+        lines = "\n".join(
+            f"{i}. {item_name}, {category}, {condition}"
+            for i, (item_name, category, condition) in enumerate(items, 1)
+        )
+        
+        try:
+            prompt = f"""Ты - эксперт по ценам на российских маркетплейсах (Wildberries, OZON, Яндекс.Маркет).
+            
+            Оцени примерную стоимость каждого товара на российском рынке в рублях
+            с учетом реальных цен на маркетплейсах, состояния, бренда и модели.
+            
+            Товары (название, категория, состояние):
+            {lines}
+            
+            Ответь ТОЛЬКО JSON-массивом из {len(items)} целых чисел в том же порядке, без текста.
+            
+            Пример для трех товаров:
+            [7990, 119990, 34990]
+            
+            Твой ответ:"""
+            
+            answer = self.client.chat(
+                model="gpt-3.5-turbo",
+                messages=[
+                    {"role": "system", "content": "Ты - эксперт по ценам на российских маркетплейсах. Отвечай только JSON-массивом чисел."},
+                    {"role": "user", "content": prompt}
+                ],
+                temperature=0.3,
+                max_tokens=20 + 12 * len(items),
+                timeout=self.request_timeout,
+                max_retries=self.max_retries
+            )
+            return self.parse_batch_answer(answer, len(items))
+            
+        except Exception as e:
+            print(f"[OPENAI] Ошибка пакетного запроса к OpenAI: {e}")
+            return [None] * len(items)
+    
+    def parse_batch_answer(self, answer: str, count: int) -> List[Optional[int]]:
+        """Разбирает JSON-массив цен; некорректные элементы -> None"""
+        prices = [None] * count
+        match = re.search(r'\[.*\]', answer, re.S)
+        if not match:
+            print(f"[OPENAI] Ответ не содержит JSON-массив: {answer[:100]}")
+            return prices
+        
+        try:
+            values = json.loads(match.group(0))
+        except ValueError:
+            print(f"[OPENAI] Некорректный JSON в ответе: {answer[:100]}")
+            return prices
+        
+        for i, value in enumerate(values[:count]):
+            if isinstance(value, str):
+                digits = re.sub(r'\D', '', value)
+                value = int(digits) if digits else None
+            if isinstance(value, (int, float)) and not isinstance(value, bool) and value > 0:
+                prices[i] = int(value)
+        return prices
+    
+    def estimate_prices(self, items: List[tuple], batch_size: int = 20) -> List[int]:
+        """Оценивает список товаров [(название, категория, состояние), ...].
+        
+        Некэшированные позиции, в которых не уверена локальная модель, уходят
+        в OpenAI пачками по batch_size в одном запросе; неразобранные позиции
+        получают оценку без сети. Кэш сохраняется на диск один раз в конце.
+        """
+        prices = [None] * len(items)
+        pending = {}
+        
+        for i, (item_name, category, condition) in enumerate(items):
+            cached, _ = self.find_cached(item_name, category, condition)
+            if cached is not None:
+                prices[i] = cached["price"]
+            else:
+                cache_key = self.get_cache_key(item_name, category, condition)
+                pending.setdefault(cache_key, []).append(i)
+        
+        if not pending:
+            return prices
+        
+        resolved = {}
+        
+        # Первый проход - уверенные ответы локальной модели без API
+        keys = []
+        for key in pending:
+            item_name, category, condition = items[pending[key][0]]
+            local_price, confidence = self.local_model.predict(item_name, category, condition)
+            if local_price and confidence >= self.local_confidence:
+                resolved[key] = (self.round_to_marketplace_price(local_price), "local_model")
+            else:
+                keys.append(key)
+        
+        print(f"[PRICE] Пакетная оценка: {len(keys)} товаров через API, "
+              f"{len(resolved)} локально (из {len(items)})")
+        
+        for start in range(0, len(keys), batch_size):
+            batch_keys = keys[start:start + batch_size]
+            batch_items = [items[pending[key][0]] for key in batch_keys]
+            batch_prices = self.estimate_batch_with_openai(batch_items)
+            
+            for key, (item_name, category, condition), price in zip(batch_keys, batch_items, batch_prices):
+                if price:
+                    price = self.finalize_price(price, category, condition)
+                    resolved[key] = (price, "openai")
+                else:
+                    resolved[key] = self.offline_estimate(item_name, category, condition)
+        
+        for key, (price, source) in resolved.items():
+            item_name, category, condition = items[pending[key][0]]
+            self.save_to_cache(item_name, category, condition, price, source)
+            for i in pending[key]:
+                prices[i] = price
+        
+        self.save_cache()
+        
+        return prices
+    
     def estimate_price(self, item_name: str, category: str, condition: str) -> int:
         """Основная функция оценки цены"""
         print(f"\n[PRICE] Оценка: {item_name} ({category}, {condition})")
@@ -149,84 +382,144 @@ class OpenAIPriceEstimator:
         if cached_price is not None:
             return cached_price
         
+        return self.resolve_price(item_name, category, condition)
+    
+    def resolve_price(self, item_name: str, category: str, condition: str) -> int:
+        """Запрашивает цену, объединяя одновременные запросы одного товара.
+        
+        Первый вызывающий по ключу кэша делает запрос, остальные ждут его
+        результат вместо собственного обращения к API.
+        """
+        cache_key = self.get_cache_key(item_name, category, condition)
+        with self.inflight_lock:
+            future = self.inflight.get(cache_key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self.inflight[cache_key] = future
+        
+        if not leader:
+            print(f"[PRICE] Ожидаем уже идущий запрос: {item_name}")
+            return future.result()
+        
+        try:
+            # Предыдущий запрос мог завершиться, пока мы проверяли кэш
+            cached = self.price_cache.get(cache_key)
+            if cached is not None:
+                price = cached["price"]
+            else:
+                price = self.fetch_price(item_name, category, condition)
+            future.set_result(price)
+            return price
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.inflight_lock:
+                self.inflight.pop(cache_key, None)
+    
+    def fetch_price(self, item_name: str, category: str, condition: str) -> int:
+        """Запрашивает OpenAI (или локальную модель/fallback) и сохраняет итоговую цену в кэш"""
         price = None
         source = "cache"
         
-        if self.openai_available:
+        local_price, confidence = self.local_model.predict(item_name, category, condition)
+        if local_price and confidence >= self.local_confidence:
+            # Модель уверена - экономим запрос к API
+            price = self.round_to_marketplace_price(local_price)
+            source = "local_model"
+        elif self.openai_available:
             openai_price = self.estimate_with_openai(item_name, category, condition)
             if openai_price:
-                price = openai_price
+                price = self.finalize_price(openai_price, category, condition)
                 source = "openai"
         
         if price is None:
-            price = self.fallback_estimate(item_name, category, condition)
-            source = "fallback"
-        
-        if condition == "Б/у":
-            price = self.apply_condition_discount(price, category)
-        
-        price = self.round_to_marketplace_price(price)
+            price, source = self.offline_estimate(item_name, category, condition)
         
         self.save_to_cache(item_name, category, condition, price, source)
         
         print(f"[PRICE] Итоговая цена: {price:,} ₽ (источник: {source})".replace(",", " "))
         return price
     
-    def fallback_estimate(self, item_name: str, category: str, condition: str) -> int:
-        """Fallback оценка, если API не сработали"""
-        category_prices = {
-            "Электроника": 25000,
-            "Одежда и обувь": 5000,
-            "Бытовая техника": 20000,
-            "Автомобиль": 50000,
-            "Путешествия": 30000,
-            "Образование": 15000,
-            "Здоровье и спорт": 10000,
-            "Дом и ремонт": 15000,
-            "Хобби и развлечения": 12000,
-        }
-        
-        base_price = category_prices.get(category, 10000)
+    def finalize_price(self, price: int, category: str, condition: str) -> int:
+        """Скидка на состояние и маркетплейсное округление"""
+        if condition == "Б/у":
+            price = self.apply_condition_discount(price, category)
+        return self.round_to_marketplace_price(price)
+    
+    def offline_estimate(self, item_name: str, category: str, condition: str):
+        """Оценка без сети: локальная модель, если она достаточно уверена,
+        иначе fallback_estimate. Возвращает (итоговая цена, источник)."""
+        local_price, confidence = self.local_model.predict(item_name, category, condition)
+        if local_price and confidence >= self.local_fallback_confidence:
+            return self.round_to_marketplace_price(local_price), "local_model"
+        price = self.fallback_estimate(item_name, category, condition)
+        return self.finalize_price(price, category, condition), "fallback"
+    
+    def quick_estimate(self, item_name: str, category: str, condition: str) -> int:
+        """Мгновенная оценка без сети: кэш, локальная модель или fallback (в кэш не пишется)"""
+        cached_price = self.get_cached_price(item_name, category, condition)
+        if cached_price is not None:
+            return cached_price
+        return self.offline_estimate(item_name, category, condition)[0]
+    
+    def estimate_price_async(self, item_name: str, category: str, condition: str, callback=None):
+        """Неблокирующая оценка цены.
         
-        item_lower = item_name.lower()
+        Сразу возвращает (быстрая цена, Future): быстрая цена - из кэша или
+        fallback, Future завершается ценой от OpenAI. callback(price) вызывается
+        из рабочего потока, поэтому UI должен передавать результат в Tk через
+        root.after или очередь.
+        """
+        cached_price = self.get_cached_price(item_name, category, condition)
+        if cached_price is not None:
+            quick_price = cached_price
+        else:
+            quick_price = self.offline_estimate(item_name, category, condition)[0]
         
-        premium_brands = ["apple", "sony", "dyson", "bosch", "miele", "gucci", "louis vuitton"]
-        for brand in premium_brands:
-            if brand in item_lower:
-                base_price *= 2
-                break
+        cache_key = self.get_cache_key(item_name, category, condition)
+        if cached_price is not None or not self.openai_available:
+            future = Future()
+            future.set_result(quick_price)
+        else:
+            with self.inflight_lock:
+                future = self.inflight.get(cache_key)
+            if future is None:
+                if self.executor is None:
+                    self.executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                       thread_name_prefix="price-estimator")
+                future = self.executor.submit(self.resolve_price, item_name, category, condition)
         
-        budget_brands = ["xiaomi", "huawei", "poco", "realme", "bork", "polaris"]
-        for brand in budget_brands:
-            if brand in item_lower:
-                base_price *= 0.7
-                break
+        if callback:
+            def deliver(done):
+                try:
+                    callback(done.result())
+                except Exception as e:
+                    print(f"[PRICE] Ошибка фоновой оценки: {e}")
+                    callback(quick_price)
+            future.add_done_callback(deliver)
         
-        return int(base_price)
+        return quick_price, future
+    
+    def shutdown(self):
+        """Останавливает пул фоновых запросов и сбрасывает кэш на диск"""
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+        self.save_cache()
+    
+    def fallback_estimate(self, item_name: str, category: str, condition: str) -> int:
+        """Fallback оценка, если API не сработали"""
+        return self.pricing_rules.fallback_estimate(item_name, category)
+    
+    def fallback_estimate_many(self, item_names: List[str], categories: List[str]):
+        """Fallback оценка для массовой обработки (массив NumPy)"""
+        return self.pricing_rules.fallback_estimate_many(item_names, categories)
     
     def apply_condition_discount(self, price: int, category: str) -> int:
         """Применяет скидку на состояние Б/у"""
-        discounts = {
-            "Электроника": 0.4,
-            "Одежда и обувь": 0.3,
-            "Бытовая техника": 0.35,
-            "Автомобиль": 0.5,
-            "Дом и ремонт": 0.25,
-            "default": 0.3
-        }
-        
-        discount = discounts.get(category, discounts["default"])
-        discounted_price = int(price * (1 - discount))
-        
-        min_prices = {
-            "Электроника": 1000,
-            "Одежда и обувь": 500,
-            "Бытовая техника": 3000,
-            "default": 500
-        }
-        
-        min_price = min_prices.get(category, min_prices["default"])
-        return max(discounted_price, min_price)
+        return self.pricing_rules.condition_discount(price, category)
     
     def round_to_marketplace_price(self, price: int) -> int:
         """Округляет цену как на маркетплейсах"""
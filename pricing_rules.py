@@ -0,0 +1,113 @@
+"""
+Правила запасной оценки цены (fallback): базовые цены категорий, бренды,
+скидки на состояние Б/у.
+
+Значения по умолчанию - константы модуля; их можно переопределить в
+pricing_rules.json рядом с программой, например:
+
+    {"category_prices": {"Электроника": 30000}, "premium_brands": ["apple", "bang & olufsen"]}
+
+Словари дополняются, списки и числа заменяются целиком.
+"""
+import copy
+import re
+import numpy as np
+from persistence import load_json
+
+PRICING_RULES_FILE = "pricing_rules.json"
+
+DEFAULT_RULES = {
+    "category_prices": {
+        "Электроника": 25000,
+        "Одежда и обувь": 5000,
+        "Бытовая техника": 20000,
+        "Автомобиль": 50000,
+        "Путешествия": 30000,
+        "Образование": 15000,
+        "Здоровье и спорт": 10000,
+        "Дом и ремонт": 15000,
+        "Хобби и развлечения": 12000,
+    },
+    "default_category_price": 10000,
+    "premium_brands": ["apple", "sony", "dyson", "bosch", "miele", "gucci", "louis vuitton"],
+    "premium_multiplier": 2,
+    "budget_brands": ["xiaomi", "huawei", "poco", "realme", "bork", "polaris"],
+    "budget_multiplier": 0.7,
+    "condition_discounts": {
+        "Электроника": 0.4,
+        "Одежда и обувь": 0.3,
+        "Бытовая техника": 0.35,
+        "Автомобиль": 0.5,
+        "Дом и ремонт": 0.25,
+        "default": 0.3
+    },
+    "min_prices": {
+        "Электроника": 1000,
+        "Одежда и обувь": 500,
+        "Бытовая техника": 3000,
+        "default": 500
+    }
+}
+
+def compile_brands(brands):
+    """Одно регулярное выражение на список брендов (поиск подстроки, как раньше)"""
+    if not brands:
+        return None
+    # Длинные названия первыми, чтобы "louis vuitton" не перехватывалось короткими
+    ordered = sorted({brand.lower() for brand in brands}, key=len, reverse=True)
+    return re.compile("|".join(re.escape(brand) for brand in ordered))
+
+class PricingRules:
+    def __init__(self, overrides=None):
+        rules = copy.deepcopy(DEFAULT_RULES)
+        for key, value in (overrides or {}).items():
+            if isinstance(rules.get(key), dict) and isinstance(value, dict):
+                rules[key].update(value)
+            else:
+                rules[key] = value
+        self.rules = rules
+
+        self.category_prices = rules["category_prices"]
+        self.default_category_price = rules["default_category_price"]
+        self.premium_multiplier = rules["premium_multiplier"]
+        self.budget_multiplier = rules["budget_multiplier"]
+        self.premium_re = compile_brands(rules["premium_brands"])
+        self.budget_re = compile_brands(rules["budget_brands"])
+        self.condition_discounts = rules["condition_discounts"]
+        self.min_prices = rules["min_prices"]
+
+    @classmethod
+    def load(cls, path=PRICING_RULES_FILE):
+        """Правила по умолчанию с пользовательскими переопределениями из JSON"""
+        try:
+            overrides = load_json(path, {})
+        except Exception as e:
+            print(f"[PRICE] Ошибка чтения {path}: {e}")
+            overrides = {}
+        return cls(overrides)
+
+    def brand_multiplier(self, item_lower):
+        multiplier = 1
+        if self.premium_re and self.premium_re.search(item_lower):
+            multiplier *= self.premium_multiplier
+        if self.budget_re and self.budget_re.search(item_lower):
+            multiplier *= self.budget_multiplier
+        return multiplier
+
+    def fallback_estimate(self, item_name, category):
+        base_price = self.category_prices.get(category, self.default_category_price)
+        return int(base_price * self.brand_multiplier(item_name.lower()))
+
+    def fallback_estimate_many(self, item_names, categories):
+        """fallback_estimate для списков названий и категорий (массив int64)"""
+        return np.fromiter(
+            (self.fallback_estimate(item_name, category) for item_name, category in zip(item_names, categories)),
+            dtype=np.int64
+        )
+
+    def condition_discount(self, price, category):
+        """Цена с учетом скидки на состояние Б/у (не ниже минимальной для категории)"""
+        discount = self.condition_discounts.get(category, self.condition_discounts["default"])
+        discounted_price = int(price * (1 - discount))
+        min_price = self.min_prices.get(category, self.min_prices["default"])
+        return max(discounted_price, min_price)
@@ -0,0 +1,218 @@
+from datetime import datetime
+import numpy as np
+
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+def month_starts(first, last):
+    """Локальные начала месяцев (epoch) с месяца first по месяц last и их имена YYYY-MM"""
+    month = datetime.fromtimestamp(first).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    end = datetime.fromtimestamp(last)
+    starts, names = [], []
+    while month <= end:
+        starts.append(int(month.timestamp()))
+        names.append(month.strftime("%Y-%m"))
+        if month.month == 12:
+            month = month.replace(year=month.year + 1, month=1)
+        else:
+            month = month.replace(month=month.month + 1)
+    return np.array(starts, dtype=np.int64), names
+
+class PurchaseColumns:
+    """Колоночное зеркало истории покупок (массивы NumPy) для агрегатов"""
+
+    def __init__(self, purchases=None, capacity=64):
+        self.size = 0
+        self.capacity = max(capacity, len(purchases or []))
+
+        self.price = np.zeros(self.capacity, dtype=np.float64)
+        self.status = np.zeros(self.capacity, dtype=np.int16)
+        self.category = np.zeros(self.capacity, dtype=np.int32)
+        self.added_at = np.zeros(self.capacity, dtype=np.int64)
+        self.savings = np.zeros(self.capacity, dtype=np.float64)
+
+        # Строка <-> id покупки и сама покупка
+        self.ids = []
+        self.rows = {}
+        self.records = []
+
+        # Словари кодов: статусы и категории хранятся числами
+        self.statuses = ["cooling", "purchased"]
+        self.status_codes = {"cooling": 0, "purchased": 1}
+        self.categories = []
+        self.category_codes = {}
+
+        for purchase in purchases or []:
+            self.append(purchase)
+
+    def rebuild(self, purchases):
+        """Пересобирает колонки с нуля (после массовой замены списка)"""
+        self.__init__(purchases, self.capacity)
+
+    def _grow(self):
+        self.capacity *= 2
+        for column in ("price", "status", "category", "added_at", "savings"):
+            old = getattr(self, column)
+            new = np.zeros(self.capacity, dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, column, new)
+
+    def _code(self, value, names, codes):
+        if value not in codes:
+            codes[value] = len(names)
+            names.append(value)
+        return codes[value]
+
+    def _epoch(self, purchase):
+        if purchase.get("added_at_ts") is not None:
+            return purchase["added_at_ts"]
+        added_at = purchase.get("added_at")
+        if not added_at:
+            return 0
+        try:
+            return int(datetime.strptime(added_at, DATE_FORMAT).timestamp())
+        except (TypeError, ValueError):
+            return 0
+
+    def _fill_row(self, row, purchase):
+        self.price[row] = purchase.get("price", 0) or 0
+        self.status[row] = self._code(purchase.get("status", "cooling"), self.statuses, self.status_codes)
+        self.category[row] = self._code(purchase.get("category", "Другое"), self.categories, self.category_codes)
+        self.added_at[row] = self._epoch(purchase)
+        self.savings[row] = purchase.get("current_savings", 0) or 0
+
+    def append(self, purchase):
+        """Добавляет покупку в конец колонок"""
+        purchase_id = purchase.get("id")
+        if purchase_id in self.rows:
+            self.update(purchase)
+            return
+
+        if self.size == self.capacity:
+            self._grow()
+
+        row = self.size
+        self._fill_row(row, purchase)
+        self.ids.append(purchase_id)
+        self.records.append(purchase)
+        self.rows[purchase_id] = row
+        self.size += 1
+
+    def update(self, purchase):
+        """Обновляет строку покупки (или добавляет, если ее еще нет)"""
+        row = self.rows.get(purchase.get("id"))
+        if row is None:
+            self.append(purchase)
+        else:
+            self._fill_row(row, purchase)
+            self.records[row] = purchase
+
+    def get(self, purchase_id):
+        """Покупка по id (или None)"""
+        row = self.rows.get(purchase_id)
+        return None if row is None else self.records[row]
+
+    def remove(self, purchase_id):
+        """Удаляет покупку: последняя строка переезжает на место удаленной"""
+        row = self.rows.pop(purchase_id, None)
+        if row is None:
+            return False
+
+        last = self.size - 1
+        if row != last:
+            for column in (self.price, self.status, self.category, self.added_at, self.savings):
+                column[row] = column[last]
+            moved_id = self.ids[last]
+            self.ids[row] = moved_id
+            self.records[row] = self.records[last]
+            self.rows[moved_id] = row
+
+        self.ids.pop()
+        self.records.pop()
+        self.size -= 1
+        return True
+
+    def status_mask(self, status):
+        """Булева маска строк с указанным статусом"""
+        code = self.status_codes.get(status)
+        if code is None:
+            return np.zeros(self.size, dtype=bool)
+        return self.status[:self.size] == code
+
+    def count(self, status=None):
+        if status is None:
+            return self.size
+        return int(np.count_nonzero(self.status_mask(status)))
+
+    def total_price(self, status=None):
+        prices = self.price[:self.size]
+        if status is not None:
+            prices = prices[self.status_mask(status)]
+        return float(prices.sum())
+
+    def total_savings(self, status=None):
+        savings = self.savings[:self.size]
+        if status is not None:
+            savings = savings[self.status_mask(status)]
+        return float(savings.sum())
+
+    def _group(self, codes, names, mask):
+        """Количество и сумма цен по кодам (одним проходом bincount)"""
+        if mask is not None:
+            codes = codes[mask]
+            prices = self.price[:self.size][mask]
+        else:
+            prices = self.price[:self.size]
+
+        counts = np.bincount(codes, minlength=len(names))
+        sums = np.bincount(codes, weights=prices, minlength=len(names))
+        return {
+            names[code]: {"count": int(counts[code]), "total": float(sums[code])}
+            for code in np.flatnonzero(counts)
+        }
+
+    def totals_by_status(self):
+        return self._group(self.status[:self.size], self.statuses, None)
+
+    def totals_by_category(self, status=None):
+        mask = self.status_mask(status) if status is not None else None
+        return self._group(self.category[:self.size], self.categories, mask)
+
+    def top_categories(self, limit=3):
+        """Самые частые категории: [(категория, количество), ...]"""
+        counts = np.bincount(self.category[:self.size], minlength=len(self.categories))
+        order = np.argsort(-counts, kind="stable")[:limit]
+        return [(self.categories[code], int(counts[code])) for code in order if counts[code] > 0]
+
+    def totals_by_month(self, status=None):
+        """Сумма цен по месяцам добавления: {"2024-01": {"count", "total"}}"""
+        mask = self.added_at[:self.size] > 0
+        if status is not None:
+            mask &= self.status_mask(status)
+        if not mask.any():
+            return {}
+
+        # Месяц считаем по локальному времени, как и строки added_at. Смещение
+        # от UTC у каждой даты свое (летнее время), поэтому берем локальные
+        # границы месяцев и раскладываем по ним метки через searchsorted
+        timestamps = self.added_at[:self.size][mask]
+        starts, names = month_starts(int(timestamps.min()), int(timestamps.max()))
+        months = np.searchsorted(starts, timestamps, side="right") - 1
+
+        counts = np.bincount(months, minlength=len(names))
+        sums = np.bincount(months, weights=self.price[:self.size][mask], minlength=len(names))
+        return {
+            names[i]: {"count": int(counts[i]), "total": float(sums[i])}
+            for i in np.flatnonzero(counts)
+        }
+
+    def ids_with_status(self, status):
+        """id покупок с указанным статусом"""
+        return [self.ids[row] for row in np.flatnonzero(self.status_mask(status))]
+
+    def purchases_with_status(self, status, newest_first=True):
+        """Покупки с указанным статусом, отсортированные по дате добавления"""
+        rows = np.flatnonzero(self.status_mask(status))
+        order = np.argsort(self.added_at[rows], kind="stable")
+        if newest_first:
+            order = order[::-1]
+        return [self.records[row] for row in rows[order]]
@@ -0,0 +1,128 @@
+"""
+Шаблоны рекомендаций по охлаждению.
+
+Расчет (CoolingManager) отдает только данные; здесь они превращаются в
+блоки (стиль, значок, заголовок, значение), которые UI рисует напрямую,
+и при необходимости в Markdown-текст. Оба шага кэшируются.
+"""
+from functools import lru_cache
+
+TIPS = {
+    "cooling": (
+        "Используйте это время для поиска альтернатив",
+        "Проверьте, не появились ли акции",
+        "Убедитесь, что товар вам действительно нужен",
+        "Рассмотрите покупку аналогичного товара б/у",
+        "Сравните цены в разных магазинах"
+    ),
+    "immediate": (
+        "Убедитесь, что товар вам действительно нужен",
+        "Проверьте наличие акций и скидок",
+        "Сравните цены в других магазинах"
+    ),
+    "default": (
+        "Подождите неделю перед покупкой",
+        "Проверьте, действительно ли вам нужен этот товар",
+        "Ищите альтернативы и скидки"
+    )
+}
+
+FORBIDDEN_TEXT = ("Рекомендуем отказаться от этой покупки. Вы добавили эту категорию в список "
+                  "запрещенных, что говорит о желании контролировать подобные траты.")
+
+# Перед блоками этих стилей в Markdown ставится пустая строка
+SPACED_STYLES = ("price", "section", "total", "savings", "text")
+
+def format_money(value):
+    return f"{value:,} ₽".replace(",", " ")
+
+@lru_cache(maxsize=512)
+def build_blocks(kind, item_name, price, category, price_days=0, savings_days=0,
+                 total_days=0, purchase_date=None, daily_savings=0, days_to_save=0):
+    """Блоки рекомендации: кортеж (стиль, значок, заголовок, значение)"""
+    if kind == "forbidden":
+        return (
+            ("title", "❌", f"Категория '{category}' находится в вашем списке запрещенных покупок", ""),
+            ("text", "", "", FORBIDDEN_TEXT),
+        )
+
+    title = f"Анализ: {item_name}" if kind == "default" else f"Анализ завершен: {item_name}"
+    blocks = [
+        ("title", "🎯" if kind == "cooling" else "✅", title, ""),
+        ("price", "💰", "Цена:", format_money(price)),
+        ("category", "📁", "Категория:", category),
+    ]
+
+    if kind == "default":
+        blocks.append(("total", "⏱️", "Рекомендуемый период охлаждения:", f"{total_days} дней"))
+    elif kind == "immediate":
+        blocks.append(("section", "📊", "Рекомендации:", ""))
+        blocks.append(("bullet", "", "", "По цене: можно покупать сразу"))
+    else:
+        blocks.append(("section", "📊", "Рекомендации:", ""))
+        if price_days > 0:
+            blocks.append(("bullet", "", "", f"По цене: подумайте {price_days} дней"))
+        if savings_days > 0:
+            blocks.append(("bullet", "", "", f"По накоплениям: потребуется {savings_days} дней"))
+        blocks.append(("total", "⏱️", "Итоговый период охлаждения:", f"{total_days} дней"))
+        if purchase_date:
+            blocks.append(("date", "📅", "Можете купить:", purchase_date))
+        if daily_savings > 0:
+            blocks.append(("savings", "💵", "Накопления:", ""))
+            blocks.append(("bullet", "", "",
+                           f"При откладывании {format_money(daily_savings)}/день: {days_to_save} дней"))
+
+    blocks.append(("section", "💡", "Советы:", ""))
+    for number, tip in enumerate(TIPS[kind], 1):
+        blocks.append(("tip", "", f"{number}.", tip))
+    return tuple(blocks)
+
+def result_blocks(result):
+    """Блоки для результата calculate_cooling_period"""
+    return build_blocks(
+        result.get("kind", "default"),
+        result.get("item_name", ""),
+        result.get("price", 0),
+        result.get("category", ""),
+        result.get("cooling_days", 0),
+        result.get("savings_based_days", 0),
+        result.get("total_days", 0),
+        result.get("purchase_date"),
+        result.get("daily_savings", 0),
+        result.get("days_to_save", 0)
+    )
+
+@lru_cache(maxsize=512)
+def render_markdown(blocks, final_newline=False):
+    """Markdown-текст рекомендации (прежний формат поля message).
+
+    final_newline - прежнее сообщение об охлаждении заканчивалось переводом строки.
+    """
+    lines = []
+    for style, icon, label, value in blocks:
+        if style in SPACED_STYLES and lines:
+            lines.append("")
+        if style == "bullet":
+            lines.append(f"• {value}")
+        elif style in ("tip", "text"):
+            lines.append(f"{label} {value}".strip())
+        else:
+            lines.append(f"{icon} **{label}** {value}".rstrip() if value else f"{icon} **{label}**")
+    text = "\n".join(lines)
+    return text + "\n" if final_newline else text
+
+class CoolingResult(dict):
+    """Результат расчета охлаждения; текст message строится только по запросу"""
+
+    def blocks(self):
+        return result_blocks(self)
+
+    def __missing__(self, key):
+        if key == "message":
+            return render_markdown(self.blocks(), self.get("kind") == "cooling")
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        if key == "message" and not dict.__contains__(self, key):
+            return self["message"]
+        return dict.get(self, key, default)